@@ -7,59 +7,298 @@ License: see the LICENSE file.
 
 """
 
+import hmac
 import json
 import logging
 import os
-import threading
+import re
+import time
 
+from cluster import Cluster  # pylint: disable=import-error
 from flask import Flask, request
-from tvtime import TVTime  # pylint: disable=import-error
-from utils.config import Config  # pylint: disable=import-error
-from utils.logger import setup_logging  # pylint: disable=import-error
-from werkzeug.exceptions import BadRequest
+from guids import create_resolver  # pylint: disable=import-error
+from prewarm import Prewarmer  # pylint: disable=import-error
+from registry import (  # pylint: disable=import-error
+    TVTimeRegistry,
+    WatchedSync,
+    client_options,
+    create_browser_pool,
+    create_movie_cache,
+    create_state,
+    parse_users,
+)
+from scrobbler import (  # pylint: disable=import-error
+    BatchSettings,
+    OfflineSettings,
+    ScrobbleDispatcher,
+    ScrobbleJob,
+)
+from server import serve  # pylint: disable=import-error
+from utils.config import Config, ConfigWatcher  # pylint: disable=import-error
+from utils.dedup import DedupWindow  # pylint: disable=import-error
+from utils.journal import ScrobbleJournal  # pylint: disable=import-error
+from utils.logger import (  # pylint: disable=import-error
+    correlation,
+    new_correlation_id,
+    setup_logging,
+)
+from utils.metrics import (  # pylint: disable=import-error
+    CONTENT_TYPE,
+    IN_FLIGHT,
+    OFFLINE_BUFFER,
+    QUEUE_DEPTH,
+    REGISTRY,
+    STAGE_SECONDS,
+    TOKEN_AGE,
+    WEBHOOKS,
+)
+from utils.multipart import read_field  # pylint: disable=import-error
+from utils.profiler import StackSampler  # pylint: disable=import-error
+from utils.trace import SLOW_LOG, tracing  # pylint: disable=import-error
 from werkzeug.http import parse_options_header
 
-setup_logging()
-log = logging.getLogger(__name__)
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+SCROBBLE_EVENT = b'"media.scrobble"'
+# Playback events pre-warming the scrobble of their item, or cancelling the pre-warm
+PREWARM_EVENTS = ("media.play", "media.resume")
+CANCEL_EVENTS = ("media.stop",)
+PLAYBACK_EVENTS = tuple(f'"{event}"'.encode() for event in PREWARM_EVENTS + CANCEL_EVENTS)
+PLAIN_NAME = re.compile(r"[\w .@+-]*", re.ASCII)
+
 config = Config("config/config.yml")
 config.load()
+setup_logging(config.get_config_of("logging.format", "text"))
+log = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
-# Set log level from config
-log_level = config.get_config_of("logging.level", "INFO")
-app.logger.setLevel(getattr(logging, log_level.upper()))
-log.setLevel(getattr(logging, log_level.upper()))
+
+
+def apply_log_level() -> None:
+    """
+    Sets the log level and the slow request threshold from the configuration.
+    """
+    log_level = getattr(logging, config.get_config_of("logging.level", "INFO").upper())
+    app.logger.setLevel(log_level)
+    # Records below the level are dropped before being queued or formatted
+    logging.getLogger().setLevel(log_level)
+    SLOW_LOG.configure(
+        float(config.get_config_of("logging.slow_threshold", 1)),
+        int(config.get_config_of("logging.slow_keep", 100)),
+    )
+
+
+apply_log_level()
 
 
 class Webhook:  # pylint: disable=too-few-public-methods
     """
     Class representing a webhook for TVTime integration with Plex.
+
+    A single HTTP server is shared by every configured user, the TVTime client
+    matching an incoming event being looked up in the registry.
     """
 
-    def __init__(
-        self, plex_user: str, tvtime_username: str, tvtime_password: str
-    ):  # pylint: disable=too-many-arguments
-        self.tvtime = None
-        self.user = plex_user
-        self.username = tvtime_username
-        self.password = tvtime_password
+    registry = TVTimeRegistry()
+    state = create_state(config)
+    movie_cache = create_movie_cache(config, state)
+    browsers = create_browser_pool(config)
+    resolver = create_resolver(config)
+    dedup = DedupWindow(
+        window=float(config.get_config_of("dedup.window", 300)),
+        max_keys=int(config.get_config_of("dedup.max_keys", 10000)),
+        state=state,
+    )
+    cluster: Cluster = None
+    prewarmer: Prewarmer = None
+    dispatcher: ScrobbleDispatcher = None
+    watcher: ConfigWatcher = None
+    watched_sync: WatchedSync = None
+
+    def __init__(self, users: dict):
+        self.users = parse_users(users)
+
+    def login(self, registry: TVTimeRegistry) -> None:
+        """
+        Logs every configured user in, registering their clients in the given registry.
+
+        Args:
+            registry (TVTimeRegistry): The registry to register the clients in.
+        """
+        registry.login_all(
+            self.users,
+            max_workers=int(config.get_config_of("startup.login_workers", 4)),
+            **client_options(config, Webhook.movie_cache, Webhook.browsers, Webhook.state),
+        )
+
+    def prime_tokens(self) -> None:
+        """
+        Logs every configured user in once so their tokens are in the token cache,
+        from which the server processes then restore their clients without a browser.
+        """
+        log.info("Logging in %d user(s)...", len(self.users))
+        registry = TVTimeRegistry()
+        self.login(registry)
+        registry.close()
+        # The forked workers must not inherit the browsers of the master
+        Webhook.browsers.close()
+
+    def start(self) -> None:
+        """
+        Logs in every configured user and starts the scrobble workers,
+        replaying the scrobbles left over in the journal.
+
+        With a shared state, the accounts are split with the other replicas first,
+        the scrobbles of the accounts of other replicas being forwarded to them.
+        """
+        log.info("Starting TVTime integration for %d user(s)...", len(self.users))
+        self.login(Webhook.registry)
+        if Webhook.state is not None:
+            Webhook.cluster = Cluster(
+                Webhook.state,
+                users=lambda: list(Webhook.registry.clients()),
+                deliver=lambda plex_user, fields: Webhook.dispatcher.deliver(plex_user, fields),
+                lease_ttl=float(config.get_config_of("state.lease_ttl", 30)),
+                poll_interval=float(config.get_config_of("state.poll_interval", 0.5)),
+            )
+        Webhook.dispatcher = ScrobbleDispatcher(
+            Webhook.registry,
+            workers=int(config.get_config_of("queue.workers", 2)),
+            depth=int(config.get_config_of("queue.depth", 100)),
+            full_policy=config.get_config_of("queue.full_policy", "reject"),
+            block_timeout=float(config.get_config_of("queue.block_timeout", 2)),
+            journal=(
+                ScrobbleJournal(
+                    config.get_config_of("journal.path", "config/journal.db"),
+                    max_attempts=int(config.get_config_of("journal.max_attempts", 5)),
+                )
+                if config.get_config_of("journal.enabled", True)
+                else None
+            ),
+            batch=BatchSettings(
+                linger=float(config.get_config_of("queue.batch_linger", 0.5)),
+                size=int(config.get_config_of("queue.batch_size", 50)),
+                concurrency=int(config.get_config_of("queue.batch_concurrency", 4)),
+            ),
+            offline=OfflineSettings(
+                max_buffer=int(config.get_config_of("offline.max_buffer", 10000)),
+                retry_interval=float(config.get_config_of("offline.retry_interval", 5)),
+                max_retry_interval=float(config.get_config_of("offline.max_retry_interval", 300)),
+                flush_size=int(config.get_config_of("offline.flush_size", 50)),
+                max_auth_failures=int(config.get_config_of("offline.max_auth_failures", 5)),
+            ),
+            cluster=Webhook.cluster,
+        )
+        if Webhook.cluster is not None:
+            Webhook.cluster.start()
+        Webhook.dispatcher.replay()
+        if config.get_config_of("prewarm.enabled", True):
+            Webhook.prewarmer = Prewarmer(
+                Webhook.registry,
+                workers=int(config.get_config_of("prewarm.workers", 2)),
+                window=float(config.get_config_of("prewarm.window", 3600)),
+                max_pending=int(config.get_config_of("prewarm.max_pending", 100)),
+            )
+        resync = float(config.get_config_of("watched.resync_interval", 3600))
+        if config.get_config_of("watched.enabled", True) and resync > 0:
+            Webhook.watched_sync = WatchedSync(
+                Webhook.registry,
+                resync,
+                int(config.get_config_of("watched.page_size", 100)),
+                owns=Webhook.cluster.owns if Webhook.cluster is not None else None,
+            )
+            Webhook.watched_sync.start()
+        interval = float(config.get_config_of("reload.interval", 5))
+        if interval > 0:
+            Webhook.watcher = ConfigWatcher(config, interval, self.reload)
+            Webhook.watcher.start()
+        log.info("TVTime integration started for %d user(s) !", len(Webhook.registry))
+
+    def reload(self) -> None:
+        """
+        Applies a changed configuration: the log level, and the users added,
+        removed or whose credentials changed. The other users are left untouched.
+        """
+        apply_log_level()
+        self.users = parse_users(config.get_config_of("users"))
+        added, removed, retired = Webhook.registry.sync(
+            self.users,
+            max_workers=int(config.get_config_of("startup.login_workers", 4)),
+            **client_options(config, Webhook.movie_cache, Webhook.browsers, Webhook.state),
+        )
+        if Webhook.dispatcher is not None:
+            Webhook.dispatcher.sync(retired)
+        else:
+            for client in retired:
+                client.close()
+        if added or removed:
+            log.info(
+                "Configuration reloaded: %d user(s) logged in, %d removed", len(added), len(removed)
+            )
+
+    def stop(self, timeout: float = None) -> None:
+        """
+        Drains the in-flight scrobbles and persists the caches.
+
+        Args:
+            timeout (float): The maximum number of seconds to wait for each scrobble worker.
+        """
+        if Webhook.watcher is not None:
+            Webhook.watcher.stop()
+        if Webhook.cluster is not None:
+            # Stops taking forwarded scrobbles; the queued ones are drained below
+            Webhook.cluster.stop()
+        if Webhook.watched_sync is not None:
+            Webhook.watched_sync.stop()
+        if Webhook.prewarmer is not None:
+            Webhook.prewarmer.shutdown()
+        if Webhook.dispatcher is not None:
+            Webhook.dispatcher.shutdown(timeout)
+        Webhook.registry.close()
+        Webhook.browsers.close()
+        Webhook.resolver.close()
+        Webhook.movie_cache.save()
+        if Webhook.state is not None:
+            Webhook.state.close()
 
     def run(self):
         """
-        Runs the TVTime integration webhook.
+        Runs the TVTime integration webhook, with gunicorn unless the development server is configured.
         """
-        log.info("Starting TVTime integration...")
-        Webhook.tvtime = TVTime(
-            plex_user=self.user,
-            tvtime_username=self.username,
-            tvtime_password=self.password,
-            driver_location="/usr/local/bin/geckodriver",
-            browser_location="/usr/bin/firefox-esr",
+        host = config.get_config_of("server.host", "0.0.0.0")
+        port = int(config.get_config_of("server.port", 5000))
+        if config.get_config_of("server.mode", "production") == "development":
+            self.start()
+            try:
+                app.run(host=host, port=port, debug=False)
+            finally:
+                self.stop(timeout=float(config.get_config_of("server.graceful_timeout", 30)))
+            return
+
+        workers = int(config.get_config_of("server.workers", 1))
+        if workers > 1 and Webhook.state is None:
+            # Every worker would refresh the tokens and keep the recent scrobbles on its own
+            log.warning(
+                "Running 1 gunicorn worker instead of %d, several workers need state.enabled",
+                workers,
+            )
+            workers = 1
+        serve(
+            app,
+            self,
+            {
+                "bind": f"{host}:{port}",
+                "workers": workers,
+                "threads": int(config.get_config_of("server.threads", 8)),
+                "worker_class": "gthread",
+                "graceful_timeout": int(config.get_config_of("server.graceful_timeout", 30)),
+                "timeout": int(config.get_config_of("server.timeout", 60)),
+            },
         )
-        Webhook.tvtime.login()
-        log.info("TVTime integration started !")
-        app.run(host="0.0.0.0", port=5000, debug=False)
 
 
 class WebhookHandler:
@@ -88,63 +327,98 @@ class WebhookHandler:
             return None, None
 
     @staticmethod
-    def parse_form_data(pdict: dict):
+    def read_payload(pdict: dict):
         """
-        Parse form data from the given dictionary.
+        Reads the "payload" field of the multipart request body, skipping the thumbnail.
 
         Args:
-            pdict (dict): The dictionary containing the form data.
+            pdict (dict): The parameters of the content type, holding the boundary.
 
         Returns:
-            dict or None:   The parsed form data as a dictionary,
+            bytes or None:  The raw JSON payload,
             or None if there was an error parsing the data.
         """
-        if "boundary" in pdict:
-            pdict["boundary"] = pdict["boundary"].encode("utf-8")
+        boundary = pdict.get("boundary")
+        if not boundary:
+            log.error("Boundary not found in content type")
+            return None
         try:
-            form_data = request.form
-            return form_data.to_dict(flat=False)
-        except BadRequest as _:
+            payload = read_field(request.stream, boundary.encode("utf-8"), "payload")
+        except ValueError as _:
             log.error("Error parsing form data: %s", _)
             return None
+        if payload is None:
+            log.error("Payload not found in form data")
+        return payload
+
+    @staticmethod
+    def is_candidate(payload: bytes) -> bool:
+        """
+        Tells whether a raw payload may be a scrobble, or a playback event to pre-warm,
+        of a configured user, without decoding it.
+
+        The scan is conservative: a payload is only rejected if it cannot be one.
+
+        Args:
+            payload (bytes): The raw JSON payload.
+
+        Returns:
+            bool: False if the payload can be ignored, True if it has to be decoded.
+        """
+        if SCROBBLE_EVENT not in payload and not (
+            Webhook.prewarmer is not None and any(event in payload for event in PLAYBACK_EVENTS)
+        ):
+            return False
+        users = Webhook.registry.clients()
+        # Names that a JSON encoder could escape cannot be looked for as is
+        if not all(PLAIN_NAME.fullmatch(user) for user in users):
+            return True
+        payload = payload.lower()
+        return any(user.encode("ascii") in payload for user in users)
 
     @staticmethod
-    def process_payload(post_vars: dict):
+    def process_payload(payload: bytes):
         """
         Process the payload from the form data.
 
         Args:
-            post_vars (dict): The dictionary containing the form data.
+            payload (bytes): The raw JSON payload.
 
         Returns:
             dict or None: The decoded JSON payload if successful, None otherwise.
         """
-        if "payload" not in post_vars:
-            log.error("Payload not found in form data")
-            return None
-        payload = post_vars["payload"][0]
         try:
-            return json.loads(payload)
-        except json.JSONDecodeError as _:
+            webhook_data = json_loads(payload)
+        except ValueError as _:
             log.error("Error decoding JSON payload: %s", _)
             return None
+        if not isinstance(webhook_data, dict):
+            log.error("Invalid JSON payload")
+            return None
+        return webhook_data
 
     @staticmethod
     def handle_media(webhook_data: dict):  # pylint: disable=too-many-return-statements
         """
         Handles the media scrobble event received from the webhook.
 
+        The event is validated then queued, the TVTime calls being made by the
+        scrobble workers of the user's account. Playback events of the item pre-warm
+        its scrobble instead, or cancel the pre-warm when playback stops.
+
         Args:
             webhook_data (dict): The payload data received from the webhook.
 
         Returns:
             tuple: A tuple containing the response body and status code.
             The response body is an empty string ('') and the status code is 204
-            if the event is invalid, or 'OK' and the status code 200
-            if the event is valid and processed successfully.
+            if the event is invalid, 'Accepted' and the status code 202
+            if the event is valid and queued, or 'Queue full' and the status code 503
+            if the queue of the user's account has no room left.
         """
         event = webhook_data.get("event")
-        if event != "media.scrobble":
+        playback = Webhook.prewarmer is not None and event in PREWARM_EVENTS + CANCEL_EVENTS
+        if event != "media.scrobble" and not playback:
             return "", 204
 
         metadata = webhook_data.get("Metadata")
@@ -152,8 +426,8 @@ class WebhookHandler:
             log.error("Metadata not found in payload")
             return "", 204
 
-        plex_user = webhook_data.get("Account").get("title").lower()
-        if plex_user != Webhook.tvtime.user:
+        plex_user = ((webhook_data.get("Account") or {}).get("title") or "").lower()
+        if plex_user not in Webhook.registry:
             log.debug("[%s] User does not have any TVtime account configured", plex_user)
             return "", 204
 
@@ -166,31 +440,67 @@ class WebhookHandler:
             log.error("Media name not found in metadata")
             return "", 204
 
-        guids = metadata.get("Guid")
-        if not guids:
+        if media_type not in ("movie", "show"):
+            log.error("Invalid media type")
+            return "", 204
+
+        if not metadata.get("Guid") and not metadata.get("guid"):
             log.error("GUIDs not found in metadata")
             return "", 204
 
-        media_id = [
-            int(guid.get("id").split("tvdb://")[-1])
-            for guid in guids
-            if guid.get("id").startswith("tvdb://")
-        ][0]
+        media_id = Webhook.resolver.resolve(media_type, metadata)
+        if media_id is None:
+            log.warning("[%s] No TVDB ID found for %s", plex_user, media_name)
+            return "", 204
+        if playback:
+            return WebhookHandler.handle_playback(event, plex_user, media_type, media_id)
         log.debug(
             "[%s] Received a scrobble event for the %s : %s", plex_user, media_type, media_name
         )
 
-        if media_type == "movie":
-            movie_uuid = Webhook.tvtime.get_movie_uuid(movie_id=media_id)
-            if movie_uuid is not None:
-                Webhook.tvtime.watch_movie(movie_uuid=movie_uuid)
-        elif media_type == "show":
-            Webhook.tvtime.watch_episode(episode_id=media_id)
-        else:
-            log.error("Invalid media type")
+        dedup_key = (plex_user, media_type, media_id)
+        if Webhook.dedup.is_duplicate(dedup_key):
+            log.debug("[%s] Ignoring duplicate scrobble of %s", plex_user, media_name)
             return "", 204
 
-        return "OK", 200
+        job = ScrobbleJob(
+            plex_user=plex_user,
+            media_type=media_type,
+            media_id=media_id,
+            media_name=media_name,
+            prewarmed=(
+                Webhook.prewarmer is not None
+                and Webhook.prewarmer.claim(plex_user, media_type, media_id)
+            ),
+        )
+        if Webhook.dispatcher is None or not Webhook.dispatcher.submit(job):
+            Webhook.dedup.forget(dedup_key)
+            return "Queue full", 503
+
+        return "Accepted", 202
+
+    @staticmethod
+    def handle_playback(event: str, plex_user: str, media_type: str, media_id: int):
+        """
+        Pre-warms the scrobble of an item being played, or cancels its pre-warm.
+
+        Args:
+            event (str): The playback event, such as "media.play".
+            plex_user (str): The lowercased Plex user playing the item.
+            media_type (str): Either "movie" or "show".
+            media_id (int): The TVDB ID of the movie or the episode.
+
+        Returns:
+            tuple: 'Accepted' and the status code 202 if a pre-warm was scheduled,
+            an empty body and the status code 204 otherwise.
+        """
+        if event in CANCEL_EVENTS:
+            Webhook.prewarmer.cancel(plex_user, media_type, media_id)
+            return "", 204
+        if not Webhook.prewarmer.submit(plex_user, media_type, media_id):
+            return "", 204
+        log.debug("[%s] Pre-warming the %s %s", plex_user, media_type, media_id)
+        return "Accepted", 202
 
     @staticmethod
     @app.route("/tvtime/plex", methods=["POST"])
@@ -204,19 +514,55 @@ class WebhookHandler:
         Returns:
             A response indicating the result of handling the webhook data.
         """
-        content_type, pdict = WebhookHandler.parse_content_type()
-        if content_type is None or content_type != "multipart/form-data":
-            return "", 204
-
-        post_vars = WebhookHandler.parse_form_data(pdict)
-        if post_vars is None:
-            return "", 204
+        IN_FLIGHT.inc()
+        try:
+            with (
+                correlation(new_correlation_id()) as correlation_id,
+                tracing("webhook", correlation_id),
+            ):
+                body, status = WebhookHandler.handle_request()
+        finally:
+            IN_FLIGHT.inc(-1)
+        WEBHOOKS.inc(status=status)
+        return body, status
 
-        webhook_data = WebhookHandler.process_payload(post_vars)
-        if webhook_data is None:
-            return "", 204
+    @staticmethod
+    def handle_request():
+        """
+        Parses the webhook request and handles its payload, timing every stage.
 
-        return WebhookHandler.handle_media(webhook_data)
+        Returns:
+            tuple: A tuple containing the response body and status code.
+        """
+        with STAGE_SECONDS.time(stage="content_type") as span:
+            content_type, pdict = WebhookHandler.parse_content_type()
+            if content_type is None or content_type != "multipart/form-data":
+                span.outcome = "rejected"
+                return "", 204
+
+        with STAGE_SECONDS.time(stage="form") as span:
+            payload = WebhookHandler.read_payload(pdict)
+            if payload is None:
+                span.outcome = "failure"
+                return "", 204
+            if not WebhookHandler.is_candidate(payload):
+                span.outcome = "rejected"
+                return "", 204
+
+        with STAGE_SECONDS.time(stage="json") as span:
+            webhook_data = WebhookHandler.process_payload(payload)
+            if webhook_data is None:
+                span.outcome = "failure"
+                return "", 204
+
+        # Only configured users are used as labels, to bound the number of series
+        plex_user = ((webhook_data.get("Account") or {}).get("title") or "").lower()
+        if plex_user not in Webhook.registry:
+            plex_user = ""
+        with STAGE_SECONDS.time(stage="handle_media", user=plex_user) as span:
+            body, status = WebhookHandler.handle_media(webhook_data)
+            span.outcome = str(status)
+        return body, status
 
     @staticmethod
     @app.route("/health", methods=["GET"])
@@ -232,31 +578,131 @@ class WebhookHandler:
             if not users:
                 return {"status": "unhealthy", "error": "No users configured"}, 503
 
-            if not hasattr(Webhook, "tvtime") or Webhook.tvtime is None:
+            clients = Webhook.registry.clients()
+            if not clients:
                 return {"status": "unhealthy", "error": "TVTime not initialized"}, 503
 
-            if not Webhook.tvtime.token:
+            accounts = {user: bool(client.token) for user, client in clients.items()}
+            if not any(accounts.values()):
                 return {"status": "unhealthy", "error": "TVTime not authenticated"}, 503
 
-            return {"status": "healthy", "service": "plex-tvtime-py"}, 200
+            return {
+                "status": "healthy",
+                "service": "plex-tvtime-py",
+                "accounts": accounts,
+                "queues": Webhook.dispatcher.stats() if Webhook.dispatcher else {},
+                "upstream": {user: client.stats() for user, client in clients.items()},
+                "movie_cache": Webhook.movie_cache.stats(),
+                "guids": Webhook.resolver.stats(),
+                "browsers": Webhook.browsers.stats(),
+                "dedup": Webhook.dedup.stats(),
+                "cluster": Webhook.cluster.stats() if Webhook.cluster else {},
+                "slow": SLOW_LOG.stats(),
+                "prewarm": Webhook.prewarmer.stats() if Webhook.prewarmer else {},
+            }, 200
 
         except Exception as e:
             log.error("Health check failed: %s", e)
             return {"status": "unhealthy", "error": str(e)}, 503
 
+    @staticmethod
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        """
+        Metrics endpoint exposing counters, gauges and latency histograms to Prometheus.
 
-if __name__ == "__main__":
-    USERS = config.get_config_of("users")
-    threads = []
-    for user, _ in USERS.items():
-        username: str = None
-        password: str = None
+        Returns:
+            The metrics in the Prometheus text format.
+        """
+        return REGISTRY.render(), 200, {"Content-Type": CONTENT_TYPE}
+
+    @staticmethod
+    def is_admin() -> bool:
+        """
+        Tells whether the request carries the admin token as a bearer token.
+
+        Returns:
+            bool: False if it does not, or if no admin token is configured.
+        """
+        token = str(config.get_config_of("admin.token", "") or "")
+        if not token:
+            return False
+        scheme, _, credentials = request.headers.get("Authorization", "").partition(" ")
+        return scheme.lower() == "bearer" and hmac.compare_digest(
+            credentials.strip().encode(), token.encode()
+        )
+
+    @staticmethod
+    @app.route("/admin/profile", methods=["POST"])
+    def profile():
+        """
+        Samples the call stacks of every thread of the worker for a window, such as
+        POST /admin/profile?seconds=10&interval=0.005, then returns them in the collapsed
+        stack format of flamegraph.pl and speedscope.
+
+        Returns:
+            The collapsed stacks, or an error if the request is not authorized,
+            the parameters are invalid or a profile is already running.
+        """
+        if not WebhookHandler.is_admin():
+            return "", 404
         try:
-            username = _["tvtime"]["username"]
-            password = _["tvtime"]["password"]
-        except KeyError as _:
-            log.error("Error parsing configuration : %s", _)
-            continue
-        t = threading.Thread(target=Webhook(user, username, password).run)
-        t.start()
-        threads.append(t)
+            seconds = float(request.args.get("seconds", 10))
+            interval = float(request.args.get("interval", 0.005))
+        except ValueError:
+            return "Invalid seconds or interval", 400
+        max_seconds = float(config.get_config_of("admin.max_profile_seconds", 60))
+        if not 0 < seconds <= max_seconds or not 0.001 <= interval <= 1:
+            return f"seconds must be within (0, {max_seconds:g}], interval within [0.001, 1]", 400
+        sampler = StackSampler(interval)
+        log.info("Profiling for %gs, one sample every %gs", seconds, interval)
+        if not sampler.run(seconds):
+            return "A profile is already running", 409
+        return (
+            sampler.collapsed(),
+            200,
+            {"Content-Type": "text/plain; charset=utf-8", "X-Samples": str(sampler.samples)},
+        )
+
+    @staticmethod
+    @app.route("/admin/slow", methods=["GET"])
+    def slow():
+        """
+        Lists the latest webhooks and scrobbles slower than logging.slow_threshold,
+        with the time of each of their stages.
+
+        Returns:
+            A JSON response with the threshold and the slow traces, or an error
+            if the request is not authorized.
+        """
+        if not WebhookHandler.is_admin():
+            return "", 404
+        return {**SLOW_LOG.stats(), "traces": SLOW_LOG.traces()}, 200
+
+
+def _token_ages() -> dict:
+    now = time.time()
+    return {
+        (user,): now - client.token_issued_at
+        for user, client in Webhook.registry.clients().items()
+        if client.token and client.token_issued_at
+    }
+
+
+TOKEN_AGE.set_function(_token_ages)
+QUEUE_DEPTH.set_function(
+    lambda: {
+        (user,): stats["depth"]
+        for user, stats in (Webhook.dispatcher.stats() if Webhook.dispatcher else {}).items()
+    }
+)
+OFFLINE_BUFFER.set_function(
+    lambda: {
+        (user,): stats["buffered"]
+        for user, stats in (Webhook.dispatcher.stats() if Webhook.dispatcher else {}).items()
+    }
+)
+
+
+if __name__ == "__main__":
+    Webhook(config.get_config_of("users")).run()
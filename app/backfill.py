@@ -0,0 +1,535 @@
+"""
+backfill.py
+
+This module provides a command line tool pushing a Plex watch history into TVTime,
+so that items watched while the webhook was down are synced too.
+
+The history is read from a Plex JSON/XML export or from a Plex server and
+streamed item by item, so exports of any size are handled in constant memory.
+
+Usage:
+    python3 backfill.py <plex_user> history.xml
+    python3 backfill.py <plex_user> http://plex:32400 --plex-token <token> --account-id 1
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from guids import GuidResolver, create_resolver  # pylint: disable=import-error
+from registry import (  # pylint: disable=import-error
+    client_options,
+    create_browser_pool,
+    create_movie_cache,
+    parse_users,
+    sync_watched,
+)
+from scrobbler import ScrobbleJob, process  # pylint: disable=import-error
+from tvtime import RETRYABLE_ERRORS, TVTime, TVTimeAuthError  # pylint: disable=import-error
+from utils.config import Config  # pylint: disable=import-error
+from utils.logger import logging as log  # pylint: disable=import-error
+from utils.logger import setup_logging  # pylint: disable=import-error
+from utils.ratelimit import TokenBucket  # pylint: disable=import-error
+
+HISTORY_PATH = "/status/sessions/history/all"
+METADATA_PATH = "/library/metadata"
+# The number of characters read looking for the array of items of a JSON export
+MAX_JSON_PREFIX = 1 << 20
+UNAVAILABLE_DELAY = 5.0
+# The number of times an item is retried when the account cannot log in, before stopping
+AUTH_RETRIES = 3
+ITEM_TAGS = ("Video",)
+
+
+def iter_json_items(
+    f, key: str = "Metadata", chunk_size: int = 65536, max_prefix: int = MAX_JSON_PREFIX
+) -> Iterator[dict]:
+    """
+    Streams the items of a Plex JSON export without loading the whole file.
+
+    The export is either a top-level array of items, or a Plex API response whose
+    items are in the array of the given key, such as {"MediaContainer": {"Metadata": [...]}}.
+
+    Args:
+        f: The file object to read from.
+        key (str): The key of the array of items in a Plex API response.
+        chunk_size (int): The number of characters read at a time.
+        max_prefix (int): The number of characters read at most before the array of items.
+
+    Raises:
+        ValueError: If no array of items was found within max_prefix characters.
+
+    Yields:
+        dict: The items of the export.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    marker = f'"{key}"'
+    while True:
+        stripped = buf.lstrip()
+        if stripped.startswith("["):
+            buf = stripped[1:]
+            break
+        index = buf.find(marker)
+        if index >= 0 and "[" in buf[index:]:
+            buf = buf[buf.index("[", index) + 1 :]
+            break
+        if len(buf) > max_prefix:
+            raise ValueError(f"No {key} array in the first {max_prefix} characters of the export")
+        chunk = f.read(chunk_size)
+        if not chunk:
+            raise ValueError(f"The export is neither an array of items nor has a {key} array")
+        buf += chunk
+
+    eof = False
+    while True:
+        buf = buf.lstrip(" \t\r\n,")
+        if buf.startswith("]"):
+            return
+        try:
+            item, end = decoder.raw_decode(buf)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buf += chunk
+            continue
+        buf = buf[end:]
+        yield item
+
+
+def iter_xml_items(source) -> Iterator[dict]:
+    """
+    Streams the items of a Plex XML document, clearing each element once parsed.
+
+    Args:
+        source: A file name or a file object to read from.
+
+    Yields:
+        dict: The attributes of every item, with its GUIDs under "Guid" as in JSON exports.
+    """
+    root = None
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if root is None and event == "start":
+            root = elem
+        if event != "end" or elem.tag not in ITEM_TAGS:
+            continue
+        item = dict(elem.attrib)
+        item["Guid"] = [{"id": guid.get("id")} for guid in elem.iter("Guid")]
+        yield item
+        elem.clear()
+        root.clear()
+
+
+def iter_plex_history(
+    url: str, token: str, account_id: str = None, page_size: int = 500
+) -> Iterator[dict]:
+    """
+    Streams the watch history of a Plex server, one page at a time.
+
+    Some servers leave the GUIDs out of the history, the GUIDs of such an item being
+    then read from its metadata, once per item.
+
+    Args:
+        url (str): The base URL of the Plex server.
+        token (str): The Plex token.
+        account_id (str): The Plex account whose history is fetched, all accounts if None.
+        page_size (int): The number of items fetched per request.
+
+    Yields:
+        dict: The items of the history, oldest first.
+    """
+    params = {"sort": "viewedAt:asc", "includeGuids": 1}
+    if account_id:
+        params["accountID"] = account_id
+    headers = {"X-Plex-Token": token, "Accept": "application/xml"}
+    start = 0
+    guids: dict[str, list[dict]] = {}
+    looked_up = missing = 0
+    with requests.Session() as session:
+        try:
+            while True:
+                headers["X-Plex-Container-Start"] = str(start)
+                headers["X-Plex-Container-Size"] = str(page_size)
+                r = session.get(
+                    f"{url.rstrip('/')}{HISTORY_PATH}",
+                    params=params,
+                    headers=headers,
+                    stream=True,
+                    timeout=(5, 60),
+                )
+                r.raise_for_status()
+                r.raw.decode_content = True
+                count = 0
+                for item in iter_xml_items(r.raw):
+                    count += 1
+                    rating_key = item.get("ratingKey")
+                    if not item["Guid"] and rating_key:
+                        if rating_key not in guids:
+                            looked_up += 1
+                            guids[rating_key] = fetch_guids(session, url, token, rating_key)
+                        item["Guid"] = guids[rating_key]
+                        missing += not item["Guid"]
+                    yield item
+                if count < page_size:
+                    return
+                start += count
+        finally:
+            if looked_up:
+                log.info(
+                    "Looked the GUIDs of %d history item(s) up, %d item(s) left without any",
+                    looked_up,
+                    missing,
+                )
+
+
+def fetch_guids(session: requests.Session, url: str, token: str, rating_key: str) -> list[dict]:
+    """
+    Reads the GUIDs of a library item from its metadata.
+
+    Args:
+        session (requests.Session): The session to send the request with.
+        url (str): The base URL of the Plex server.
+        token (str): The Plex token.
+        rating_key (str): The rating key of the item.
+
+    Returns:
+        list: The GUIDs of the item, as in the "Guid" of an item, empty if it has none
+        or could not be read, such as when it was removed from the library.
+    """
+    try:
+        r = session.get(
+            f"{url.rstrip('/')}{METADATA_PATH}/{rating_key}",
+            headers={"X-Plex-Token": token, "Accept": "application/xml"},
+            timeout=(5, 60),
+        )
+        r.raise_for_status()
+        items = list(iter_xml_items(io.BytesIO(r.content)))
+    except (requests.RequestException, ET.ParseError) as exc:
+        log.warning("Unable to read the metadata of item %s: %s", rating_key, exc)
+        return []
+    return items[0]["Guid"] if items else []
+
+
+def open_source(source: str, plex_token: str = None, account_id: str = None) -> Iterator[dict]:
+    """
+    Streams the items of a history source.
+
+    Args:
+        source (str): A Plex server URL, or the path of a JSON, JSON lines or XML export.
+        plex_token (str): The Plex token, for a Plex server URL.
+        account_id (str): The Plex account whose history is fetched, for a Plex server URL.
+
+    Yields:
+        dict: The items of the history.
+    """
+    if source.startswith(("http://", "https://")):
+        yield from iter_plex_history(source, plex_token, account_id)
+        return
+    if source.endswith(".xml"):
+        yield from iter_xml_items(source)
+        return
+    with open(source, encoding="utf-8") as f:
+        if source.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from iter_json_items(f)
+
+
+def to_job(plex_user: str, item: dict, resolver: GuidResolver = None) -> ScrobbleJob | None:
+    """
+    Maps a history item to a scrobble job, the same way the webhook maps its payload.
+
+    Args:
+        plex_user (str): The lowercased Plex account title.
+        item (dict): The history item.
+        resolver (GuidResolver): The resolver of the TVDB IDs, None to only use the TVDB GUIDs.
+
+    Returns:
+        ScrobbleJob: The job, or None if the item is not a movie or an episode with a TVDB ID.
+    """
+    kind = item.get("type") or item.get("librarySectionType")
+    if kind == "movie":
+        media_type, media_name = "movie", item.get("title")
+    elif kind in ("episode", "show"):
+        media_type, media_name = "show", item.get("grandparentTitle")
+    else:
+        return None
+    media_id = (resolver or GuidResolver()).resolve(media_type, item)
+    if media_id is None:
+        return None
+    return ScrobbleJob(
+        plex_user=plex_user, media_type=media_type, media_id=media_id, media_name=media_name
+    )
+
+
+class Checkpoint:
+    """
+    The position up to which a source has been backfilled, persisted to resume an interrupted run.
+
+    Args:
+        path (str): The checkpoint file, None disabling checkpoints.
+        source (str): The source being backfilled, a checkpoint of another source being ignored.
+    """
+
+    def __init__(self, path: str, source: str) -> None:
+        self.path = path
+        self.source = source
+        self.position = 0
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("source") == source:
+                self.position = saved.get("position", 0)
+
+    def save(self, position: int) -> None:
+        """
+        Saves the position, atomically.
+
+        Args:
+            position (int): The number of items of the source done.
+        """
+        self.position = position
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"source": self.source, "position": position}, f)
+        os.replace(tmp_path, self.path)
+
+
+class Backfill:  # pylint: disable=too-many-instance-attributes
+    """
+    Pushes history items to TVTime concurrently, at a bounded rate.
+
+    Items complete out of order, so the checkpoint only moves past an item once
+    every item before it is done, and a resumed run never skips an item. When the
+    account cannot log in, the run stops and the checkpoint stays before the item.
+
+    Args:
+        client (TVTime): The TVTime client of the account.
+        concurrency (int): The maximum number of items sent at the same time.
+        rate (float): The maximum number of items sent per second, 0 for no limit.
+        checkpoint (Checkpoint): The checkpoint to resume from and to update.
+        progress_interval (float): The number of seconds between progress reports.
+        resolver (GuidResolver): The resolver of the TVDB IDs of the items.
+    """
+
+    def __init__(
+        self,
+        client: TVTime,
+        concurrency: int = 4,
+        rate: float = 5,
+        checkpoint: Checkpoint = None,
+        progress_interval: float = 10,
+        resolver: GuidResolver = None,
+    ):  # pylint: disable=too-many-arguments
+        self.client = client
+        self.resolver = resolver or GuidResolver()
+        self.concurrency = max(1, concurrency)
+        self.limiter = TokenBucket(rate, burst=self.concurrency)
+        self.checkpoint = checkpoint or Checkpoint(None, "")
+        self.progress_interval = progress_interval
+        self.stats = {"read": 0, "skipped": 0, "succeeded": 0, "failed": 0, "unsent": 0}
+        self._done: set[int] = set()
+        self._watermark = self.checkpoint.position
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._started_at = 0.0
+        self._reported_at = 0.0
+
+    def run(self, items: Iterator[dict]) -> dict:
+        """
+        Pushes the items to TVTime, skipping those done by a previous run.
+
+        Args:
+            items (Iterator): The history items.
+
+        Returns:
+            dict: The number of items read, skipped, succeeded and failed, those left unsent
+            because the account could not log in, and the throughput.
+        """
+        self._started_at = self._reported_at = time.monotonic()
+        slots = threading.Semaphore(self.concurrency)
+        start = self.checkpoint.position
+        if start:
+            log.info("Resuming after %d item(s)", start)
+        try:
+            with ThreadPoolExecutor(
+                max_workers=self.concurrency, thread_name_prefix="backfill"
+            ) as ex:
+                for position, item in enumerate(items):
+                    if self._stopped.is_set():
+                        break
+                    if position < start:
+                        continue
+                    self.stats["read"] += 1
+                    job = to_job(self.client.user, item, self.resolver)
+                    if job is None:
+                        self._complete(position, None)
+                        continue
+                    slots.acquire()
+                    if self._stopped.is_set():
+                        # Stopped while waiting for a slot, the item is left for the next run
+                        break
+                    self.limiter.acquire()
+                    future = ex.submit(self._push, position, job)
+                    future.add_done_callback(lambda _: slots.release())
+        finally:
+            # Saved even when reading the history failed, the next run resuming from here
+            self.checkpoint.save(self._watermark)
+        return self._report(final=True)
+
+    def _push(self, position: int, job: ScrobbleJob) -> None:
+        succeeded = False
+        auth_failures = 0
+        while True:
+            try:
+                succeeded = process(self.client, job)
+            except TVTimeAuthError as exc:
+                auth_failures += 1
+                if auth_failures > AUTH_RETRIES:
+                    # The rest of the history would fail the same way: stop, resuming from here
+                    log.error(
+                        "[%s] Stopping the backfill, unable to log in: %s", job.plex_user, exc
+                    )
+                    with self._lock:
+                        self.stats["unsent"] += 1
+                    self._stopped.set()
+                    return
+                log.warning("[%s] %s", job.plex_user, exc)
+                time.sleep(UNAVAILABLE_DELAY * auth_failures)
+                continue
+            except RETRYABLE_ERRORS as exc:
+                # TVTime is unavailable, wait for it rather than failing the rest of the history
+                log.warning("[%s] %s", job.plex_user, exc)
+                time.sleep(max(getattr(exc, "retry_after", 0.0), UNAVAILABLE_DELAY))
+                continue
+            except Exception as _:  # pylint: disable=broad-except
+                log.error("[%s] Error while backfilling %s: %s", job.plex_user, job.media_name, _)
+            break
+        self._complete(position, succeeded)
+
+    def _complete(self, position: int, succeeded: bool | None) -> None:
+        with self._lock:
+            if succeeded is None:
+                self.stats["skipped"] += 1
+            elif succeeded:
+                self.stats["succeeded"] += 1
+            else:
+                self.stats["failed"] += 1
+            self._done.add(position)
+            advanced = False
+            while self._watermark in self._done:
+                self._done.remove(self._watermark)
+                self._watermark += 1
+                advanced = True
+            report = time.monotonic() - self._reported_at >= self.progress_interval
+            if report:
+                self._reported_at = time.monotonic()
+            if advanced and report:
+                self.checkpoint.save(self._watermark)
+        if report:
+            self._report()
+
+    def _report(self, final: bool = False) -> dict:
+        elapsed = max(time.monotonic() - self._started_at, 1e-9)
+        with self._lock:
+            stats = dict(self.stats)
+        done = stats["skipped"] + stats["succeeded"] + stats["failed"]
+        stats["elapsed"] = round(elapsed, 1)
+        stats["items_per_second"] = round(done / elapsed, 2)
+        log.info(
+            "%s %d item(s) done (%d succeeded, %d failed, %d skipped, %d unsent) in %.1fs, "
+            "%.2f item(s)/s",
+            "Backfill finished:" if final else "Backfill progress:",
+            done,
+            stats["succeeded"],
+            stats["failed"],
+            stats["skipped"],
+            stats["unsent"],
+            elapsed,
+            stats["items_per_second"],
+        )
+        return stats
+
+
+def main(argv: list[str] = None) -> int:
+    """
+    Runs the backfill command.
+
+    Args:
+        argv (list): The command line arguments, defaulting to sys.argv.
+
+    Returns:
+        int: The exit status.
+    """
+    parser = argparse.ArgumentParser(description="Push a Plex watch history into TVTime.")
+    parser.add_argument("plex_user", help="The configured Plex user to backfill.")
+    parser.add_argument("source", help="A Plex server URL or a JSON/JSON lines/XML export.")
+    parser.add_argument("--plex-token", help="The Plex token, for a Plex server URL.")
+    parser.add_argument("--account-id", help="The Plex account ID, for a Plex server URL.")
+    parser.add_argument("--config", default="config/config.yml", help="The configuration file.")
+    parser.add_argument("--checkpoint", help="A file to save progress to and resume from.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Items sent at the same time.")
+    parser.add_argument("--rate", type=float, default=5, help="Items sent per second, 0 for any.")
+    parser.add_argument("--progress", type=float, default=10, help="Seconds between reports.")
+    args = parser.parse_args(argv)
+
+    config = Config(args.config)
+    config.load()
+    setup_logging(config.get_config_of("logging.format", "text"))
+    log.getLogger().setLevel(config.get_config_of("logging.level", "INFO").upper())
+
+    credentials = {
+        user.lower(): (username, password)
+        for user, username, password in parse_users(config.get_config_of("users"))
+    }
+    if args.plex_user.lower() not in credentials:
+        log.error("User %s has no TVTime account configured", args.plex_user)
+        return 1
+    username, password = credentials[args.plex_user.lower()]
+    movie_cache = create_movie_cache(config)
+    browser_pool = create_browser_pool(config)
+    resolver = create_resolver(config)
+    client = TVTime(
+        plex_user=args.plex_user.lower(),
+        tvtime_username=username,
+        tvtime_password=password,
+        **client_options(config, movie_cache, browser_pool),
+    )
+    client.login()
+    # Items TVTime already shows as watched are then skipped without a request
+    sync_watched(client, int(config.get_config_of("watched.page_size", 100)))
+
+    backfill = Backfill(
+        client,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        checkpoint=Checkpoint(args.checkpoint, args.source),
+        progress_interval=args.progress,
+        resolver=resolver,
+    )
+    try:
+        stats = backfill.run(open_source(args.source, args.plex_token, args.account_id))
+    finally:
+        client.close()
+        browser_pool.close()
+        resolver.close()
+        movie_cache.save()
+    return 1 if stats["failed"] or stats["unsent"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""
+cluster.py
+
+This module splits the TVTime accounts between the replicas of the webhook sharing a state
+backend. Each account is owned by a single replica at a time, through a lease it renews:
+the other replicas forward the scrobbles of the account to its queue in the shared state,
+which its owner drains. When a replica stops or dies, its leases expire and the remaining
+replicas take its accounts over.
+"""
+
+import json
+import math
+import os
+import socket
+import threading
+from collections.abc import Callable
+
+from utils.logger import logging as log  # pylint: disable=import-error
+from utils.state import StateBackend, StateError  # pylint: disable=import-error
+
+REPLICAS = "replicas"
+
+
+def lease_key(plex_user: str) -> str:
+    """
+    Returns the key of the lease of an account.
+    """
+    return f"lease:{plex_user}"
+
+
+def queue_name(plex_user: str) -> str:
+    """
+    Returns the name of the shared queue of an account.
+    """
+    return f"queue:{plex_user}"
+
+
+class Cluster:  # pylint: disable=too-many-instance-attributes
+    """
+    This class holds the leases of the accounts this replica owns and drains their queues.
+
+    Every lease_ttl / 3 seconds, the replica records itself as alive, renews its leases
+    and takes free leases until it owns its share of the accounts, the accounts divided
+    by the replicas alive. A replica owning more than its share, such as when another
+    replica starts, gives the extra leases up. The shared queues of the owned accounts
+    are polled every poll_interval seconds.
+
+    Args:
+        state (StateBackend): The shared state.
+        users (Callable): Returns the lowercased Plex users of the configured accounts.
+        deliver (Callable): Called with the Plex user and the fields of every scrobble
+            taken from the shared queue of an owned account.
+        lease_ttl (float): The number of seconds a lease lasts without being renewed.
+        poll_interval (float): The number of seconds between two polls of the shared queues.
+        batch (int): The maximum number of scrobbles taken from a queue at a time.
+        replica_id (str): The name of this replica, its host name and process ID if None.
+    """
+
+    def __init__(
+        self,
+        state: StateBackend,
+        users: Callable[[], list[str]],
+        deliver: Callable[[str, dict], None],
+        lease_ttl: float = 30,
+        poll_interval: float = 0.5,
+        batch: int = 50,
+        replica_id: str = None,
+    ) -> None:  # pylint: disable=too-many-arguments
+        self.state = state
+        self.users = users
+        self.deliver = deliver
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.batch = batch
+        self.replica_id = replica_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.owned: frozenset[str] = frozenset()
+        self.forwarded = 0
+        self.received = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._lease, name="cluster-leases", daemon=True),
+            threading.Thread(target=self._drain, name="cluster-queues", daemon=True),
+        ]
+
+    def owns(self, plex_user: str) -> bool:
+        """
+        Tells whether this replica owns an account.
+
+        Args:
+            plex_user (str): The lowercased Plex user of the account.
+
+        Returns:
+            bool: True if this replica holds the lease of the account.
+        """
+        return plex_user in self.owned
+
+    def forward(self, plex_user: str, fields: dict) -> bool:
+        """
+        Appends a scrobble to the shared queue of an account, for its owner to send.
+
+        Args:
+            plex_user (str): The lowercased Plex user of the account.
+            fields (dict): The fields of the scrobble, serializable to JSON.
+
+        Returns:
+            bool: True if the scrobble was queued, False if the shared state is unavailable.
+        """
+        try:
+            self.state.push(queue_name(plex_user), [json.dumps(fields)])
+        except StateError as exc:
+            log.error("[%s] Unable to forward the scrobble: %s", plex_user, exc)
+            return False
+        with self._lock:
+            self.forwarded += 1
+        return True
+
+    def start(self) -> None:
+        """
+        Takes the leases of this replica's share of the accounts, then keeps them in the background.
+        """
+        self.rebalance()
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops draining the queues and gives every lease up, for the other replicas to take over.
+        """
+        self._stopped.set()
+        for thread in self._threads:
+            if thread.is_alive():
+                thread.join()
+        for plex_user in self.owned:
+            try:
+                self.state.release(lease_key(plex_user), self.replica_id)
+            except StateError as exc:
+                log.warning("[%s] Unable to release the lease: %s", plex_user, exc)
+        self.owned = frozenset()
+
+    def stats(self) -> dict:
+        """
+        Returns the state of this replica.
+
+        Returns:
+            dict: The replica ID, the accounts it owns and the scrobbles forwarded and received.
+        """
+        with self._lock:
+            return {
+                "replica": self.replica_id,
+                "owned": sorted(self.owned),
+                "forwarded": self.forwarded,
+                "received": self.received,
+            }
+
+    def rebalance(self) -> None:
+        """
+        Renews the leases of this replica and takes or gives leases up to own its share.
+        """
+        try:
+            self.state.heartbeat(REPLICAS, self.replica_id, self.lease_ttl)
+            replicas = self.state.members(REPLICAS)
+            users = sorted(self.users())
+            share = math.ceil(len(users) / max(1, len(replicas)))
+            owned = set()
+            for plex_user in users:
+                if plex_user in self.owned and self._acquire(plex_user):
+                    owned.add(plex_user)
+            # Accounts are tried in an order of their own for each replica, so replicas
+            # starting together do not all race for the same leases
+            offset = replicas.index(self.replica_id) if self.replica_id in replicas else 0
+            for plex_user in users[offset:] + users[:offset]:
+                if len(owned) >= share:
+                    break
+                if plex_user not in owned and self._acquire(plex_user):
+                    owned.add(plex_user)
+            for plex_user in sorted(owned)[share:]:
+                self.state.release(lease_key(plex_user), self.replica_id)
+                owned.discard(plex_user)
+        except StateError as exc:
+            # The leases will expire, better stop sending than send twice
+            log.error("Unable to renew the account leases: %s", exc)
+            owned = set()
+        gained, lost = owned - self.owned, self.owned - owned
+        self.owned = frozenset(owned)
+        if gained or lost:
+            log.info(
+                "Replica %s now owns %d account(s): %s taken, %s given up",
+                self.replica_id,
+                len(owned),
+                ", ".join(sorted(gained)) or "none",
+                ", ".join(sorted(lost)) or "none",
+            )
+
+    def _acquire(self, plex_user: str) -> bool:
+        return self.state.acquire(lease_key(plex_user), self.replica_id, self.lease_ttl)
+
+    def _lease(self) -> None:
+        while not self._stopped.wait(self.lease_ttl / 3):
+            self.rebalance()
+
+    def _drain(self) -> None:
+        while not self._stopped.is_set():
+            drained = 0
+            for plex_user in self.owned:
+                try:
+                    values = self.state.pop(queue_name(plex_user), self.batch)
+                except StateError as exc:
+                    log.error("[%s] Unable to read the shared queue: %s", plex_user, exc)
+                    continue
+                for value in values:
+                    try:
+                        self.deliver(plex_user, json.loads(value))
+                    except Exception as exc:  # pylint: disable=broad-except
+                        log.error("[%s] Error delivering a forwarded scrobble: %s", plex_user, exc)
+                drained += len(values)
+            with self._lock:
+                self.received += drained
+            if not drained:
+                self._stopped.wait(self.poll_interval)
@@ -0,0 +1,223 @@
+"""
+guids.py
+
+This module resolves Plex items to the TVDB IDs TVTime knows them by, from any of their
+GUIDs: tvdb, tmdb, imdb or plex. Items without a TVDB GUID are looked up in a cross-reference
+table, learnt from the items that have one and precomputable from a dump of IDs.
+
+Usage: python3 guids.py <dump.csv> [--config config/config.yml]
+
+The dump is a CSV file with a "media_type" column ("movie" or "show"), a "tvdb" column
+and any of the "tmdb", "imdb" and "plex" columns, holding either bare IDs or full GUIDs.
+"""
+
+import argparse
+import csv
+import re
+import sys
+from collections.abc import Iterable, Iterator
+
+from utils.config import Config  # pylint: disable=import-error
+from utils.logger import logging as log  # pylint: disable=import-error
+from utils.logger import setup_logging  # pylint: disable=import-error
+from utils.xref import CrossReference  # pylint: disable=import-error
+
+SCHEMES = ("tmdb", "imdb", "plex")
+# The GUIDs of the legacy Plex agents, such as "com.plexapp.agents.imdb://tt0133093?lang=en"
+LEGACY_AGENTS = {"imdb": "imdb", "themoviedb": "tmdb", "thetvdb": "tvdb"}
+LEGACY_GUID = re.compile(r"com\.plexapp\.agents\.(\w+)://([^?]+)")
+# A TVDB GUID holds either an ID, or for the episodes of the legacy agent the ID of the
+# series followed by the season and episode numbers, such as "tvdb://12345/1/2"
+TVDB_VALUE = re.compile(r"(\d+)(/\d+/\d+)?")
+
+
+def normalize_guid(guid: str) -> str | None:
+    """
+    Normalizes a GUID, mapping those of the legacy Plex agents to the current schemes.
+
+    Args:
+        guid (str): The GUID, such as "tmdb://603" or "com.plexapp.agents.themoviedb://603?lang=en".
+
+    Returns:
+        str: The normalized GUID, or None if it is not one.
+    """
+    guid = (guid or "").strip()
+    if match := LEGACY_GUID.match(guid):
+        agent, value = match.groups()
+        return f"{LEGACY_AGENTS.get(agent, agent)}://{value}"
+    guid = guid.split("?", 1)[0]
+    return guid if "://" in guid else None
+
+
+def parse_guids(item: dict) -> tuple[int | None, list[str]]:
+    """
+    Reads the GUIDs of a Plex item.
+
+    Args:
+        item (dict): The item, with its GUIDs under "Guid", such as {"id": "tvdb://12345"},
+            and its Plex GUID under "guid".
+
+    Returns:
+        tuple: The TVDB ID of the item, None if it has none, and its other GUIDs,
+        the tmdb, imdb and plex ones first. The legacy "tvdb://series/season/episode"
+        GUIDs of episodes are among the others, their leading ID being the series' one.
+    """
+    tvdb_id = None
+    guids = []
+    entries = [entry.get("id") for entry in item.get("Guid") or [] if isinstance(entry, dict)]
+    for guid in map(normalize_guid, [*entries, item.get("guid")]):
+        if guid is None or guid in guids:
+            continue
+        if guid.startswith("tvdb://"):
+            match = TVDB_VALUE.fullmatch(guid[len("tvdb://") :])
+            if match is None:
+                log.error("Invalid TVDB ID in GUID %s", guid)
+            elif match.group(2) is None:
+                tvdb_id = tvdb_id or int(match.group(1))
+            else:
+                # The leading ID is the series' one, the episode is looked up in the table
+                guids.append(guid)
+            continue
+        guids.append(guid)
+    order = {scheme: i for i, scheme in enumerate(SCHEMES)}
+    guids.sort(key=lambda guid: order.get(guid.split("://", 1)[0], len(SCHEMES)))
+    return tvdb_id, guids
+
+
+class GuidResolver:
+    """
+    This class resolves Plex items to their TVDB IDs.
+
+    The TVDB GUID of an item is used when it has one, its other GUIDs being recorded
+    in the cross-reference table meanwhile. Otherwise its GUIDs are looked up in the table.
+
+    Args:
+        xref (CrossReference): The cross-reference table, None to only use the TVDB GUIDs.
+        learn (bool): Whether to record the GUIDs of the items that have a TVDB GUID.
+    """
+
+    def __init__(self, xref: CrossReference = None, learn: bool = True) -> None:
+        self.xref = xref
+        self.learn = learn
+
+    def resolve(self, media_type: str, item: dict) -> int | None:
+        """
+        Resolves a Plex item to its TVDB ID.
+
+        Args:
+            media_type (str): Either "movie" or "show".
+            item (dict): The Plex item, such as the "Metadata" of a webhook payload.
+
+        Returns:
+            int: The TVDB ID of the item, or None if it cannot be resolved.
+        """
+        tvdb_id, guids = parse_guids(item)
+        if self.xref is None or not guids:
+            return tvdb_id
+        if tvdb_id is not None:
+            if self.learn:
+                self.xref.learn(media_type, tvdb_id, guids)
+            return tvdb_id
+        tvdb_id = self.xref.lookup(media_type, guids)
+        if tvdb_id is not None:
+            log.debug("Resolved %s to the TVDB ID %s", guids[0], tvdb_id)
+        return tvdb_id
+
+    def stats(self) -> dict:
+        """
+        Returns the statistics of the cross-reference table.
+
+        Returns:
+            dict: The number of hits, misses and learnt cross-references, empty without a table.
+        """
+        return self.xref.stats() if self.xref is not None else {}
+
+    def close(self) -> None:
+        """
+        Closes the cross-reference table.
+        """
+        if self.xref is not None:
+            self.xref.close()
+
+
+def create_resolver(config: Config) -> GuidResolver:
+    """
+    Creates the GUID resolver described by the "guids" section of the configuration.
+
+    Args:
+        config (Config): The loaded configuration.
+
+    Returns:
+        GuidResolver: The GUID resolver.
+    """
+    path = config.get_config_of("guids.path", "config/guids.db")
+    return GuidResolver(
+        CrossReference(path) if path else None,
+        learn=bool(config.get_config_of("guids.learn", True)),
+    )
+
+
+def read_dump(rows: Iterable[dict]) -> Iterator[tuple[str, str, int]]:
+    """
+    Reads the cross-references of a dump of IDs.
+
+    Args:
+        rows (Iterable): The rows of the dump, each with a "media_type", a "tvdb" ID
+            and any of the tmdb, imdb and plex IDs.
+
+    Yields:
+        tuple: The media type, GUID and TVDB ID of every cross-reference.
+    """
+    for row in rows:
+        media_type = (row.get("media_type") or "").strip().lower()
+        if media_type in ("episode", "series", "tv"):
+            media_type = "show"
+        try:
+            tvdb_id = int((row.get("tvdb") or "").strip().removeprefix("tvdb://"))
+        except ValueError:
+            continue
+        if media_type not in ("movie", "show"):
+            continue
+        for scheme in SCHEMES:
+            value = (row.get(scheme) or "").strip()
+            if not value:
+                continue
+            if "://" not in value:
+                kind = "movie" if media_type == "movie" else "episode"
+                value = f"plex://{kind}/{value}" if scheme == "plex" else f"{scheme}://{value}"
+            guid = normalize_guid(value)
+            if guid is not None:
+                yield media_type, guid, tvdb_id
+
+
+def main(argv: list[str] = None) -> int:
+    """
+    Loads a dump of IDs into the cross-reference table.
+
+    Returns:
+        int: The exit code.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=2)[1])
+    parser.add_argument("dump", help="A CSV file of IDs.")
+    parser.add_argument("--config", default="config/config.yml", help="The configuration file.")
+    args = parser.parse_args(argv)
+
+    config = Config(args.config)
+    config.load()
+    setup_logging(config.get_config_of("logging.format", "text"))
+    path = config.get_config_of("guids.path", "config/guids.db")
+    if not path:
+        log.error("The cross-reference table is disabled by guids.path")
+        return 1
+    xref = CrossReference(path)
+    try:
+        with open(args.dump, newline="", encoding="utf-8") as f:
+            count = xref.load(read_dump(csv.DictReader(f)))
+    finally:
+        xref.close()
+    log.info("Loaded %d cross-reference(s) into %s", count, path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
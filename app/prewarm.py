@@ -0,0 +1,183 @@
+"""
+prewarm.py
+
+This module pre-warms what the scrobble of an item will need while it is being played:
+the token of the account is checked, and renewed if needed, and a movie's UUID is looked
+up and cached, so the scrobble sent when the item is watched is a single request to TVTime.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from registry import TVTimeRegistry  # pylint: disable=import-error
+from utils.logger import correlation, current_correlation_id  # pylint: disable=import-error
+from utils.logger import logging as log  # pylint: disable=import-error
+from utils.metrics import PREWARMS, STAGE_SECONDS  # pylint: disable=import-error
+
+PrewarmKey = tuple[str, str, int]
+# The maximum number of items remembered, the oldest being forgotten first
+MAX_ITEMS = 10000
+
+
+class Prewarmer:  # pylint: disable=too-many-instance-attributes
+    """
+    This class pre-warms items in background threads, once per account and item within a window.
+
+    A pre-warm waiting for a thread is cancelled when playback stops, or when the scrobble of
+    the item arrives first, the scrobble doing the work itself then. A pre-warm already
+    running is left to finish, its results being cached anyway.
+
+    Args:
+        registry (TVTimeRegistry): The registry of the TVTime clients.
+        workers (int): The number of threads pre-warming items.
+        window (float): The number of seconds during which an item is pre-warmed once per account.
+        max_pending (int): The maximum number of pre-warms waiting for a thread, newer
+            ones being dropped.
+    """
+
+    def __init__(
+        self,
+        registry: TVTimeRegistry,
+        workers: int = 2,
+        window: float = 3600,
+        max_pending: int = 100,
+    ) -> None:
+        self.registry = registry
+        self.window = window
+        self.max_pending = max_pending
+        self.counts = dict.fromkeys(
+            ("done", "failed", "cancelled", "deduplicated", "dropped", "claimed"), 0
+        )
+        self._items: OrderedDict[PrewarmKey, tuple[Future, float]] = OrderedDict()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prewarm")
+
+    def submit(self, plex_user: str, media_type: str, media_id: int) -> bool:
+        """
+        Pre-warms an item being played, unless it already was within the window.
+
+        Args:
+            plex_user (str): The lowercased Plex user playing the item.
+            media_type (str): Either "movie" or "show".
+            media_id (int): The TVDB ID of the movie or the episode.
+
+        Returns:
+            bool: True if a pre-warm was scheduled, False otherwise.
+        """
+        key = (plex_user, media_type, media_id)
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            entry = self._items.get(key)
+            if entry is not None and not _failed(entry[0]):
+                self._count(plex_user, "deduplicated")
+                return False
+            if self._pending >= self.max_pending:
+                self._count(plex_user, "dropped")
+                return False
+            self._pending += 1
+            future = self._executor.submit(self._prewarm, key, current_correlation_id())
+            self._items[key] = (future, now)
+        future.add_done_callback(lambda f: self._done(key, f))
+        return True
+
+    def cancel(self, plex_user: str, media_type: str, media_id: int) -> bool:
+        """
+        Cancels the pre-warm of an item if it is still waiting for a thread.
+
+        Args:
+            plex_user (str): The lowercased Plex user who played the item.
+            media_type (str): Either "movie" or "show".
+            media_id (int): The TVDB ID of the movie or the episode.
+
+        Returns:
+            bool: True if a pre-warm was cancelled, False otherwise.
+        """
+        with self._lock:
+            entry = self._items.get((plex_user, media_type, media_id))
+        return entry is not None and entry[0].cancel()
+
+    def claim(self, plex_user: str, media_type: str, media_id: int) -> bool:
+        """
+        Tells the scrobble of an item whether it was pre-warmed, forgetting the item, and
+        cancels its pre-warm if it is still waiting for a thread.
+
+        Args:
+            plex_user (str): The lowercased Plex user who watched the item.
+            media_type (str): Either "movie" or "show".
+            media_id (int): The TVDB ID of the movie or the episode.
+
+        Returns:
+            bool: True if the item was pre-warmed successfully, False otherwise.
+        """
+        with self._lock:
+            entry = self._items.pop((plex_user, media_type, media_id), None)
+        if entry is None:
+            return False
+        future = entry[0]
+        if future.cancel() or not future.done() or _failed(future):
+            return False
+        with self._lock:
+            self._count(plex_user, "claimed")
+        return True
+
+    def shutdown(self) -> None:
+        """
+        Cancels the pre-warms waiting for a thread and waits for the running ones.
+        """
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self) -> dict:
+        """
+        Returns the pre-warms by outcome.
+
+        Returns:
+            dict: The number of items remembered, pre-warms waiting for a thread, and
+            pre-warms by outcome, "claimed" counting the scrobbles that found their item pre-warmed.
+        """
+        with self._lock:
+            return {"items": len(self._items), "pending": self._pending, **self.counts}
+
+    def _prewarm(self, key: PrewarmKey, correlation_id: str) -> None:
+        plex_user, media_type, media_id = key
+        with self._lock:
+            self._pending -= 1
+        client = self.registry.get(plex_user)
+        if client is None:
+            return
+        with correlation(correlation_id), STAGE_SECONDS.time(stage="prewarm", user=plex_user):
+            client.ensure_token()
+            if media_type == "movie":
+                client.get_movie_uuid(movie_id=media_id)
+            log.debug("[%s] Pre-warmed the %s %s", plex_user, media_type, media_id)
+
+    def _done(self, key: PrewarmKey, future: Future) -> None:
+        with self._lock:
+            if future.cancelled():
+                # Cancelled before a thread picked it up
+                self._pending -= 1
+                self._count(key[0], "cancelled")
+            elif future.exception() is not None:
+                self._count(key[0], "failed")
+            else:
+                self._count(key[0], "done")
+        if _failed(future) and not future.cancelled():
+            log.debug("[%s] Unable to pre-warm %s: %s", key[0], key[2], future.exception())
+
+    def _count(self, plex_user: str, outcome: str) -> None:
+        self.counts[outcome] += 1
+        PREWARMS.inc(user=plex_user, outcome=outcome)
+
+    def _evict(self, now: float) -> None:
+        while self._items:
+            key, (_, submitted_at) = next(iter(self._items.items()))
+            if now - submitted_at < self.window and len(self._items) <= MAX_ITEMS:
+                return
+            del self._items[key]
+
+
+def _failed(future: Future) -> bool:
+    return future.cancelled() or (future.done() and future.exception() is not None)
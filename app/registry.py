@@ -0,0 +1,374 @@
+"""
+registry.py
+
+This module provides a thread-safe registry mapping Plex users to their TVTime clients.
+It also takes care of logging every configured user in, in parallel, at startup.
+"""
+
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import httpx
+from tvtime import API_URL, AUTH_URL, RETRYABLE_ERRORS, TVTime  # pylint: disable=import-error
+from utils.aio import shared_loop  # pylint: disable=import-error
+from utils.browser import BrowserPool  # pylint: disable=import-error
+from utils.cache import TTLCache  # pylint: disable=import-error
+from utils.config import Config  # pylint: disable=import-error
+from utils.http import HttpSettings, create_client  # pylint: disable=import-error
+from utils.logger import logging as log  # pylint: disable=import-error
+from utils.state import StateBackend, open_state  # pylint: disable=import-error
+from utils.token_cache import TokenCache  # pylint: disable=import-error
+
+DRIVER_LOCATION = "/usr/local/bin/geckodriver"
+BROWSER_LOCATION = "/usr/bin/firefox-esr"
+# The maximum number of seconds before the mirror of a new account is first synced
+CHECK_INTERVAL = 60
+
+
+def parse_users(users: dict) -> list[tuple[str, str, str]]:
+    """
+    Parses the "users" section of the configuration.
+
+    Args:
+        users (dict): The "users" section, mapping Plex users to their TVTime credentials.
+
+    Returns:
+        list: A list of (plex_user, tvtime_username, tvtime_password) tuples,
+        users with invalid settings being logged and skipped.
+    """
+    parsed = []
+    for user, _ in (users or {}).items():
+        try:
+            parsed.append((user, _["tvtime"]["username"], _["tvtime"]["password"]))
+        except (KeyError, TypeError) as exc:
+            log.error("Error parsing configuration of %s : %s", user, exc)
+    return parsed
+
+
+def client_options(
+    config: Config,
+    movie_cache: TTLCache = None,
+    browser_pool: BrowserPool = None,
+    state: StateBackend = None,
+) -> dict:
+    """
+    Builds the keyword arguments shared by every TVTime client from the configuration.
+
+    Args:
+        config (Config): The loaded configuration.
+        movie_cache (TTLCache): The movie UUID cache shared by every client, if any.
+        browser_pool (BrowserPool): The browser pool shared by every client, if any.
+        state (StateBackend): The state shared by the replicas, storing the tokens, if any.
+
+    Returns:
+        dict: The keyword arguments of the TVTime constructor, apart from the credentials.
+    """
+    return {
+        "driver_location": config.get_config_of("browser.driver_location", DRIVER_LOCATION),
+        "browser_location": config.get_config_of("browser.browser_location", BROWSER_LOCATION),
+        "browser_pool": browser_pool,
+        "token_cache": TokenCache(config.get_config_of("auth.token_cache", "config/tokens"), state),
+        "refresh_margin": int(config.get_config_of("auth.refresh_margin", 300)),
+        "relogin_timeout": float(config.get_config_of("auth.relogin_timeout", 60)),
+        "http_settings": HttpSettings.from_config(config.get_config_of("http")),
+        "movie_cache": movie_cache,
+        "rate_limits": config.get_config_of("limits"),
+        "failure_threshold": int(config.get_config_of("breaker.failure_threshold", 5)),
+        "reset_timeout": float(config.get_config_of("breaker.reset_timeout", 30)),
+        "api_url": config.get_config_of("tvtime.api_url", API_URL),
+        "auth_url": config.get_config_of("tvtime.auth_url", AUTH_URL),
+        "watched_path": (
+            config.get_config_of("watched.path", "config/watched")
+            if config.get_config_of("watched.enabled", True)
+            else None
+        ),
+    }
+
+
+def create_browser_pool(config: Config) -> BrowserPool:
+    """
+    Creates the browser pool described by the "browser" section of the configuration.
+
+    Args:
+        config (Config): The loaded configuration.
+
+    Returns:
+        BrowserPool: The browser pool, starting its browsers on first use.
+    """
+    return BrowserPool(
+        driver_location=config.get_config_of("browser.driver_location", DRIVER_LOCATION),
+        browser_location=config.get_config_of("browser.browser_location", BROWSER_LOCATION),
+        size=int(config.get_config_of("browser.pool_size", 1)),
+        max_uses=int(config.get_config_of("browser.max_uses", 20)),
+        idle_timeout=float(config.get_config_of("browser.idle_timeout", 300)),
+        load_timeout=float(config.get_config_of("browser.load_timeout", 30)),
+        poll_interval=float(config.get_config_of("browser.poll_interval", 0.25)),
+    )
+
+
+def create_movie_cache(config: Config, state: StateBackend = None) -> TTLCache:
+    """
+    Creates the movie UUID cache described by the "cache.movies" section of the configuration.
+
+    Args:
+        config (Config): The loaded configuration.
+        state (StateBackend): The state shared by the replicas, if any.
+
+    Returns:
+        TTLCache: The movie UUID cache.
+    """
+    return TTLCache(
+        max_size=int(config.get_config_of("cache.movies.max_size", 10000)),
+        ttl=float(config.get_config_of("cache.movies.ttl", 30 * 24 * 3600)),
+        negative_ttl=float(config.get_config_of("cache.movies.negative_ttl", 3600)),
+        path=config.get_config_of("cache.movies.path", "config/movies.json"),
+        state=state,
+        namespace="movie:",
+    )
+
+
+def create_state(config: Config) -> StateBackend | None:
+    """
+    Opens the shared state described by the "state" section of the configuration.
+
+    Args:
+        config (Config): The loaded configuration.
+
+    Returns:
+        StateBackend: The shared state, or None if it is disabled.
+    """
+    if not config.get_config_of("state.enabled", False):
+        return None
+    return open_state(config.get_config_of("state.url", "sqlite:///config/state.db"))
+
+
+class TVTimeRegistry:
+    """
+    A registry mapping lowercased Plex account titles to their TVTime clients.
+
+    Lookups are plain dictionary reads, so resolving the client of an incoming
+    webhook is O(1) and does not need to take the lock. The clients logged in by
+    the registry share one HTTP client, multiplexing their requests over its connections.
+    """
+
+    def __init__(self) -> None:
+        self._clients: dict[str, TVTime] = {}
+        self._lock = threading.Lock()
+        self._http: httpx.AsyncClient = None
+
+    def __contains__(self, plex_user: str) -> bool:
+        return plex_user.lower() in self._clients
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def get(self, plex_user: str) -> TVTime | None:
+        """
+        Retrieves the TVTime client of a Plex user.
+
+        Args:
+            plex_user (str): The Plex account title, in any case.
+
+        Returns:
+            TVTime: The client of the user if registered, None otherwise.
+        """
+        return self._clients.get(plex_user.lower())
+
+    def register(self, client: TVTime) -> None:
+        """
+        Registers a TVTime client, replacing any client previously registered for the same user.
+
+        Args:
+            client (TVTime): The client to register.
+        """
+        with self._lock:
+            self._clients[client.user.lower()] = client
+
+    def clients(self) -> dict[str, TVTime]:
+        """
+        Returns a snapshot of the registered clients.
+
+        Returns:
+            dict: A copy of the mapping of Plex users to TVTime clients.
+        """
+        with self._lock:
+            return dict(self._clients)
+
+    def login_all(
+        self,
+        users: list[tuple[str, str, str]],
+        max_workers: int = 4,
+        **options,
+    ) -> None:
+        """
+        Creates and logs in a TVTime client for every user, in parallel.
+
+        A user whose login fails is logged and skipped, so one bad account
+        does not prevent the others from being served.
+
+        Args:
+            users (list): A list of (plex_user, tvtime_username, tvtime_password) tuples.
+            max_workers (int): The maximum number of logins running at the same time.
+            **options: Extra keyword arguments passed to every TVTime client,
+                the HTTP client of the registry being shared unless one is given.
+        """
+        if not users:
+            return
+        with self._lock:
+            if self._http is None:
+                self._http = create_client(options.get("http_settings") or HttpSettings())
+        options.setdefault("http_client", self._http)
+
+        def _login(plex_user: str, username: str, password: str) -> TVTime:
+            client = TVTime(
+                plex_user=plex_user.lower(),
+                tvtime_username=username,
+                tvtime_password=password,
+                **options,
+            )
+            client.login()
+            return client
+
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(max_workers, len(users))), thread_name_prefix="login"
+        ) as executor:
+            futures = {executor.submit(_login, *user): user[0] for user in users}
+            for future in as_completed(futures):
+                plex_user = futures[future]
+                try:
+                    self.register(future.result())
+                except Exception as _:  # pylint: disable=broad-except
+                    log.error("[%s] Unable to log in to TVTime, skipping user: %s", plex_user, _)
+
+    def sync(
+        self,
+        users: list[tuple[str, str, str]],
+        max_workers: int = 4,
+        **options,
+    ) -> tuple[list[str], list[str], list[TVTime]]:
+        """
+        Brings the registry in line with the configured users.
+
+        Only the users added or whose credentials changed are logged in, and the
+        removed users are unregistered: the clients of the other users are kept as is.
+        The clients replaced or unregistered are not closed, scrobbles of theirs may
+        still be queued: the caller closes them once they are no longer used.
+
+        Args:
+            users (list): A list of (plex_user, tvtime_username, tvtime_password) tuples.
+            max_workers (int): The maximum number of logins running at the same time.
+            **options: Extra keyword arguments passed to every new TVTime client.
+
+        Returns:
+            tuple: The lowercased Plex users logged in, those unregistered, and the
+            clients replaced or unregistered.
+        """
+        wanted = {user[0].lower(): user for user in users}
+        current = self.clients()
+        changed = [
+            user
+            for plex_user, user in wanted.items()
+            if plex_user not in current
+            or (current[plex_user].username, current[plex_user].password) != user[1:]
+        ]
+        removed = [plex_user for plex_user in current if plex_user not in wanted]
+        with self._lock:
+            for plex_user in removed:
+                self._clients.pop(plex_user, None)
+        self.login_all(changed, max_workers=max_workers, **options)
+        retired = [current[plex_user] for plex_user in removed]
+        for user in changed:
+            plex_user = user[0].lower()
+            # The old client stays registered if its replacement could not log in
+            if plex_user in current and self.get(plex_user) is not current[plex_user]:
+                retired.append(current[plex_user])
+        return [user[0].lower() for user in changed], removed, retired
+
+    def close(self) -> None:
+        """
+        Closes the registered clients and the HTTP client they share.
+        """
+        for client in self.clients().values():
+            client.close()
+        with self._lock:
+            http, self._http = self._http, None
+        if http is not None:
+            shared_loop().run(http.aclose())
+
+
+def sync_watched(client: TVTime, page_size: int = 100) -> None:
+    """
+    Brings the watched state mirror of a client up to date, walking the whole history
+    the first time and only its latest pages afterwards. Failures are logged.
+
+    Args:
+        client (TVTime): The client whose mirror to sync.
+        page_size (int): The number of episodes fetched per request.
+    """
+    if client.watched is None:
+        return
+    try:
+        client.sync_watched(full=not client.watched.synced_at, page_size=page_size)
+    except RETRYABLE_ERRORS as exc:
+        log.warning("[%s] Unable to sync the watched state: %s", client.user, exc)
+
+
+class WatchedSync:
+    """
+    This class keeps the watched state mirrors of the registered clients up to date
+    from a background thread, seeding the mirrors never synced on its first round.
+
+    Args:
+        registry (TVTimeRegistry): The registry of the clients to sync.
+        interval (float): The number of seconds between two incremental syncs.
+        page_size (int): The number of episodes fetched per request.
+        owns (Callable): Tells whether this replica owns the account of a Plex user,
+            only the owned accounts being synced. Every account is synced if None.
+    """
+
+    def __init__(
+        self,
+        registry: TVTimeRegistry,
+        interval: float,
+        page_size: int = 100,
+        owns: Callable[[str], bool] = None,
+    ) -> None:
+        self.registry = registry
+        self.interval = interval
+        self.page_size = page_size
+        self.owns = owns
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sync, name="watched-sync", daemon=True)
+
+    def start(self) -> None:
+        """
+        Starts syncing the mirrors.
+        """
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops syncing the mirrors.
+        """
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _sync(self) -> None:
+        while True:
+            for plex_user, client in self.registry.clients().items():
+                if self._stopped.is_set():
+                    return
+                # Mirrors never synced are always due, the others once they are interval old
+                if client.watched is None or time.time() - client.watched.synced_at < self.interval:
+                    continue
+                if self.owns is not None and not self.owns(plex_user):
+                    continue
+                try:
+                    sync_watched(client, self.page_size)
+                except Exception as exc:  # pylint: disable=broad-except
+                    log.error("[%s] Error syncing the watched state: %s", client.user, exc)
+            if self._stopped.wait(min(self.interval, CHECK_INTERVAL)):
+                return
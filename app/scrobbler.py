@@ -0,0 +1,834 @@
+"""
+scrobbler.py
+
+This module provides an in-process scrobble queue drained by a pool of workers per TVTime account,
+so the Plex webhook can acknowledge events without waiting for TVTime.
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from cluster import Cluster  # pylint: disable=import-error
+from registry import TVTimeRegistry  # pylint: disable=import-error
+from tvtime import RETRYABLE_ERRORS, TVTime  # pylint: disable=import-error
+from utils.journal import ScrobbleJournal  # pylint: disable=import-error
+from utils.logger import correlation, current_correlation_id  # pylint: disable=import-error
+from utils.logger import logging as log  # pylint: disable=import-error
+from utils.metrics import FLUSHED, SCROBBLES, SEND_SECONDS  # pylint: disable=import-error
+from utils.trace import tracing  # pylint: disable=import-error
+
+FULL_POLICIES = ("reject", "block", "drop_oldest")
+LATENCY_SAMPLES = 1024
+
+
+@dataclass
+class ScrobbleJob:
+    """
+    A scrobble event waiting to be sent to TVTime.
+
+    Args:
+        plex_user (str): The lowercased Plex account title.
+        media_type (str): The Plex library section type, either "movie" or "show".
+        media_id (int): The TVDB ID of the movie or the episode.
+        media_name (str): The title of the movie or of the show, for logging purposes.
+        journal_id (int): The ID of the job in the scrobble journal, if journaled.
+        correlation_id (str): The ID tagging the log records of the job, defaulting to the one
+            of the webhook request that queued it.
+        prewarmed (bool): Whether the item was pre-warmed while it was being played.
+    """
+
+    plex_user: str
+    media_type: str
+    media_id: int
+    media_name: str
+    journal_id: int = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    correlation_id: str = field(default_factory=current_correlation_id)
+    prewarmed: bool = False
+
+
+@dataclass
+class BatchSettings:
+    """
+    How the episode scrobbles queued for an account are grouped before being sent.
+
+    Args:
+        linger (float): The number of seconds a worker waits for more episodes, 0 disabling batches.
+        size (int): The maximum number of episodes in a batch.
+        concurrency (int): The maximum number of episodes of a batch sent at the same time.
+    """
+
+    linger: float = 0.5
+    size: int = 50
+    concurrency: int = 4
+
+
+@dataclass
+class OfflineSettings:
+    """
+    How the scrobbles of an account are buffered while TVTime is unavailable.
+
+    Args:
+        max_buffer (int): The maximum number of scrobbles buffered, the next ones being rejected.
+        retry_interval (float): The number of seconds before trying to flush the buffer,
+            doubled after every failed attempt.
+        max_retry_interval (float): The maximum number of seconds between two attempts.
+        flush_size (int): The number of buffered scrobbles sent at a time.
+        max_auth_failures (int): The number of attempts in a row the account cannot log in
+            for, after which its scrobbles are failed until its credentials change.
+    """
+
+    max_buffer: int = 10000
+    retry_interval: float = 5.0
+    max_retry_interval: float = 300.0
+    flush_size: int = 50
+    max_auth_failures: int = 5
+
+
+class AccountWorkers:  # pylint: disable=too-many-instance-attributes
+    """
+    A bounded queue and the pool of worker threads draining it for a single TVTime account.
+
+    When TVTime cannot be reached, or the account cannot log in, the account goes offline:
+    the scrobbles are appended to a buffer instead of being sent, and a reconciler thread
+    flushes the buffer in order once TVTime answers again. An account still unable to log
+    in after max_auth_failures attempts is locked out instead: its buffered and next
+    scrobbles are failed without a login until its client is replaced with new credentials.
+    """
+
+    def __init__(
+        self,
+        client: TVTime,
+        workers: int,
+        depth: int,
+        journal: ScrobbleJournal = None,
+        batch: BatchSettings = None,
+        offline: OfflineSettings = None,
+    ):  # pylint: disable=too-many-arguments
+        self.client = client
+        self.journal = journal
+        self.batch = batch or BatchSettings()
+        self.settings = offline or OfflineSettings()
+        self.queue: queue.Queue = queue.Queue(maxsize=depth)
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.latencies: deque = deque(maxlen=LATENCY_SAMPLES)
+        self.offline = False
+        self.buffer: deque[ScrobbleJob] = deque()
+        self.deduplicated = 0
+        self.flushed = 0
+        self.flush_rate = 0.0
+        self._buffered_keys: set[tuple] = set()
+        self._retries = 0
+        self._retry_after = 0.0
+        self._auth_failures = 0
+        # The client whose credentials kept failing, if the account is locked out
+        self._locked_out: TVTime = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.threads = [
+            threading.Thread(target=self._work, name=f"scrobble-{client.user}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, job: ScrobbleJob, policy: str, block_timeout: float) -> bool:
+        """
+        Puts a job on the queue, applying the back-pressure policy when it is full.
+
+        Args:
+            job (ScrobbleJob): The job to enqueue.
+            policy (str): One of "reject", "block" or "drop_oldest".
+            block_timeout (float): The number of seconds to wait for room with the "block" policy.
+
+        Returns:
+            bool: True if the job was enqueued or buffered, False if it was rejected.
+        """
+        if self.offline:
+            buffered = self._buffer([job], reject=True)
+            if buffered is not None:
+                return buffered
+        try:
+            if policy == "block":
+                self.queue.put(job, timeout=block_timeout)
+            elif policy == "drop_oldest":
+                while True:
+                    try:
+                        self.queue.put_nowait(job)
+                        break
+                    except queue.Full:
+                        try:
+                            dropped = self.queue.get_nowait()
+                        except queue.Empty:
+                            continue
+                        self.queue.task_done()
+                        self._settle(dropped, True)
+                        with self._lock:
+                            self.dropped += 1
+                        log.warning(
+                            "[%s] Scrobble queue full, dropping %s %s",
+                            self.client.user,
+                            dropped.media_type,
+                            dropped.media_name,
+                        )
+            else:
+                self.queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def stop(self, timeout: float = None) -> None:
+        """
+        Stops the workers once every job already enqueued has been processed.
+
+        Buffered jobs are not waited for, they are replayed from the journal on the next startup.
+
+        Args:
+            timeout (float): The maximum number of seconds to wait for each worker.
+        """
+        self._stopping.set()
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join(timeout)
+        if self.buffer:
+            log.warning(
+                "[%s] Stopping with %d buffered scrobble(s)%s",
+                self.client.user,
+                len(self.buffer),
+                ", left in the journal" if self.journal is not None else " lost",
+            )
+
+    def stats(self) -> dict:
+        """
+        Returns the counters and latency figures of the account queue.
+
+        Returns:
+            dict: The queue depth, job counters and latencies in milliseconds.
+        """
+        with self._lock:
+            latencies = sorted(self.latencies)
+            stats = {
+                "depth": self.queue.qsize(),
+                "capacity": self.queue.maxsize,
+                "enqueued": self.enqueued,
+                "processed": self.processed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "dropped": self.dropped,
+                "offline": self.offline,
+                "buffered": len(self.buffer),
+                "deduplicated": self.deduplicated,
+                "flushed": self.flushed,
+                "flush_rate": round(self.flush_rate, 1),
+            }
+        if latencies:
+            stats["latency_ms"] = {
+                "avg": round(sum(latencies) / len(latencies) * 1000, 1),
+                "p50": round(latencies[len(latencies) // 2] * 1000, 1),
+                "p99": round(latencies[int(len(latencies) * 0.99)] * 1000, 1),
+                "max": round(latencies[-1] * 1000, 1),
+            }
+        return stats
+
+    def _work(self) -> None:
+        stopping = False
+        while not stopping:
+            job = self.queue.get()
+            if job is None:
+                self.queue.task_done()
+                return
+            jobs = [job]
+            if job.media_type == "show" and self.batch.linger > 0:
+                stopping = self._collect(jobs)
+            # Jobs queued before the account went offline keep their order behind the buffer
+            if not (self.offline and self._buffer(jobs)):
+                refused, retry_after = self._process(jobs)
+                if refused:
+                    self._go_offline(refused, retry_after)
+            for _ in jobs:
+                self.queue.task_done()
+
+    def _process(self, jobs: list[ScrobbleJob]) -> tuple[list[ScrobbleJob], float]:
+        """
+        Sends a group of jobs to TVTime.
+
+        Returns:
+            tuple: The jobs not sent because TVTime is unavailable, and the seconds to wait
+            before retrying them.
+        """
+        if self._locked_out is not None and self.client is self._locked_out:
+            for job in jobs:
+                self._finish(job, False)
+            return [], 0.0
+        refused, retry_after = [], 0.0
+        episodes = [j for j in jobs if j.media_type == "show"]
+        others = [j for j in jobs if j.media_type != "show"]
+        if len(episodes) > 1:
+            refused = self._process_episodes(episodes)
+            if refused:
+                retry_after = self.client.breakers["watched_episodes"].retry_after()
+        else:
+            others = jobs
+        for other in others:
+            if refused:
+                # TVTime is unavailable, the remaining jobs would fail the same way
+                refused.append(other)
+                continue
+            succeeded = False
+            queued = time.monotonic() - other.enqueued_at
+            with (
+                correlation(other.correlation_id),
+                tracing("scrobble", other.correlation_id, queued),
+            ):
+                try:
+                    with SEND_SECONDS.time(prewarmed=str(other.prewarmed).lower()) as span:
+                        succeeded = process(self.client, other)
+                        if not succeeded:
+                            span.outcome = "failure"
+                except RETRYABLE_ERRORS as exc:
+                    log.warning("[%s] TVTime is unavailable: %s", other.plex_user, exc)
+                    refused.append(other)
+                    retry_after = max(retry_after, getattr(exc, "retry_after", 0.0))
+                    continue
+                except Exception as _:  # pylint: disable=broad-except
+                    log.error("[%s] Error while processing scrobble: %s", other.plex_user, _)
+            self._finish(other, succeeded)
+        return refused, retry_after
+
+    def _buffer(self, jobs: list[ScrobbleJob], reject: bool = False) -> bool | None:
+        """
+        Appends jobs to the buffer, settling those of a media already buffered.
+
+        Args:
+            jobs (list): The jobs to buffer.
+            reject (bool): Whether to refuse the jobs rather than exceed the buffer size.
+
+        Returns:
+            bool: True if the jobs were buffered, False if the buffer is full and reject is set,
+            None if the account is back online.
+        """
+        duplicates = []
+        with self._lock:
+            if not self.offline:
+                return None
+            if reject and len(self.buffer) + len(jobs) > self.settings.max_buffer:
+                self.rejected += len(jobs)
+                return False
+            for job in jobs:
+                key = (job.media_type, job.media_id)
+                if key in self._buffered_keys:
+                    duplicates.append(job)
+                    continue
+                self._buffered_keys.add(key)
+                self.buffer.append(job)
+            self.deduplicated += len(duplicates)
+        for job in duplicates:
+            self._settle(job, True)
+        return True
+
+    def _go_offline(self, jobs: list[ScrobbleJob], retry_after: float) -> bool:
+        """
+        Buffers the jobs TVTime was unavailable for, starting the reconciler if the account
+        was online, or locks the account out if it could not log in too many times in a row.
+
+        Returns:
+            bool: True if the account was locked out, the jobs and the buffer being failed.
+        """
+        # A client left without a usable token while the authentication endpoint answers
+        # is refused its credentials, rather than waiting for TVTime to recover
+        auth_failed = (
+            self.client.token_expires_soon() and self.client.breakers["auth"].failures == 0
+        )
+        with self._lock:
+            self._auth_failures = self._auth_failures + 1 if auth_failed else 0
+            locked_out = self._auth_failures >= self.settings.max_auth_failures
+        if locked_out:
+            self._lock_out(jobs)
+            return True
+        with self._lock:
+            self._retries += 1
+            backoff = self.settings.retry_interval * 2 ** (self._retries - 1)
+            self._retry_after = max(retry_after, min(backoff, self.settings.max_retry_interval))
+            went_offline = not self.offline
+            self.offline = True
+            # The refused jobs go back to the front of the buffer, to be sent in order
+            duplicates = []
+            for job in reversed(jobs):
+                key = (job.media_type, job.media_id)
+                if key in self._buffered_keys:
+                    duplicates.append(job)
+                    continue
+                self._buffered_keys.add(key)
+                self.buffer.appendleft(job)
+            self.deduplicated += len(duplicates)
+        for job in duplicates:
+            self._settle(job, True)
+        if went_offline:
+            log.warning(
+                "[%s] TVTime is unavailable, buffering scrobbles until it recovers",
+                self.client.user,
+            )
+            threading.Thread(
+                target=self._reconcile, name=f"reconcile-{self.client.user}", daemon=True
+            ).start()
+        return False
+
+    def _lock_out(self, jobs: list[ScrobbleJob]) -> None:
+        """
+        Fails the jobs and the buffer of an account that cannot log in, until its client changes.
+        """
+        with self._lock:
+            self._locked_out = self.client
+            failed = [*jobs, *self.buffer]
+            self.buffer.clear()
+            self._buffered_keys.clear()
+            self.offline = False
+            self._retries = 0
+            self._auth_failures = 0
+        log.error(
+            "[%s] Unable to log in to TVTime %d times in a row, failing %d scrobble(s) and the "
+            "next ones until the credentials change",
+            self.client.user,
+            self.settings.max_auth_failures,
+            len(failed),
+        )
+        for job in failed:
+            self._finish(job, False)
+
+    def _reconcile(self) -> None:
+        """
+        Tries to flush the buffer until it is empty, the account then going back online.
+        """
+        while not self._stopping.wait(self._retry_after):
+            if self._flush():
+                return
+
+    def _flush(self) -> bool:
+        """
+        Sends the buffered jobs in order, a chunk at a time.
+
+        Returns:
+            bool: True if the buffer was emptied, False if TVTime is still unavailable.
+        """
+        started, sent = time.monotonic(), 0
+        while True:
+            if self._stopping.is_set():
+                return False
+            with self._lock:
+                if not self.buffer:
+                    self.offline = False
+                    self._retries = 0
+                    break
+                chunk = [
+                    self.buffer.popleft()
+                    for _ in range(min(self.settings.flush_size, len(self.buffer)))
+                ]
+                for job in chunk:
+                    self._buffered_keys.discard((job.media_type, job.media_id))
+            refused, retry_after = self._process(chunk)
+            sent += len(chunk) - len(refused)
+            with self._lock:
+                self.flushed += len(chunk) - len(refused)
+            FLUSHED.inc(len(chunk) - len(refused), user=self.client.user)
+            if refused:
+                if self._go_offline(refused, retry_after):
+                    return True
+                log.warning(
+                    "[%s] TVTime is still unavailable, %d scrobble(s) buffered, retrying in %.0fs",
+                    self.client.user,
+                    len(self.buffer),
+                    self._retry_after,
+                )
+                return False
+        elapsed = max(time.monotonic() - started, 1e-9)
+        with self._lock:
+            self.flush_rate = sent / elapsed
+        if sent:
+            log.info(
+                "[%s] TVTime is available again, flushed %d scrobble(s) in %.1fs (%.1f/s)",
+                self.client.user,
+                sent,
+                elapsed,
+                sent / elapsed,
+            )
+        return True
+
+    def _collect(self, jobs: list[ScrobbleJob]) -> bool:
+        """
+        Collects the jobs queued within the linger interval, up to the batch size.
+
+        Returns:
+            bool: True if the stop sentinel was dequeued while collecting, False otherwise.
+        """
+        deadline = time.monotonic() + self.batch.linger
+        while len(jobs) < self.batch.size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if job is None:
+                self.queue.task_done()
+                return True
+            jobs.append(job)
+        return False
+
+    def _process_episodes(self, episodes: list[ScrobbleJob]) -> list[ScrobbleJob]:
+        results = {}
+        # The records of a batch carry the IDs of every request it groups
+        correlation_ids = ",".join(dict.fromkeys(job.correlation_id for job in episodes))
+        queued = time.monotonic() - min(job.enqueued_at for job in episodes)
+        with correlation(correlation_ids), tracing("scrobble batch", correlation_ids, queued):
+            log.debug("[%s] Marking %d episodes as watched", self.client.user, len(episodes))
+            try:
+                results = self.client.watch_episodes(
+                    [job.media_id for job in episodes], max_workers=self.batch.concurrency
+                )
+            except RETRYABLE_ERRORS as exc:
+                log.warning("[%s] TVTime is unavailable: %s", self.client.user, exc)
+                return episodes
+            except Exception as _:  # pylint: disable=broad-except
+                log.error("[%s] Error while processing scrobbles: %s", self.client.user, _)
+        refused = []
+        for job in episodes:
+            succeeded = results.get(job.media_id, False)
+            if succeeded is None:
+                refused.append(job)
+            else:
+                self._finish(job, succeeded)
+        return refused
+
+    def _finish(self, job: ScrobbleJob, succeeded: bool) -> None:
+        self._settle(job, succeeded)
+        SCROBBLES.inc(user=job.plex_user, outcome="success" if succeeded else "failure")
+        with self._lock:
+            if succeeded:
+                self.processed += 1
+            else:
+                self.failed += 1
+            self.latencies.append(time.monotonic() - job.enqueued_at)
+
+    def _settle(self, job: ScrobbleJob, done: bool) -> None:
+        if self.journal is None or job.journal_id is None:
+            return
+        if done:
+            self.journal.mark_done(job.journal_id)
+        else:
+            self.journal.mark_failed(job.journal_id)
+
+
+class ScrobbleDispatcher:
+    """
+    Dispatches scrobble jobs to the worker pool of their TVTime account.
+
+    Args:
+        registry (TVTimeRegistry): The registry used to resolve the client of a job.
+        workers (int): The number of workers per account.
+        depth (int): The maximum number of pending jobs per account.
+        full_policy (str): What to do when a queue is full: "reject", "block" or "drop_oldest".
+        block_timeout (float): The number of seconds to wait for room with the "block" policy.
+        journal (ScrobbleJournal): The journal recording accepted jobs until they are done.
+        batch (BatchSettings): How the episode scrobbles of an account are grouped.
+        offline (OfflineSettings): How the scrobbles of an account are buffered while
+            TVTime is unavailable.
+        cluster (Cluster): The accounts owned by this replica, the scrobbles of the other
+            accounts being forwarded to their owner. Every account is served locally if None.
+    """
+
+    def __init__(
+        self,
+        registry: TVTimeRegistry,
+        workers: int = 2,
+        depth: int = 100,
+        full_policy: str = "reject",
+        block_timeout: float = 2.0,
+        journal: ScrobbleJournal = None,
+        batch: BatchSettings = None,
+        offline: OfflineSettings = None,
+        cluster: Cluster = None,
+    ):  # pylint: disable=too-many-arguments
+        if full_policy not in FULL_POLICIES:
+            log.warning("Unknown queue full policy %s, falling back to reject", full_policy)
+            full_policy = "reject"
+        self.registry = registry
+        self.workers = max(1, workers)
+        self.depth = max(1, depth)
+        self.full_policy = full_policy
+        self.block_timeout = block_timeout
+        self.journal = journal
+        self.batch = batch or BatchSettings()
+        self.offline = offline or OfflineSettings()
+        self.cluster = cluster
+        self._accounts: dict[str, AccountWorkers] = {}
+        # The threads closing the retired clients once their account is drained
+        self._retiring: list[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def submit(self, job: ScrobbleJob) -> bool:
+        """
+        Submits a job to the queue of its account.
+
+        When a journal is configured, the job is durably journaled before being queued,
+        so it is replayed on the next startup if it could not be sent to TVTime.
+        The job of an account owned by another replica is forwarded to it instead.
+
+        Args:
+            job (ScrobbleJob): The job to submit.
+
+        Returns:
+            bool: True if the job was accepted, False if it was rejected.
+        """
+        account = self._account(job.plex_user)
+        if account is None:
+            return False
+        if self.cluster is not None and not self.cluster.owns(job.plex_user):
+            return self._forward(job)
+        if self.journal is not None and job.journal_id is None:
+            job.journal_id = self.journal.append(
+                job.plex_user, job.media_type, job.media_id, job.media_name
+            )
+        accepted = account.put(job, self.full_policy, self.block_timeout)
+        if not accepted:
+            log.warning("[%s] Scrobble queue full, rejecting %s", job.plex_user, job.media_name)
+            if self.journal is not None:
+                self.journal.mark_done(job.journal_id)
+        return accepted
+
+    def deliver(self, plex_user: str, fields: dict) -> None:
+        """
+        Queues a job forwarded by another replica, waiting up to block_timeout for room.
+
+        The job was already taken from the shared queue, so a job the account has no room
+        for is forwarded again, to the back of the shared queue, rather than waited for:
+        the queues of every account are drained by the same thread.
+
+        Args:
+            plex_user (str): The lowercased Plex user of the job.
+            fields (dict): The media_type, media_id, media_name and correlation_id of the job.
+        """
+        job = ScrobbleJob(plex_user=plex_user, **fields)
+        account = self._account(plex_user)
+        if account is None:
+            log.warning(
+                "[%s] Dropping a forwarded scrobble of %s, the user has no TVTime account here",
+                plex_user,
+                job.media_name,
+            )
+            SCROBBLES.inc(user=plex_user, outcome="undeliverable")
+            return
+        if self.cluster is not None and not self.cluster.owns(plex_user):
+            # The account changed hands since the job was taken from its queue
+            self._forward(job)
+            return
+        if self.journal is not None:
+            job.journal_id = self.journal.append(
+                job.plex_user, job.media_type, job.media_id, job.media_name
+            )
+        if account.put(job, "block", self.block_timeout):
+            return
+        if not self._forward(job):
+            # Left in the journal if there is one, to be replayed on the next startup
+            SCROBBLES.inc(user=plex_user, outcome="undeliverable")
+            return
+        log.warning("[%s] Scrobble queue full, forwarding %s again", plex_user, job.media_name)
+        if self.journal is not None:
+            # The owner journals the job again when it takes it
+            self.journal.mark_done(job.journal_id)
+
+    def replay(self) -> int:
+        """
+        Queues the journaled jobs left over by a previous run.
+
+        Jobs of users without a registered client are kept in the journal, as are the jobs
+        of an account whose queue has no room left after block_timeout seconds.
+
+        Returns:
+            int: The number of replayed jobs.
+        """
+        if self.journal is None:
+            return 0
+        if not self.journal.acquire_replay_lock():
+            log.debug("The journal is replayed by another process")
+            return 0
+        replayed, full = 0, set()
+        for entry_id, plex_user, media_type, media_id, media_name in self.journal.pending():
+            account = self._account(plex_user)
+            if account is None or plex_user in full:
+                continue
+            job = ScrobbleJob(
+                plex_user=plex_user,
+                media_type=media_type,
+                media_id=media_id,
+                media_name=media_name,
+                journal_id=entry_id,
+            )
+            if self.cluster is not None and not self.cluster.owns(plex_user):
+                if self._forward(job):
+                    self.journal.mark_done(entry_id)
+                    replayed += 1
+                continue
+            if not account.put(job, "block", self.block_timeout):
+                # The next entries of the account are kept too, to be replayed in order
+                log.warning(
+                    "[%s] Scrobble queue full, keeping the next scrobbles in the journal",
+                    plex_user,
+                )
+                full.add(plex_user)
+                continue
+            replayed += 1
+        if replayed:
+            log.info("Replayed %d scrobble(s) from the journal", replayed)
+        return replayed
+
+    def stats(self) -> dict:
+        """
+        Returns the queue statistics of every account.
+
+        Returns:
+            dict: A mapping of Plex users to their queue statistics.
+        """
+        with self._lock:
+            accounts = dict(self._accounts)
+        return {user: account.stats() for user, account in accounts.items()}
+
+    def sync(self, retired: list[TVTime] = ()) -> None:
+        """
+        Brings the account workers in line with the registry, closing the retired clients
+        once they are no longer used.
+
+        The workers of unregistered users drain their queue and stop in the background,
+        their client being closed then, and the workers of users whose client was replaced
+        switch to the new client, the old one being closed once the jobs queued before
+        are processed. The other accounts are left untouched.
+
+        Args:
+            retired (list): The clients the registry replaced or unregistered.
+        """
+        retired = {client.user.lower(): client for client in retired}
+        with self._lock:
+            accounts = dict(self._accounts)
+        for plex_user, account in accounts.items():
+            client = self.registry.get(plex_user)
+            if client is None:
+                with self._lock:
+                    self._accounts.pop(plex_user, None)
+                log.info("[%s] Stopping the scrobble workers of the removed user", plex_user)
+                old, stop = retired.pop(plex_user, account.client), True
+            elif client is not account.client:
+                old, stop = retired.pop(plex_user, account.client), False
+                account.client = client
+            else:
+                continue
+            thread = threading.Thread(
+                target=self._retire, args=(account, old, stop), name=f"retire-{plex_user}"
+            )
+            with self._lock:
+                self._retiring = [t for t in self._retiring if t.is_alive()] + [thread]
+            thread.start()
+        # Clients of accounts without workers have nothing queued
+        for client in retired.values():
+            client.close()
+
+    def _retire(self, account: AccountWorkers, client: TVTime, stop: bool) -> None:
+        if stop:
+            account.stop()
+        else:
+            account.queue.join()
+        try:
+            client.close()
+        except Exception as exc:  # pylint: disable=broad-except
+            log.error("[%s] Error closing the replaced TVTime client: %s", client.user, exc)
+
+    def shutdown(self, timeout: float = None) -> None:
+        """
+        Drains every queue and stops the workers.
+
+        Args:
+            timeout (float): The maximum number of seconds to wait for each worker.
+        """
+        with self._lock:
+            accounts = list(self._accounts.values())
+            self._accounts.clear()
+            retiring = list(self._retiring)
+        for account in accounts:
+            account.stop(timeout)
+        for thread in retiring:
+            thread.join(timeout)
+        if self.journal is not None:
+            self.journal.close()
+
+    def _forward(self, job: ScrobbleJob) -> bool:
+        return self.cluster.forward(
+            job.plex_user,
+            {
+                "media_type": job.media_type,
+                "media_id": job.media_id,
+                "media_name": job.media_name,
+                "correlation_id": job.correlation_id,
+                "prewarmed": job.prewarmed,
+            },
+        )
+
+    def _account(self, plex_user: str) -> AccountWorkers | None:
+        account = self._accounts.get(plex_user)
+        if account is not None:
+            return account
+        client = self.registry.get(plex_user)
+        if client is None:
+            log.debug("[%s] User does not have any TVtime account configured", plex_user)
+            return None
+        with self._lock:
+            account = self._accounts.get(plex_user)
+            if account is None:
+                account = AccountWorkers(
+                    client, self.workers, self.depth, self.journal, self.batch, self.offline
+                )
+                self._accounts[plex_user] = account
+        return account
+
+
+def process(client: TVTime, job: ScrobbleJob) -> bool:
+    """
+    Sends a scrobble job to TVTime.
+
+    Args:
+        client (TVTime): The TVTime client of the job's account.
+        job (ScrobbleJob): The job to send.
+
+    Raises:
+        CircuitOpenError: If the circuit of an endpoint is open and the job should be retried later.
+        TVTimeUnavailableError: If TVTime could not be reached and the job should be retried later.
+        TVTimeAuthError: If the account could not log in.
+
+    Returns:
+        bool: True if the media was marked as watched, False otherwise.
+    """
+    log.debug(
+        "[%s] Processing a scrobble event for the %s : %s",
+        job.plex_user,
+        job.media_type,
+        job.media_name,
+    )
+    if job.media_type == "movie":
+        movie_uuid = client.get_movie_uuid(movie_id=job.media_id)
+        if movie_uuid is None:
+            return False
+        return client.watch_movie(movie_uuid=movie_uuid)
+    if job.media_type == "show":
+        return client.watch_episode(episode_id=job.media_id)
+    log.error("Invalid media type")
+    return False
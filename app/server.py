@@ -0,0 +1,64 @@
+"""
+server.py
+
+This module runs the webhook behind gunicorn, the production WSGI server.
+
+The TVTime logins happen once, in the gunicorn master, before any worker is forked:
+the tokens they produce are persisted in the token cache, from which every worker
+restores its clients without starting a browser. Each worker starts its own scrobble
+workers after the fork, and drains them on shutdown.
+"""
+
+from gunicorn.app.base import BaseApplication
+from utils.logger import logging as log  # pylint: disable=import-error
+
+
+class WebhookServer(BaseApplication):  # pylint: disable=abstract-method
+    """
+    A gunicorn application serving the webhook.
+
+    Args:
+        application: The WSGI application to serve.
+        webhook: The Webhook whose clients and scrobble workers are started in every worker.
+        options (dict): The gunicorn settings, such as "bind", "workers" or "threads".
+    """
+
+    def __init__(self, application, webhook, options: dict = None) -> None:
+        self.application = application
+        self.webhook = webhook
+        self.options = options or {}
+        super().__init__()
+
+    def load_config(self) -> None:
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key.lower(), value)
+        self.cfg.set("on_starting", self._on_starting)
+        self.cfg.set("post_worker_init", self._post_worker_init)
+        self.cfg.set("worker_exit", self._worker_exit)
+
+    def load(self):
+        return self.application
+
+    def _on_starting(self, _server) -> None:
+        self.webhook.prime_tokens()
+
+    def _post_worker_init(self, worker) -> None:
+        log.info("Starting worker %s...", worker.pid)
+        self.webhook.start()
+
+    def _worker_exit(self, _server, worker) -> None:
+        log.info("Stopping worker %s, draining in-flight scrobbles...", worker.pid)
+        self.webhook.stop(timeout=self.cfg.graceful_timeout)
+
+
+def serve(application, webhook, options: dict) -> None:
+    """
+    Serves the webhook with gunicorn until it is stopped.
+
+    Args:
+        application: The WSGI application to serve.
+        webhook: The Webhook whose clients and scrobble workers are started in every worker.
+        options (dict): The gunicorn settings.
+    """
+    WebhookServer(application, webhook, options).run()
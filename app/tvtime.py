@@ -1,32 +1,97 @@
 """
 tvtime.py
 
-This module provides a class for interacting with the TVTime API.
+This module provides classes for interacting with the TVTime API.
 It includes methods for logging in, marking episodes as watched, and watching movies on TVTime.
+
+AsyncTVTime exposes them as coroutines, so many accounts can share an event loop
+and a connection pool. TVTime wraps it for synchronous callers.
 """
 
+import asyncio
 import json
-import sys
+import os
 import time
 
-import requests
-from selenium import webdriver
-from selenium.webdriver.firefox.options import Options
-from selenium.webdriver.firefox.service import Service
+import httpx
+from utils.aio import EventLoopThread, shared_loop  # pylint: disable=import-error
+from utils.breaker import CircuitBreaker, CircuitOpenError  # pylint: disable=import-error
+from utils.browser import BrowserPool  # pylint: disable=import-error
+from utils.cache import MISSING, TTLCache  # pylint: disable=import-error
+from utils.http import HttpSettings, create_client, send  # pylint: disable=import-error
 from utils.logger import logging as log  # pylint: disable=import-error
+from utils.metrics import timed  # pylint: disable=import-error
+from utils.ratelimit import TokenBucket  # pylint: disable=import-error
+from utils.token_cache import (  # pylint: disable=import-error
+    TokenCache,
+    jwt_claims,
+    jwt_expiry,
+)
+from utils.watched import WatchedSet  # pylint: disable=import-error
 
 BASE_URL = "app.tvtime.com"
+API_URL = f"https://{BASE_URL}"
+AUTH_URL = "https://beta-app.tvtime.com/sidecar?o=https://auth.tvtime.com/v1"
+HISTORY_API = "https://api2.tozelabs.com/v2/watched_episodes"
+ENDPOINTS = ("watched_episodes", "tracking", "search", "history", "auth")
+DEFAULT_RATE_LIMITS = {
+    "watched_episodes": {"rate": 5, "burst": 10},
+    "tracking": {"rate": 2, "burst": 5},
+    "search": {"rate": 2, "burst": 5},
+    "history": {"rate": 1, "burst": 5},
+    "auth": {"rate": 0.1, "burst": 2},
+}
+
+
+class TVTimeAuthError(Exception):
+    """
+    Raised when a TVTime account cannot be authenticated.
+    """
 
 
-class TVTime:
+class TVTimeUnavailableError(Exception):
     """
-    A class for interacting with the TVTime API.
+    Raised when TVTime cannot be reached or keeps failing, the request being worth retrying later.
+    """
+
+
+# The errors after which a scrobble is kept to be sent again once TVTime recovers
+RETRYABLE_ERRORS = (CircuitOpenError, TVTimeUnavailableError, TVTimeAuthError)
+
+
+class AsyncTVTime:  # pylint: disable=too-many-instance-attributes
+    """
+    An asynchronous client of the TVTime API.
+
+    Every account can share the same HTTP client, its requests being multiplexed
+    over the pooled connections, while a semaphore bounds the requests in flight
+    of each account. The requests to each endpoint go through a rate limiter and
+    a circuit breaker of the account.
 
     Args:
-        username (str): The username for the TVTime account.
-        password (str): The password for the TVTime account.
+        plex_user (str): The name of plex's user to map with TVTime.
+        tvtime_username (str): The username for the TVTime account.
+        tvtime_password (str): The password for the TVTime account.
         driver_location (str): The location of the Firefox driver executable.
         browser_location (str): The location of the Firefox browser executable.
+        token_cache (TokenCache): The cache persisting the tokens between restarts.
+        refresh_margin (int): The number of seconds before expiry at which the token is refreshed.
+        http_settings (HttpSettings): The connection pool, timeout and retry settings.
+        movie_cache (TTLCache): The cache of movie UUIDs, shared by every account.
+        http_client (httpx.AsyncClient): The HTTP client shared by every account,
+            a client of its own being created if None.
+        browser_pool (BrowserPool): The browsers shared by every account to fetch
+            the anonymous JWT token, a browser being started for each login if None.
+        rate_limits (dict): The "rate" and "burst" of the requests to each endpoint,
+            overriding DEFAULT_RATE_LIMITS.
+        failure_threshold (int): The number of consecutive failures opening the circuit of an endpoint.
+        reset_timeout (float): The number of seconds an open circuit refuses requests.
+        api_url (str): The base URL of the TVTime API, only changed to test against a stand-in.
+        auth_url (str): The base URL of the TVTime authentication API.
+        watched_path (str): The directory of the watched state mirrors, the items already
+            watched being answered without calling TVTime. No mirror is kept if None.
+        relogin_timeout (float): The maximum number of seconds a request rejected with a 401
+            waits for the account to log in again.
     """
 
     def __init__(
@@ -36,43 +101,287 @@ class TVTime:
         tvtime_password: str = None,
         driver_location: str = None,
         browser_location: str = None,
+        token_cache: TokenCache = None,
+        refresh_margin: int = 300,
+        http_settings: HttpSettings = None,
+        movie_cache: TTLCache = None,
+        http_client: httpx.AsyncClient = None,
+        browser_pool: BrowserPool = None,
+        rate_limits: dict = None,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        api_url: str = API_URL,
+        auth_url: str = AUTH_URL,
+        watched_path: str = None,
+        relogin_timeout: float = 60,
     ):  # pylint: disable=too-many-arguments
-        """
-        Initializes a new instance of the TVTime class.
-
-        Args:
-            plex_user (str): The name of plex's user to map with TVTime.
-            tvtime_username (str): The username for the TVTime account.
-            tvtime_password (str): The password for the TVTime account.
-            driver_location (str): The location of the Firefox driver executable.
-            browser_location (str): The location of the Firefox browser executable.
-        """
         self.user = plex_user
         self.username = tvtime_username
         self.password = tvtime_password
+        self.driver_location = driver_location
+        self.browser_location = browser_location
+        self.token_cache = token_cache
+        self.refresh_margin = refresh_margin
+        self.api_url = api_url.rstrip("/")
+        self.auth_url = auth_url.rstrip("/")
         self.token: str = ""
         self.refresh_token: str = ""
-        options = Options()
-        options.add_argument("--headless")
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--allow-origins=*")
-        options.add_argument("--log-level=3")
+        self.token_expiry: float | None = None
+        self.token_issued_at: float | None = None
+        self.movie_cache = movie_cache
+        self.http_settings = http_settings or HttpSettings()
+        self.http = http_client or create_client(self.http_settings)
+        self._owns_http = http_client is None
+        self.browser_pool = browser_pool or BrowserPool(
+            driver_location, browser_location, max_uses=1
+        )
+        self._semaphore = asyncio.Semaphore(max(1, self.http_settings.max_concurrency))
+        self._login_lock = asyncio.Lock()
+        self.relogin_timeout = relogin_timeout
+        self._relogin_task: asyncio.Future = None
+        self.relogins = 0
+        self.relogin_waits = 0
+        rate_limits = {**DEFAULT_RATE_LIMITS, **(rate_limits or {})}
+        self.limiters = {
+            endpoint: TokenBucket(float(limit.get("rate", 0)), limit.get("burst"))
+            for endpoint, limit in rate_limits.items()
+        }
+        self.breakers = {
+            endpoint: CircuitBreaker(f"{plex_user}/{endpoint}", failure_threshold, reset_timeout)
+            for endpoint in ENDPOINTS
+        }
+        self.watched = (
+            WatchedSet(os.path.join(watched_path, f"{plex_user}.json"), owner=tvtime_username)
+            if watched_path
+            else None
+        )
 
-        if browser_location:
-            options.binary_location = browser_location
+    async def _request(
+        self, endpoint: str, method: str, url: str, auth: str = None, reauth: bool = True, **kwargs
+    ) -> httpx.Response:
+        """
+        Sends a request to a TVTime endpoint, within its rate limit and circuit breaker.
+
+        Throttled responses and server errors count as failures of the endpoint,
+        so an outage opens its circuit instead of being hammered by every scrobble.
+        A request sent with the token of the account and rejected with a 401 is sent
+        again once the account logged in again, see relogin.
 
+        Raises:
+            CircuitOpenError: If the circuit of the endpoint is open.
+            httpx.HTTPError: If the request could not be sent.
+            TVTimeAuthError: If the token was rejected and the account could not log in again.
+        """
+        headers = {"Content-Type": "application/json"}
+        token = None
+        if auth is None:
+            headers["Host"] = f"{BASE_URL}:80"
+            auth = token = self.token
+        headers["Authorization"] = f"Bearer {auth}"
+        breaker = self.breakers[endpoint]
+        breaker.before_call()
+        await self.limiters[endpoint].wait()
         try:
-            log.info("Initializing Firefox driver...")
-            self.driver = webdriver.Firefox(service=Service(driver_location), options=options)
+            async with self._semaphore:
+                r = await send(
+                    self.http, self.http_settings, method, url, headers=headers, **kwargs
+                )
+        except httpx.HTTPError:
+            self._record_failure(breaker)
+            raise
+        if r.status_code == 429 or r.is_server_error:
+            self._record_failure(breaker)
+        else:
+            breaker.record_success()
+        if r.status_code == 401 and token is not None and reauth:
+            log.debug("[%s] TVTime rejected the token, logging in again...", self.user)
+            await self.relogin(token)
+            return await self._request(endpoint, method, url, reauth=False, **kwargs)
+        return r
+
+    def _record_failure(self, breaker: CircuitBreaker) -> None:
+        if breaker.record_failure():
+            log.warning(
+                "[%s] TVTime keeps failing, pausing %s for %ss",
+                self.user,
+                breaker.name,
+                breaker.reset_timeout,
+            )
+
+    def stats(self) -> dict:
+        """
+        Returns the rate limiter saturation and the circuit state of every endpoint.
+
+        Returns:
+            dict: The "limits" and "circuits" of the account, by endpoint, the "auth"
+            counters and the "watched" state mirror if there is one.
+        """
+        stats = {
+            "limits": {endpoint: limiter.stats() for endpoint, limiter in self.limiters.items()},
+            "circuits": {endpoint: breaker.stats() for endpoint, breaker in self.breakers.items()},
+            "auth": {"relogins": self.relogins, "relogin_waits": self.relogin_waits},
+        }
+        if self.watched is not None:
+            stats["watched"] = self.watched.stats()
+        return stats
+
+    @timed("login")
+    async def login(self, force: bool = False) -> None:
+        """
+        Logs in to the TVTime API.
+
+        This method tries the cheapest way to get a valid token first:
+        1. Reuses the tokens of the token cache if they are still valid, including
+           tokens another process renewed since this one loaded its own.
+        2. Renews them with the refresh token if they expired.
+        3. Falls back to a full login, fetching a JWT token using Selenium
+           and authenticating with the credentials.
+
+        Concurrent calls are serialized, so an expired token is only renewed once.
+
+        Args:
+            force (bool): Whether the current token was rejected, the first step only reusing
+                a cached token another replica has since renewed.
+
+        Raises:
+            TVTimeAuthError: If every way of getting a token failed.
+
+        Returns:
+            None
+        """
+        async with self._login_lock:
+            rejected = self.token if force else None
+            if force:
+                self.token = ""
+                self.token_expiry = None
+                self.token_issued_at = None
+            # Another process sharing the token cache may have renewed the token already,
+            # a refresh token being only valid once
+            if self.token_expires_soon() and self.token_cache is not None:
+                cached = self.token_cache.load(self.user, self.username)
+                if cached and cached.get("token") not in (rejected, self.token):
+                    self._set_tokens(
+                        cached.get("token", ""), cached.get("refresh_token", ""), persist=False
+                    )
+            if self.token and not self.token_expires_soon():
+                log.info("Reusing the cached token of %s's TVtime account !", self.user)
+                return
+            if self.refresh_token and await self.refresh():
+                return
+            await self.login_with_credentials()
+
+    def token_expires_soon(self) -> bool:
+        """
+        Tells whether the token expires within the refresh margin.
+
+        Returns:
+            bool: True if there is no token or if it is about to expire, False otherwise.
+        """
+        if not self.token:
+            return True
+        if self.token_expiry is None:
+            return False
+        return self.token_expiry - time.time() < self.refresh_margin
+
+    async def ensure_token(self) -> None:
+        """
+        Renews the token if it is about to expire, so requests are not sent with a stale token.
+        """
+        if self.token_expires_soon():
+            log.debug("[%s] The token is about to expire, renewing it...", self.user)
+            await self.login()
+
+    async def relogin(self, rejected_token: str = None) -> None:
+        """
+        Logs in again after TVTime rejected a token.
+
+        The first caller starts the login and the concurrent ones wait for it, so however
+        many requests were rejected, the account logs in once. A caller whose token was
+        already replaced returns straight away.
+
+        Args:
+            rejected_token (str): The token TVTime rejected, the current one if None.
+
+        Raises:
+            TVTimeAuthError: If the login failed or did not finish within relogin_timeout.
+            CircuitOpenError: If the circuit of the auth is open.
+        """
+        if rejected_token is not None and self.token and self.token != rejected_token:
+            return
+        task = self._relogin_task
+        if task is None or task.done():
+            self.relogins += 1
+            task = self._relogin_task = asyncio.ensure_future(self.login(force=True))
+            task.add_done_callback(self._relogin_done)
+        else:
+            self.relogin_waits += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(task), self.relogin_timeout)
+        except TimeoutError as _:
+            raise TVTimeAuthError(
+                f"Timed out after {self.relogin_timeout}s waiting for the login"
+            ) from _
+
+    def _relogin_done(self, task: asyncio.Future) -> None:
+        # Retrieve the error even if every caller stopped waiting for the login
+        if not task.cancelled() and task.exception() is not None:
+            log.warning("[%s] Unable to log in again: %s", self.user, task.exception())
+
+    async def refresh(self) -> bool:
+        """
+        Renews the tokens using the refresh token.
+
+        Returns:
+            bool: True if the tokens were renewed, False otherwise.
+        """
+        log.debug("Trying to refresh %s's TVTime token...", self.user)
+        try:
+            r = await self._request(
+                "auth",
+                "POST",
+                f"{self.auth_url}/refresh",
+                auth=self.refresh_token,
+                content=json.dumps({"refresh_token": self.refresh_token}),
+            )
+            auth_resp = r.json()
+            self._set_tokens(auth_resp["data"]["jwt_token"], auth_resp["data"]["jwt_refresh_token"])
+        except (httpx.HTTPError, ValueError, KeyError, TypeError) as _:
+            log.warning("[%s] Unable to refresh the TVTime token: %s", self.user, _)
+            return False
+
+        log.info("Successfully refreshed %s's TVtime token !", self.user)
+        return True
+
+    def fetch_jwt_token(self) -> str:
+        """
+        Fetches an anonymous JWT token from the local storage of the TVTime web app using Selenium.
+
+        The browser is borrowed from the browser pool, and the local storage polled
+        until the web app stored the token. This method blocks, and is run in a
+        thread by login_with_credentials.
+
+        Raises:
+            TVTimeAuthError: If the browser could not be started or the token could not be found.
+
+        Returns:
+            str: The anonymous JWT token.
+        """
+        try:
+            with self.browser_pool.driver() as driver:
+                driver.get(f"https://{BASE_URL}/welcome?mode=auth")
+                # We need to fetch a JWT token from the local storage in order to connect
+                jwt_token = self.browser_pool.wait_for_item(driver, "flutter.jwtToken")
         except Exception as _:  # pylint: disable=broad-except
-            log.error("Error initializing Firefox driver: %s ", _)
-            sys.exit(1)
+            raise TVTimeAuthError(f"Error fetching JWT token using Selenium: {_}") from _
 
-    def login(self) -> None:
+        if jwt_token is None:
+            raise TVTimeAuthError("Unable to fetch JWT token using Selenium")
+        log.info("JWT token fetched successfully !")
+        return jwt_token.strip('"')
+
+    async def login_with_credentials(self) -> None:
         """
-        Logs in to the TVTime API using Selenium and requests.
+        Logs in to the TVTime API using Selenium and httpx.
 
         This method performs the following steps:
         1. Fetches a JWT token from the local storage using Selenium.
@@ -80,228 +389,434 @@ class TVTime:
         3. Extracts the JWT token and refresh token from the API response.
 
         Raises:
-            Exception: If there is an error fetching the JWT token or connecting to the TVTime API.
+            TVTimeAuthError: If there is an error fetching the JWT token or connecting to the TVTime API.
 
         Returns:
             None
         """
-        driver = self.driver
-        driver.get(f"https://{BASE_URL}/welcome?mode=auth")
-        time.sleep(5)  # The page can take a while to load
-
-        jwt_token: str = None
-        for i in range(1, 4):
-            time.sleep(5 + (2 * i))  # Wait a bit longer each time
-            log.debug(f"Attempt {i} to fetch JWT token")
-            # We need to fetch a JWT token from the local storage in order to connect
-            try:
-                jwt_token = driver.execute_script(
-                    "return window.localStorage.getItem('flutter.jwtToken');"
-                )
-                if jwt_token:
-                    break
-            except Exception as _:  # pylint: disable=broad-except
-                log.error("Error fetching JWT token: %s", _)
-                break
-
-        if jwt_token is None:
-            log.error("Unable to fetch JWT token using Selenium, application must exit.")
-            driver.quit()
-            sys.exit(1)
-        log.info("JWT token fetched successfully ! Exiting Selenium...")
-        driver.quit()
-
-        jwt_token = jwt_token.strip('"')
+        # Do not start a browser for a login bound to be refused
+        self.breakers["auth"].check()
+        jwt_token = await asyncio.to_thread(self.fetch_jwt_token)
 
-        headers = {
-            "Authorization": f"Bearer {jwt_token}",
-            "Content-Type": "application/json",
-        }
         credentials = {"username": self.username, "password": self.password}
         log.debug("Trying to connect to %s's TVTime account...", self.user)
-        login_url = "https://beta-app.tvtime.com/sidecar?" "o=https://auth.tvtime.com/v1/login"
         try:
-            r = requests.post(
-                url=login_url, headers=headers, data=json.dumps(credentials), timeout=(5, 10)
+            r = await self._request(
+                "auth",
+                "POST",
+                f"{self.auth_url}/login",
+                auth=jwt_token,
+                content=json.dumps(credentials),
             )
-        except requests.exceptions.RequestException as _:
-            log.error("Error connecting to TVTime API : %s", _)
+        except httpx.HTTPError as _:
+            raise TVTimeAuthError(f"Error connecting to TVTime API : {_}") from _
 
         try:
             auth_resp = r.json()
         except json.JSONDecodeError as _:
-            log.error("Error decoding JSON response: %s", _)
-            sys.exit(1)
+            raise TVTimeAuthError(f"Error decoding JSON response: {_}") from _
         if auth_resp is None:
-            log.error("Error fetching JWT tokens from TVTime API")
-            sys.exit(1)
+            raise TVTimeAuthError("Error fetching JWT tokens from TVTime API")
         # We need to extract the JWT token and the refresh token from the response
         try:
-            token = auth_resp["data"]["jwt_token"]
-            self.token = token
-            self.refresh_token = auth_resp["data"]["jwt_refresh_token"]
-        except KeyError as _:
-            log.error("Error crafting JWT token for TVTime API : %s", _)
-            sys.exit(1)
+            self._set_tokens(auth_resp["data"]["jwt_token"], auth_resp["data"]["jwt_refresh_token"])
+        except (KeyError, TypeError) as _:
+            raise TVTimeAuthError(f"Error crafting JWT token for TVTime API : {_}") from _
 
         log.info("Successfully connected to %s's TVtime account !", self.user)
 
-    def watch_episode(self, episode_id: int, retry: bool = False) -> None:
+    def _set_tokens(self, token: str, refresh_token: str, persist: bool = True) -> None:
+        self.token = token
+        self.refresh_token = refresh_token
+        self.token_expiry = jwt_expiry(token)
+        issued_at = jwt_claims(token).get("iat")
+        self.token_issued_at = (
+            float(issued_at) if isinstance(issued_at, int | float) else time.time()
+        )
+        if persist and self.token_cache is not None and token:
+            self.token_cache.save(self.user, self.username, token, refresh_token)
+
+    @timed("watch_episode")
+    async def watch_episode(self, episode_id: int) -> bool:
         """
         Marks an episode as watched in TVTime.
 
+        An episode the watched state mirror already holds is not sent again.
+
         Args:
             episode_id (int): The ID of the episode to be marked as watched.
 
         Returns:
-            None
+            bool: True if the episode was marked as watched, False otherwise.
 
         Raises:
-            None: This method does not raise any exceptions.
+            TVTimeAuthError: If the token had to be renewed or was rejected, and logging in failed.
+            CircuitOpenError: If the circuit of the endpoint, or of the auth, is open.
+            TVTimeUnavailableError: If TVTime could not be reached or answered with a server error.
 
         """
 
         if episode_id is None or not isinstance(episode_id, int):
             log.error("Invalid episode ID provided")
+            return False
 
-        headers = {
-            "Authorization": f"Bearer {self.token}",
-            "Content-Type": "application/json",
-            "Host": f"{BASE_URL}:80",
-        }
+        if self.watched is not None and self.watched.has_episode(episode_id):
+            log.info("[%s] Episode %s already watched, skipping", self.user, episode_id)
+            return True
+
+        await self.ensure_token()
 
         watch_api = (
-            f"https://{BASE_URL}/sidecar?"
+            f"{self.api_url}/sidecar?"
             f"o=https://api2.tozelabs.com/v2/watched_episodes/episode/{episode_id}"
             "&is_rewatch=0"
         )
         try:
-            r = requests.post(
-                url=watch_api, headers=headers, data=json.dumps(self.refresh_token), timeout=(5, 10)
-            )
-        except requests.exceptions.RequestException as _:
-            log.error("Error connecting to TVTime API : %s", _)
+            r = await self._request("watched_episodes", "POST", watch_api)
+        except httpx.HTTPError as _:
+            raise TVTimeUnavailableError(f"Error connecting to TVTime API : {_}") from _
 
+        if r.is_server_error:
+            raise TVTimeUnavailableError(f"TVTime answered {r.status_code}")
         try:
             result = r.json()
         except json.JSONDecodeError as _:
-            log.error("Error decoding JSON response: %s", _)
-            if retry:
-                log.error("Error while watching movie a second time !" "Something is not right...")
-                return
-            log.debug("Maybe the jwt token has expired, trying to refresh it...")
-            self.login()
-            log.info("Retrying to watch the episode...")
-            self.watch_episode(episode_id=episode_id, retry=True)
-            return
+            log.error("[%s] Error decoding JSON response (%s): %s", self.user, r.status_code, _)
+            return False
 
         status = result.get("result")
         if status is None or status != "OK":
             log.error("Error while watching episode !")
+            return False
 
-        season = result.get("season").get("number")
+        if self.watched is not None:
+            self.watched.add_episodes([episode_id])
+        season = (result.get("season") or {}).get("number")
         episode = result.get("number")
-        show = result.get("show").get("name")
+        show = (result.get("show") or {}).get("name")
 
         log.info(
             "[%s] Successfully marked %s S%sE%s as watched !", self.user, show, season, episode
         )
+        return True
 
-    def watch_movie(self, movie_uuid: str, retry: bool = False) -> None:
+    async def watch_episodes(self, episode_ids: list[int], max_workers: int = 4) -> dict[int, bool]:
+        """
+        Marks several episodes as watched in TVTime.
+
+        TVTime has no bulk endpoint, so the episodes are sent concurrently over the
+        pooled connections, at most max_workers at a time.
+
+        Args:
+            episode_ids (list): The IDs of the episodes to be marked as watched.
+            max_workers (int): The maximum number of episodes sent at the same time.
+
+        Raises:
+            CircuitOpenError: If the token had to be renewed while the auth circuit is open.
+            TVTimeAuthError: If the token had to be renewed or was rejected, and logging in failed.
+
+        Returns:
+            dict: A mapping of every episode ID to whether it was marked as watched,
+            None meaning it was not sent because TVTime is unavailable and it should be retried.
+        """
+        episode_ids = list(dict.fromkeys(episode_ids))
+        if not episode_ids:
+            return {}
+        # Renew the token once up front rather than in every concurrent call
+        await self.ensure_token()
+        limit = asyncio.Semaphore(max(1, max_workers))
+
+        async def _watch(episode_id: int) -> bool | None:
+            async with limit:
+                try:
+                    return await self.watch_episode(episode_id=episode_id)
+                except RETRYABLE_ERRORS as _:
+                    log.debug("[%s] Episode %s not sent: %s", self.user, episode_id, _)
+                    return None
+
+        results = await asyncio.gather(*(_watch(episode_id) for episode_id in episode_ids))
+        return dict(zip(episode_ids, results, strict=True))
+
+    @timed("watch_movie")
+    async def watch_movie(self, movie_uuid: str) -> bool:
         """
         Watch a movie on TVTime.
 
+        A movie the watched state mirror already holds is not sent again.
+
         Args:
             movie_uuid (str): The UUID of the movie to watch.
 
         Returns:
-            None: This method does not return anything.
+            bool: True if the movie was marked as watched, False otherwise.
 
         Raises:
-            None: This method does not raise any exceptions.
+            TVTimeAuthError: If the token had to be renewed or was rejected, and logging in failed.
+            CircuitOpenError: If the circuit of the endpoint, or of the auth, is open.
+            TVTimeUnavailableError: If TVTime could not be reached or answered with a server error.
         """
 
-        headers = {
-            "Authorization": f"Bearer {self.token}",
-            "Content-Type": "application/json",
-            "Host": f"{BASE_URL}:80",
-        }
+        if self.watched is not None and self.watched.has_movie(movie_uuid):
+            log.info("[%s] Movie %s already watched, skipping", self.user, movie_uuid)
+            return True
+
+        await self.ensure_token()
 
         watch_api = (
-            f"https://{BASE_URL}/sidecar?"
+            f"{self.api_url}/sidecar?"
             f"o=https://msapi.tvtime.com/prod/v1/tracking/{movie_uuid}/watch"
         )
         try:
-            r = requests.post(url=watch_api, headers=headers, timeout=(5, 10))
-        except requests.exceptions.RequestException as _:
-            log.error("Error connecting to TVTime API: %s", _)
-            return
+            r = await self._request("tracking", "POST", watch_api)
+        except httpx.HTTPError as _:
+            raise TVTimeUnavailableError(f"Error connecting to TVTime API : {_}") from _
 
+        if r.is_server_error:
+            raise TVTimeUnavailableError(f"TVTime answered {r.status_code}")
         try:
             result = r.json()
         except json.JSONDecodeError as _:
-            log.error("Error decoding JSON response: %s", _)
-            if retry:
-                log.error("Error while watching movie a second time !" "Something is not right...")
-                return
-            log.debug("Maybe the jwt token has expired, trying to refresh it...")
-            self.login()
-            log.info("Retrying to watch the movie...")
-            self.watch_movie(movie_uuid=movie_uuid, retry=1)
-            return
+            log.error("[%s] Error decoding JSON response (%s): %s", self.user, r.status_code, _)
+            return False
 
         status = result.get("status")
         if status is None or status != "success":
             log.error("Error while watching movie !")
-            return
+            return False
 
+        if self.watched is not None:
+            self.watched.add_movie(movie_uuid)
         log.info("[%s] Successfully marked the movie as watched !", self.user)
+        return True
 
-    def get_movie_uuid(self, movie_id: int) -> str:
+    @timed("get_movie_uuid", failure_values=(None,))
+    async def get_movie_uuid(self, movie_id: int) -> str:
         """
         Retrieves the UUID of a movie from the TVTime API based on the provided movie ID.
 
+        The TVDB ID to UUID mapping never changes, so results are kept in the movie
+        cache when there is one, IDs without a match being cached for a shorter time.
+
         Args:
             movie_id (int): The ID of the movie.
 
+        Raises:
+            CircuitOpenError: If the circuit of the endpoint, or of the auth, is open.
+            TVTimeUnavailableError: If TVTime could not be reached or answered with a server error.
+
         Returns:
             str: The UUID of the movie if found, None otherwise.
         """
         if movie_id is None or not isinstance(movie_id, int):
             log.error("Invalid movie ID provided")
+            return None
 
-        headers = {
-            "Authorization": f"Bearer {self.token}",
-            "Content-Type": "application/json",
-            "Host": f"{BASE_URL}:80",
-        }
+        if self.movie_cache is not None:
+            movie_uuid = self.movie_cache.get(str(movie_id))
+            if movie_uuid is not MISSING:
+                log.debug("[%s] Movie %s found in cache: %s", self.user, movie_id, movie_uuid)
+                return movie_uuid
+
+        await self.ensure_token()
         search_url = (
-            f"https://{BASE_URL}/sidecar?"
+            f"{self.api_url}/sidecar?"
             f"o=https://search.tvtime.com/v1/search/series,movie&q={movie_id}"
             "&offset=0&limit=1"
         )
         try:
-            r = requests.get(url=search_url, headers=headers, timeout=(5, 10))
-        except requests.exceptions.RequestException as _:
-            log.error("Error connecting to TVTime API : %s", _)
+            r = await self._request("search", "GET", search_url)
+        except httpx.HTTPError as _:
+            raise TVTimeUnavailableError(f"Error connecting to TVTime API : {_}") from _
 
         try:
             search = r.json()
         except json.JSONDecodeError as _:
+            if r.is_server_error:
+                raise TVTimeUnavailableError(f"TVTime answered {r.status_code}") from _
             log.error("Error decoding JSON response: %s", _)
             return None
 
         status = search.get("status")
         if status is None or status != "success":
-            log.error(f"Error while searching for the movie {movie_id}")
+            log.error("Error while searching for the movie %s", movie_id)
             return None
 
+        movie_uuid = None
         try:
             movies = search.get("data", [])
             for movie in movies:
                 if movie.get("id") == movie_id:
-                    return movie.get("uuid")
-        except KeyError as _:
+                    movie_uuid = movie.get("uuid")
+                    break
+        except (KeyError, AttributeError) as _:
             log.error("Error while fetching movie UUID : %s", _)
             return None
-        return None
+        if self.movie_cache is not None:
+            self.movie_cache.set(str(movie_id), movie_uuid)
+        return movie_uuid
+
+    async def fetch_watched_episodes(self, page: int, limit: int = 100) -> list[int]:
+        """
+        Fetches a page of the watched episodes of the account, the most recently watched first.
+
+        Args:
+            page (int): The page to fetch, from 0.
+            limit (int): The number of episodes per page.
+
+        Raises:
+            CircuitOpenError: If the circuit of the endpoint, or of the auth, is open.
+            TVTimeUnavailableError: If TVTime could not be reached or did not answer with a page.
+
+        Returns:
+            list: The IDs of the episodes of the page, empty past the last page.
+        """
+        await self.ensure_token()
+        history_url = f"{self.api_url}/sidecar?o={HISTORY_API}&page={page}&limit={limit}"
+        try:
+            r = await self._request("history", "GET", history_url)
+            result = r.json()
+        except httpx.HTTPError as _:
+            raise TVTimeUnavailableError(f"Error connecting to TVTime API : {_}") from _
+        except json.JSONDecodeError as _:
+            raise TVTimeUnavailableError(f"TVTime answered {r.status_code}") from _
+
+        if not isinstance(result, dict) or result.get("result") != "OK":
+            raise TVTimeUnavailableError("Error while fetching the watched episodes")
+        episode_ids = []
+        for item in result.get("watched_episodes") or []:
+            if isinstance(item, dict):
+                item = item.get("id", (item.get("episode") or {}).get("id"))
+            if isinstance(item, int):
+                episode_ids.append(item)
+        return episode_ids
+
+    async def sync_watched(self, full: bool = False, page_size: int = 100) -> int:
+        """
+        Brings the watched state mirror up to date with the history of the account.
+
+        A full sync walks every page of the history. An incremental sync stops at the first
+        page holding no episode the mirror did not know, the history being ordered from
+        the most recently watched episode.
+
+        Args:
+            full (bool): Whether to walk the whole history.
+            page_size (int): The number of episodes fetched per request.
+
+        Raises:
+            CircuitOpenError: If the circuit of the endpoint, or of the auth, is open.
+            TVTimeUnavailableError: If TVTime could not be reached or did not answer with a page.
+
+        Returns:
+            int: The number of episodes added to the mirror.
+        """
+        if self.watched is None:
+            return 0
+        added, page = 0, 0
+        while True:
+            episode_ids = await self.fetch_watched_episodes(page, page_size)
+            new = self.watched.add_episodes(episode_ids)
+            added += new
+            if len(episode_ids) < page_size or not (full or new):
+                break
+            page += 1
+        self.watched.mark_synced()
+        log.info(
+            "[%s] Watched state synced, %d new episode(s) in %d page(s)", self.user, added, page + 1
+        )
+        return added
+
+    async def close(self) -> None:
+        """
+        Closes the HTTP client, unless it is shared with other accounts,
+        and saves the watched state mirror.
+        """
+        if self.watched is not None:
+            self.watched.save()
+        if self._owns_http:
+            await self.http.aclose()
+
+
+class TVTime:
+    """
+    A synchronous client of the TVTime API, kept for compatibility.
+
+    It runs the coroutines of an AsyncTVTime on the event loop shared by the process,
+    so the requests of every account are still multiplexed over the same connections.
+    The attributes of the asynchronous client, such as the tokens, are readable from it.
+
+    Args:
+        plex_user (str): The name of plex's user to map with TVTime.
+        loop (EventLoopThread): The event loop to run on, the shared one if None.
+        **options: The other arguments of AsyncTVTime.
+    """
+
+    def __init__(self, plex_user: str, *args, loop: EventLoopThread = None, **options) -> None:
+        self.client = AsyncTVTime(plex_user, *args, **options)
+        self.loop = loop or shared_loop()
+
+    def __getattr__(self, name: str):
+        return getattr(self.client, name)
+
+    def login(self) -> None:
+        """
+        Logs in to the TVTime API. See AsyncTVTime.login.
+
+        Raises:
+            TVTimeAuthError: If every way of getting a token failed.
+        """
+        self.loop.run(self.client.login())
+
+    def relogin(self, rejected_token: str = None) -> None:
+        """
+        Logs in again after TVTime rejected a token. See AsyncTVTime.relogin.
+        """
+        self.loop.run(self.client.relogin(rejected_token))
+
+    def ensure_token(self) -> None:
+        """
+        Renews the token if it is about to expire. See AsyncTVTime.ensure_token.
+        """
+        self.loop.run(self.client.ensure_token())
+
+    def refresh(self) -> bool:
+        """
+        Renews the tokens using the refresh token. See AsyncTVTime.refresh.
+        """
+        return self.loop.run(self.client.refresh())
+
+    def watch_episode(self, episode_id: int) -> bool:
+        """
+        Marks an episode as watched in TVTime. See AsyncTVTime.watch_episode.
+        """
+        return self.loop.run(self.client.watch_episode(episode_id=episode_id))
+
+    def watch_episodes(self, episode_ids: list[int], max_workers: int = 4) -> dict[int, bool]:
+        """
+        Marks several episodes as watched in TVTime. See AsyncTVTime.watch_episodes.
+        """
+        return self.loop.run(self.client.watch_episodes(episode_ids, max_workers=max_workers))
+
+    def watch_movie(self, movie_uuid: str) -> bool:
+        """
+        Watch a movie on TVTime. See AsyncTVTime.watch_movie.
+        """
+        return self.loop.run(self.client.watch_movie(movie_uuid=movie_uuid))
+
+    def get_movie_uuid(self, movie_id: int) -> str:
+        """
+        Retrieves the UUID of a movie from the TVTime API. See AsyncTVTime.get_movie_uuid.
+        """
+        return self.loop.run(self.client.get_movie_uuid(movie_id=movie_id))
+
+    def sync_watched(self, full: bool = False, page_size: int = 100) -> int:
+        """
+        Brings the watched state mirror up to date. See AsyncTVTime.sync_watched.
+        """
+        return self.loop.run(self.client.sync_watched(full=full, page_size=page_size))
+
+    def close(self) -> None:
+        """
+        Closes the HTTP client, unless it is shared with other accounts,
+        and saves the watched state mirror.
+        """
+        self.loop.run(self.client.close())
@@ -0,0 +1,86 @@
+"""
+This module contains the EventLoopThread class, running the event loop shared by the TVTime clients.
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+from collections.abc import Coroutine
+
+
+class EventLoopThread:
+    """
+    This class runs an asyncio event loop in a background thread.
+
+    Synchronous code submits coroutines to the loop and waits for their result,
+    so every caller shares the loop, and the connections of the clients bound to it.
+
+    Args:
+        name (str): The name of the thread running the loop.
+    """
+
+    def __init__(self, name: str = "event-loop") -> None:
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coroutine: Coroutine, timeout: float = None):
+        """
+        Runs a coroutine on the loop and waits for its result.
+
+        The coroutine sees the context variables of the caller, such as the correlation ID
+        of its log records.
+
+        Args:
+            coroutine (Coroutine): The coroutine to run.
+            timeout (float): The maximum number of seconds to wait, None waiting forever.
+
+        Raises:
+            Exception: Whatever the coroutine raised.
+
+        Returns:
+            The result of the coroutine.
+        """
+        context = contextvars.copy_context()
+
+        async def _in_context():
+            for var, value in context.items():
+                var.set(value)
+            return await coroutine
+
+        return asyncio.run_coroutine_threadsafe(_in_context(), self.loop).result(timeout)
+
+    def stop(self) -> None:
+        """
+        Stops the loop and waits for its thread to exit.
+        """
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+_shared: EventLoopThread = None
+_shared_pid: int = None
+_shared_lock = threading.Lock()
+
+
+def shared_loop() -> EventLoopThread:
+    """
+    Returns the event loop shared by the process, starting it on first use.
+
+    A forked process starts its own loop, the thread of its parent not surviving the fork.
+
+    Returns:
+        EventLoopThread: The shared event loop.
+    """
+    global _shared, _shared_pid  # pylint: disable=global-statement
+    with _shared_lock:
+        if _shared is None or _shared_pid != os.getpid():
+            _shared = EventLoopThread(name="tvtime-loop")
+            _shared_pid = os.getpid()
+        return _shared
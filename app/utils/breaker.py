@@ -0,0 +1,143 @@
+"""
+This module contains the CircuitBreaker class, which stops calling an upstream that keeps failing.
+"""
+
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when a call is refused because its circuit is open.
+
+    Args:
+        name (str): The name of the circuit.
+        retry_after (float): The number of seconds after which the circuit lets a probe through.
+    """
+
+    def __init__(self, name: str, retry_after: float) -> None:
+        super().__init__(f"Circuit {name} is open, retrying in {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    This class is a thread-safe circuit breaker.
+
+    The circuit opens after failure_threshold consecutive failures, refusing every
+    call for reset_timeout seconds. It then lets a single probe through: the circuit
+    closes if the probe succeeds, and opens again if it fails.
+
+    Args:
+        name (str): The name of the circuit, for logging purposes.
+        failure_threshold (int): The number of consecutive failures opening the circuit.
+        reset_timeout (float): The number of seconds the circuit stays open before a probe.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30) -> None:
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.refused = 0
+        self._opened_at = 0.0
+        self._probe_started_at: float = None
+        self._lock = threading.Lock()
+
+    def retry_after(self) -> float:
+        """
+        Returns the number of seconds before the circuit lets a call through.
+
+        Returns:
+            float: 0 if the circuit is closed or ready for a probe.
+        """
+        with self._lock:
+            return self._retry_after(time.monotonic())
+
+    def _retry_after(self, now: float) -> float:
+        if self.state == CLOSED:
+            return 0.0
+        if self._probe_started_at is not None:
+            # A probe is in flight, the next one may only start if it is lost
+            return max(0.0, self._probe_started_at + self.reset_timeout - now)
+        return max(0.0, self._opened_at + self.reset_timeout - now)
+
+    def check(self) -> None:
+        """
+        Raises if a call would be refused, without starting a probe.
+
+        Raises:
+            CircuitOpenError: If the circuit is open.
+        """
+        with self._lock:
+            retry_after = self._retry_after(time.monotonic())
+        if retry_after:
+            raise CircuitOpenError(self.name, retry_after)
+
+    def before_call(self) -> None:
+        """
+        Lets a call through, as a probe if the circuit is half-open.
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or half-open with a probe in flight.
+        """
+        with self._lock:
+            now = time.monotonic()
+            retry_after = self._retry_after(now)
+            if retry_after:
+                self.refused += 1
+                raise CircuitOpenError(self.name, retry_after)
+            if self.state != CLOSED:
+                self.state = HALF_OPEN
+                self._probe_started_at = now
+
+    def record_success(self) -> None:
+        """
+        Records a successful call, closing the circuit.
+        """
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_started_at = None
+
+    def record_failure(self) -> bool:
+        """
+        Records a failed call, opening the circuit if it failed too many times in a row.
+
+        Returns:
+            bool: True if the call opened the circuit, False otherwise.
+        """
+        with self._lock:
+            self.failures += 1
+            if self.state == OPEN:
+                return False
+            if self.state == CLOSED and self.failures < self.failure_threshold:
+                return False
+            self.state = OPEN
+            self.opened += 1
+            self._opened_at = time.monotonic()
+            self._probe_started_at = None
+            return True
+
+    def stats(self) -> dict:
+        """
+        Returns the state of the circuit.
+
+        Returns:
+            dict: The state, consecutive failures, times opened, refused calls and retry delay.
+        """
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "opened": self.opened,
+                "refused": self.refused,
+                "retry_after": round(self._retry_after(time.monotonic()), 1),
+            }
@@ -0,0 +1,229 @@
+"""
+This module contains the BrowserPool class, a small pool of warm headless Firefox browsers.
+
+Selenium is only imported when a browser is started: logging in from cached tokens,
+the common case, never pays for it.
+"""
+
+import contextlib
+import logging
+import threading
+import time
+from collections.abc import Iterator
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from selenium import webdriver
+
+
+class _Browser:  # pylint: disable=too-few-public-methods
+    __slots__ = ("driver", "uses", "released_at")
+
+    def __init__(self, driver: "webdriver.Firefox") -> None:
+        self.driver = driver
+        self.uses = 0
+        self.released_at = time.monotonic()
+
+
+class BrowserPool:  # pylint: disable=too-many-instance-attributes
+    """
+    This class shares a few headless Firefox browsers between every TVTime account.
+
+    Browsers are started on first use, kept warm between uses and recycled after
+    max_uses, so logging in again does not pay for a browser start. Idle browsers
+    are quit after idle_timeout to give their memory back.
+
+    Args:
+        driver_location (str): The location of the Firefox driver executable.
+        browser_location (str): The location of the Firefox browser executable.
+        size (int): The maximum number of browsers running at the same time.
+        max_uses (int): The number of uses after which a browser is recycled.
+        idle_timeout (float): The number of seconds after which an idle browser is quit.
+        load_timeout (float): The maximum number of seconds to wait for a page or a value.
+        poll_interval (float): The number of seconds between two reads of a value.
+    """
+
+    def __init__(
+        self,
+        driver_location: str = None,
+        browser_location: str = None,
+        size: int = 1,
+        max_uses: int = 20,
+        idle_timeout: float = 300,
+        load_timeout: float = 30,
+        poll_interval: float = 0.25,
+    ) -> None:  # pylint: disable=too-many-arguments
+        self.driver_location = driver_location
+        self.browser_location = browser_location
+        self.size = max(1, size)
+        self.max_uses = max(1, max_uses)
+        self.idle_timeout = idle_timeout
+        self.load_timeout = load_timeout
+        self.poll_interval = poll_interval
+        self.started = 0
+        self.recycled = 0
+        self._idle: list[_Browser] = []
+        self._cond = threading.Condition()
+        self._reaper: threading.Thread = None
+
+    @contextlib.contextmanager
+    def driver(self) -> Iterator["webdriver.Firefox"]:
+        """
+        Borrows a browser, waiting for one to be released if they are all in use.
+
+        A browser raising while borrowed is quit rather than given back.
+
+        Raises:
+            WebDriverException: If a new browser could not be started.
+
+        Yields:
+            webdriver.Firefox: The browser.
+        """
+        browser = self._acquire()
+        try:
+            yield browser.driver
+        except BaseException:
+            self._discard(browser)
+            raise
+        self._release(browser)
+
+    def wait_for_item(self, driver: "webdriver.Firefox", key: str) -> str | None:
+        """
+        Polls the local storage of the current page until it holds a value.
+
+        Args:
+            driver (webdriver.Firefox): The browser.
+            key (str): The local storage key.
+
+        Returns:
+            str: The value, or None if it did not show up within load_timeout.
+        """
+        deadline = time.monotonic() + self.load_timeout
+        while True:
+            value = driver.execute_script("return window.localStorage.getItem(arguments[0]);", key)
+            if value or time.monotonic() >= deadline:
+                return value or None
+            time.sleep(self.poll_interval)
+
+    def stats(self) -> dict:
+        """
+        Returns the usage of the pool.
+
+        Returns:
+            dict: The size of the pool, the running and idle browsers and the recycled count.
+        """
+        with self._cond:
+            return {
+                "size": self.size,
+                "running": self.started,
+                "idle": len(self._idle),
+                "recycled": self.recycled,
+            }
+
+    def close(self) -> None:
+        """
+        Quits the idle browsers. The pool starts new ones if it is used again.
+        """
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self.started -= len(idle)
+            self._cond.notify_all()
+        for browser in idle:
+            self._quit(browser)
+
+    def _start(self) -> "webdriver.Firefox":
+        # pylint: disable=import-outside-toplevel
+        from selenium import webdriver
+        from selenium.webdriver.firefox.options import Options
+        from selenium.webdriver.firefox.service import Service
+
+        options = Options()
+        options.add_argument("--headless")
+        options.add_argument("--no-sandbox")
+        options.add_argument("--disable-dev-shm-usage")
+        options.add_argument("--disable-gpu")
+        options.add_argument("--allow-origins=*")
+        options.add_argument("--log-level=3")
+        if self.browser_location:
+            options.binary_location = self.browser_location
+        logging.info("Initializing Firefox driver...")
+        driver = webdriver.Firefox(service=Service(self.driver_location), options=options)
+        driver.set_page_load_timeout(self.load_timeout)
+        return driver
+
+    def _acquire(self) -> _Browser:
+        with self._cond:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self.started < self.size:
+                    self.started += 1
+                    break
+                self._cond.wait()
+        try:
+            return _Browser(self._start())
+        except BaseException:
+            with self._cond:
+                self.started -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, browser: _Browser) -> None:
+        browser.uses += 1
+        if browser.uses >= self.max_uses or not self._reset(browser):
+            self._discard(browser)
+            return
+        browser.released_at = time.monotonic()
+        with self._cond:
+            self._idle.append(browser)
+            self._cond.notify()
+            if self.idle_timeout and self._reaper is None:
+                self._reaper = threading.Thread(
+                    target=self._reap, name="browser-reaper", daemon=True
+                )
+                self._reaper.start()
+
+    def _discard(self, browser: _Browser) -> None:
+        with self._cond:
+            self.started -= 1
+            self.recycled += 1
+            self._cond.notify()
+        self._quit(browser)
+
+    @staticmethod
+    def _reset(browser: _Browser) -> bool:
+        # Another account must not find the storage of the previous one
+        try:
+            browser.driver.execute_script(
+                "window.localStorage.clear(); window.sessionStorage.clear();"
+            )
+            browser.driver.delete_all_cookies()
+            browser.driver.get("about:blank")
+            return True
+        except Exception as exc:  # pylint: disable=broad-except
+            logging.warning("Unable to reset the browser, recycling it: %s", exc)
+            return False
+
+    @staticmethod
+    def _quit(browser: _Browser) -> None:
+        try:
+            browser.driver.quit()
+        except Exception as exc:  # pylint: disable=broad-except
+            logging.warning("Error quitting the browser: %s", exc)
+
+    def _reap(self) -> None:
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                expired = [b for b in self._idle if now - b.released_at >= self.idle_timeout]
+                for browser in expired:
+                    self._idle.remove(browser)
+                self.started -= len(expired)
+                if not self._idle and not expired:
+                    self._reaper = None
+                    return
+                if not expired:
+                    self._cond.wait(self.idle_timeout / 2)
+            for browser in expired:
+                logging.debug("Quitting a browser idle for %ss", self.idle_timeout)
+                self._quit(browser)
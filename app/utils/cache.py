@@ -0,0 +1,188 @@
+"""
+This module contains the TTLCache class, a bounded LRU cache with expiring entries persisted on disk.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from utils.state import StateBackend, StateError  # pylint: disable=import-error
+
+MISSING = object()
+
+
+class TTLCache:  # pylint: disable=too-many-instance-attributes
+    """
+    This class is a thread-safe LRU cache whose entries expire after a time to live.
+
+    A None value is a negative entry, remembering that a key has no match, and
+    expires after its own, usually shorter, time to live. Expiry times are wall-clock
+    timestamps so entries stay valid across restarts when the cache is persisted.
+    With a shared state, entries are written through to it, and a local miss is read
+    from it, so a lookup made by one replica serves them all.
+
+    Args:
+        max_size (int): The maximum number of entries, the least recently used being evicted.
+        ttl (float): The number of seconds a value is kept.
+        negative_ttl (float): The number of seconds a negative entry is kept.
+        path (str): The JSON file the cache is persisted to, if any.
+        flush_every (int): The number of writes after which the cache is saved to disk.
+        state (StateBackend): The state shared by the replicas, if any.
+        namespace (str): The prefix of the keys of the cache in the shared state.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 10000,
+        ttl: float = 30 * 24 * 3600,
+        negative_ttl: float = 3600,
+        path: str = None,
+        flush_every: int = 20,
+        state: StateBackend = None,
+        namespace: str = "cache:",
+    ):  # pylint: disable=too-many-arguments
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.path = path
+        self.flush_every = flush_every
+        self.state = state
+        self.namespace = namespace
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._dirty = 0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        if path:
+            self.load()
+
+    def get(self, key: str):
+        """
+        Retrieves a value from the cache.
+
+        Args:
+            key (str): The key of the value.
+
+        Returns:
+            The cached value, None for a negative entry, or MISSING if the key is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] < time.time():
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and self.state is not None:
+            entry = self._load_shared(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            if entry[0] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return entry[0]
+
+    def set(self, key: str, value) -> None:
+        """
+        Stores a value in the cache.
+
+        Args:
+            key (str): The key of the value.
+            value: The value, None recording that the key has no match.
+        """
+        ttl = self.negative_ttl if value is None else self.ttl
+        expires_at = time.time() + ttl
+        self._store(key, value, expires_at)
+        if self.state is not None:
+            try:
+                self.state.set(self.namespace + key, json.dumps([value, expires_at]), ttl)
+            except StateError as exc:
+                logging.warning("Unable to share the cached %s: %s", key, exc)
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss counters of the cache.
+
+        Returns:
+            dict: The number of entries, hits, negative hits and misses.
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+            }
+
+    def load(self) -> None:
+        """
+        Loads the unexpired entries persisted on disk.
+        """
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            logging.warning("Ignoring unreadable cache %s: %s", self.path, exc)
+            return
+        now = time.time()
+        with self._lock:
+            for key, value, expires_at in entries[-self.max_size :]:
+                if expires_at > now:
+                    self._entries[key] = (value, expires_at)
+
+    def save(self) -> None:
+        """
+        Persists the cache to disk, atomically.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            entries = [
+                [key, value, expires_at] for key, (value, expires_at) in self._entries.items()
+            ]
+            self._dirty = 0
+        tmp_path = f"{self.path}.tmp"
+        with self._save_lock:
+            try:
+                if os.path.dirname(self.path):
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(entries, f)
+                os.replace(tmp_path, self.path)
+            except OSError as exc:
+                logging.error("Error saving cache %s: %s", self.path, exc)
+
+    def _store(self, key: str, value, expires_at: float) -> None:
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._dirty += 1
+            flush = self.path and self._dirty >= self.flush_every
+        if flush:
+            self.save()
+
+    def _load_shared(self, key: str) -> tuple | None:
+        try:
+            data = self.state.get(self.namespace + key)
+            if data is None:
+                return None
+            value, expires_at = json.loads(data)
+        except (StateError, ValueError, TypeError) as exc:
+            logging.warning("Unable to read the shared cached %s: %s", key, exc)
+            return None
+        if expires_at < time.time():
+            return None
+        self._store(key, value, expires_at)
+        return value, expires_at
@@ -1,31 +1,90 @@
 """
-This module contains the Config class which is used to load and get configuration data.
+This module contains the Config class which is used to load and get configuration data,
+and the ConfigWatcher class which reloads it when the file changes.
 """
 
 import logging
+import os
+import threading
+from collections.abc import Callable
 
 import yaml
 
 
+def _flatten(value, prefix: str, values: dict) -> None:
+    if not isinstance(value, dict):
+        return
+    for k, v in value.items():
+        key = f"{prefix}{k}"
+        values[key] = v
+        _flatten(v, f"{key}.", values)
+
+
 class Config:
     """
     This class is used to load and get configuration data.
+
+    Every dotted key is precomputed when the file is loaded, so lookups are
+    single dictionary reads.
     """
 
     def __init__(self, config_path: str) -> None:
         self.config = None
         self.config_path = config_path
+        self._values: dict = {}
+        self._stamp: tuple = None
+
+    def _file_stamp(self) -> tuple:
+        stat = os.stat(self.config_path)
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _read(self):
+        with open(self.config_path, encoding="utf-8") as f:
+            return yaml.safe_load(f)
+
+    def _apply(self, config, stamp: tuple) -> None:
+        values = {}
+        _flatten(config, "", values)
+        self._values = values
+        self.config = config
+        self._stamp = stamp
 
     def load(self) -> None:
         """
         This method loads the configuration data from the specified path.
         """
         try:
-            with open(self.config_path, encoding="utf-8") as f:
-                self.config = yaml.safe_load(f)
+            stamp = self._file_stamp()
+            self._apply(self._read(), stamp)
         except FileNotFoundError as exc:
             logging.error("Config file not found: %s", exc)
 
+    def reload(self) -> bool:
+        """
+        This method loads the configuration data again if the file changed since it was loaded.
+        An invalid file is logged and ignored, the current configuration being kept.
+
+        Returns:
+            bool: True if the configuration changed, False otherwise.
+        """
+        try:
+            stamp = self._file_stamp()
+        except OSError:
+            return False
+        if stamp == self._stamp:
+            return False
+        try:
+            config = self._read()
+        except (OSError, yaml.YAMLError) as exc:
+            logging.error("Ignoring the invalid config file: %s", exc)
+            self._stamp = stamp
+            return False
+        if config == self.config:
+            self._stamp = stamp
+            return False
+        self._apply(config, stamp)
+        return True
+
     def get_config_of(self, key: str, default=None):
         """
         This method retrieves the configuration data for the given key.
@@ -33,15 +92,45 @@ class Config:
         """
         if self.config is None:
             self.load()
-        if self.config is None:
-            return default
-
-        # Handle nested keys
-        keys = key.split(".")
-        value = self.config
-        for k in keys:
-            if isinstance(value, dict) and k in value:
-                value = value[k]
-            else:
-                return default
-        return value
+        return self._values.get(key, default)
+
+
+class ConfigWatcher:
+    """
+    This class polls the configuration file and calls a function when its content changes.
+
+    Args:
+        config (Config): The loaded configuration.
+        interval (float): The number of seconds between two checks of the file.
+        on_change (Callable): The function called, without arguments, after the configuration changed.
+    """
+
+    def __init__(self, config: Config, interval: float, on_change: Callable[[], None]) -> None:
+        self.config = config
+        self.interval = interval
+        self.on_change = on_change
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._watch, name="config-watcher", daemon=True)
+
+    def start(self) -> None:
+        """
+        Starts watching the file.
+        """
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops watching the file.
+        """
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                if self.config.reload():
+                    logging.info("Reloading the configuration of %s...", self.config.config_path)
+                    self.on_change()
+            except Exception as exc:  # pylint: disable=broad-except
+                logging.error("Error reloading the configuration: %s", exc)
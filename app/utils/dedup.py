@@ -0,0 +1,108 @@
+"""
+This module contains the DedupWindow class which suppresses repeated events within a time window.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+
+from utils.state import StateBackend, StateError  # pylint: disable=import-error
+
+
+class DedupWindow:
+    """
+    This class remembers the keys seen within a sliding time window.
+
+    Keys are kept in insertion order with the time they were first seen, so
+    expired keys are always at the front and eviction is amortised O(1). With a shared
+    state, a key new to this replica is also added there, expiring after the window, so
+    an event received by several replicas only passes once.
+
+    Args:
+        window (float): The number of seconds during which a repeated key is a duplicate.
+        max_keys (int): The maximum number of keys remembered, the oldest being evicted first.
+        state (StateBackend): The state shared by the replicas, if any.
+    """
+
+    def __init__(
+        self, window: float = 300, max_keys: int = 10000, state: StateBackend = None
+    ) -> None:
+        self.window = window
+        self.max_keys = max_keys
+        self.state = state
+        self.passed = 0
+        self.suppressed = 0
+        self._seen: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_duplicate(self, key: Hashable) -> bool:
+        """
+        Tells whether a key was already seen within the window, remembering it otherwise.
+
+        Args:
+            key (Hashable): The key identifying the event.
+
+        Returns:
+            bool: True if the event is a duplicate, False otherwise.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            if key in self._seen:
+                self.suppressed += 1
+                return True
+            self._seen[key] = now
+        if self.state is not None and not self._add_shared(key):
+            with self._lock:
+                self.suppressed += 1
+            return True
+        with self._lock:
+            self.passed += 1
+        return False
+
+    def forget(self, key: Hashable) -> None:
+        """
+        Forgets a key, so the next event with the same key is not considered a duplicate.
+
+        Args:
+            key (Hashable): The key identifying the event.
+        """
+        with self._lock:
+            self._seen.pop(key, None)
+        if self.state is not None:
+            try:
+                self.state.delete(self._shared_key(key))
+            except StateError as exc:
+                logging.warning("Unable to forget the shared deduplication key: %s", exc)
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the window.
+
+        Returns:
+            dict: The number of remembered keys, passed and suppressed events.
+        """
+        with self._lock:
+            return {"keys": len(self._seen), "passed": self.passed, "suppressed": self.suppressed}
+
+    @staticmethod
+    def _shared_key(key: Hashable) -> str:
+        parts = key if isinstance(key, tuple) else (key,)
+        return "dedup:" + ":".join(map(str, parts))
+
+    def _add_shared(self, key: Hashable) -> bool:
+        try:
+            return self.state.add(self._shared_key(key), "1", self.window)
+        except StateError as exc:
+            # Letting the event through risks a duplicate, dropping it risks losing a scrobble
+            logging.warning("Unable to check the shared deduplication key: %s", exc)
+            return True
+
+    def _evict(self, now: float) -> None:
+        while self._seen:
+            key, seen_at = next(iter(self._seen.items()))
+            if now - seen_at < self.window and len(self._seen) < self.max_keys:
+                return
+            del self._seen[key]
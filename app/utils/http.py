@@ -0,0 +1,134 @@
+"""
+This module provides the HTTP connection pool shared by the TVTime clients.
+"""
+
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+@dataclass
+class HttpSettings:  # pylint: disable=too-many-instance-attributes
+    """
+    The connection pool, timeout and retry settings of the TVTime HTTP clients.
+
+    Args:
+        pool_size (int): The maximum number of connections, shared by every account.
+        connect_timeout (float): The number of seconds to wait for a connection.
+        read_timeout (float): The number of seconds to wait for a response.
+        retries (int): The number of retries of a request failing with a 429 or 5xx response.
+        backoff_factor (float): The base of the exponential backoff between retries, in seconds.
+        backoff_jitter (float): The maximum random number of seconds added to each backoff.
+        http2 (bool): Whether requests are multiplexed over HTTP/2 connections.
+        max_concurrency (int): The maximum number of requests in flight per account.
+    """
+
+    pool_size: int = 4
+    connect_timeout: float = 5
+    read_timeout: float = 10
+    retries: int = 3
+    backoff_factor: float = 0.5
+    backoff_jitter: float = 0.5
+    http2: bool = True
+    max_concurrency: int = 4
+
+    @property
+    def timeout(self) -> httpx.Timeout:
+        """
+        Returns the timeouts of the requests.
+        """
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+    @classmethod
+    def from_config(cls, settings: dict | None) -> "HttpSettings":
+        """
+        Builds the settings from the "http" section of the configuration.
+
+        Args:
+            settings (dict): The "http" section, unknown keys being ignored.
+
+        Returns:
+            HttpSettings: The settings, with defaults for missing keys.
+        """
+        settings = settings or {}
+        return cls(**{k: v for k, v in settings.items() if k in cls.__dataclass_fields__})
+
+
+def create_client(settings: HttpSettings) -> httpx.AsyncClient:
+    """
+    Creates a keep-alive asynchronous HTTP client, retrying failed connections.
+
+    A single client is meant to be shared by every TVTime account: with HTTP/2,
+    their requests are multiplexed over a few connections.
+
+    Args:
+        settings (HttpSettings): The pool and retry settings.
+
+    Returns:
+        httpx.AsyncClient: The client.
+    """
+    limits = httpx.Limits(
+        max_connections=settings.pool_size, max_keepalive_connections=settings.pool_size
+    )
+    transport = httpx.AsyncHTTPTransport(
+        http2=settings.http2, limits=limits, retries=settings.retries
+    )
+    return httpx.AsyncClient(
+        http2=settings.http2, limits=limits, timeout=settings.timeout, transport=transport
+    )
+
+
+def _retry_after(response: httpx.Response) -> float | None:
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+async def send(
+    client: httpx.AsyncClient, settings: HttpSettings, method: str, url: str, **kwargs
+) -> httpx.Response:
+    """
+    Sends a request, retrying throttled and failed responses with a jittered exponential backoff.
+
+    The Retry-After header of a response is honoured when there is one.
+
+    Args:
+        client (httpx.AsyncClient): The client to send the request with.
+        settings (HttpSettings): The retry settings.
+        method (str): The HTTP method.
+        url (str): The URL of the request.
+        **kwargs: The arguments of httpx.AsyncClient.request.
+
+    Raises:
+        httpx.HTTPError: If the request could not be sent.
+
+    Returns:
+        httpx.Response: The last response received.
+    """
+    attempt = 0
+    while True:
+        response = await client.request(method, url, **kwargs)
+        if response.status_code not in RETRY_STATUSES or attempt >= settings.retries:
+            return response
+        delay = _retry_after(response)
+        if delay is None:
+            delay = settings.backoff_factor * (2**attempt) + random.uniform(
+                0, settings.backoff_jitter
+            )
+        await response.aclose()
+        attempt += 1
+        await asyncio.sleep(delay)
@@ -0,0 +1,211 @@
+"""
+This module contains the ScrobbleJournal class, a durable on-disk journal of accepted scrobbles.
+"""
+
+import fcntl
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scrobbles (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    plex_user TEXT NOT NULL,
+    media_type TEXT NOT NULL,
+    media_id INTEGER NOT NULL,
+    media_name TEXT,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+
+class _Append:  # pylint: disable=too-few-public-methods
+    """
+    A pending append, waited on by the caller until its batch is committed.
+    """
+
+    __slots__ = ("row", "entry_id", "error", "committed")
+
+    def __init__(self, row: tuple) -> None:
+        self.row = row
+        self.entry_id: int = None
+        self.error: Exception = None
+        self.committed = threading.Event()
+
+
+class ScrobbleJournal:
+    """
+    This class journals every accepted scrobble in an SQLite database in WAL mode.
+
+    Appends are group-committed by a single writer thread: every append waiting
+    while a commit is in progress is written by the next transaction, so a burst
+    of scrobbles costs one fsync instead of one per event. Entries are deleted
+    once done, so the journal only ever holds the scrobbles left to replay.
+
+    Args:
+        path (str): The path of the SQLite database.
+        max_attempts (int): The number of failed attempts after which an entry is given up.
+    """
+
+    def __init__(self, path: str, max_attempts: int = 5) -> None:
+        self.path = path
+        self.max_attempts = max_attempts
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(SCHEMA)
+        self._db_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._appends: list[_Append] = []
+        self._done: list[int] = []
+        self._failed: list[int] = []
+        self._closed = False
+        self._replay_lock = None
+        self._writer = threading.Thread(target=self._write, name="journal-writer", daemon=True)
+        self._writer.start()
+
+    def append(self, plex_user: str, media_type: str, media_id: int, media_name: str) -> int:
+        """
+        Appends a scrobble to the journal, returning once it is durably written.
+
+        Args:
+            plex_user (str): The lowercased Plex account title.
+            media_type (str): The Plex library section type.
+            media_id (int): The TVDB ID of the movie or the episode.
+            media_name (str): The title of the movie or of the show.
+
+        Returns:
+            int: The ID of the journal entry.
+        """
+        pending = _Append((plex_user, media_type, media_id, media_name, time.time()))
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Journal is closed")
+            self._appends.append(pending)
+            self._cond.notify()
+        pending.committed.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.entry_id
+
+    def mark_done(self, entry_id: int) -> None:
+        """
+        Removes an entry from the journal. The removal is committed with the next batch.
+
+        Args:
+            entry_id (int): The ID of the journal entry.
+        """
+        with self._cond:
+            self._done.append(entry_id)
+            self._cond.notify()
+
+    def mark_failed(self, entry_id: int) -> None:
+        """
+        Records a failed attempt of an entry, removing it once it reached the maximum attempts.
+
+        Args:
+            entry_id (int): The ID of the journal entry.
+        """
+        with self._cond:
+            self._failed.append(entry_id)
+            self._cond.notify()
+
+    def pending(self) -> list[tuple]:
+        """
+        Returns the entries left to replay, oldest first.
+
+        Returns:
+            list: A list of (id, plex_user, media_type, media_id, media_name) tuples.
+        """
+        with self._db_lock:
+            return self._conn.execute(
+                "SELECT id, plex_user, media_type, media_id, media_name FROM scrobbles ORDER BY id"
+            ).fetchall()
+
+    def acquire_replay_lock(self) -> bool:
+        """
+        Tries to become the only process replaying the journal, for as long as it runs.
+
+        When several server processes share the journal, only the one holding the
+        lock replays the pending entries, so they are not sent once per process.
+
+        Returns:
+            bool: True if the lock is held by this journal, False if another process holds it.
+        """
+        if self._replay_lock is not None:
+            return True
+        lock_path = f"{self.path}.lock"
+        lock = open(lock_path, "a", encoding="utf-8")  # pylint: disable=consider-using-with
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return False
+        self._replay_lock = lock
+        return True
+
+    def close(self) -> None:
+        """
+        Commits everything still pending and closes the journal.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._writer.join()
+        with self._db_lock:
+            self._conn.close()
+        if self._replay_lock is not None:
+            self._replay_lock.close()
+            self._replay_lock = None
+
+    def _write(self) -> None:
+        while True:
+            with self._cond:
+                while not (self._appends or self._done or self._failed or self._closed):
+                    self._cond.wait()
+                if self._closed and not (self._appends or self._done or self._failed):
+                    return
+                appends, self._appends = self._appends, []
+                done, self._done = self._done, []
+                failed, self._failed = self._failed, []
+            error = None
+            with self._db_lock:
+                try:
+                    self._conn.execute("BEGIN")
+                    for pending in appends:
+                        pending.entry_id = self._conn.execute(
+                            "INSERT INTO scrobbles "
+                            "(plex_user, media_type, media_id, media_name, created_at) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            pending.row,
+                        ).lastrowid
+                    if done:
+                        self._conn.executemany(
+                            "DELETE FROM scrobbles WHERE id = ?", [(i,) for i in done]
+                        )
+                    if failed:
+                        self._conn.executemany(
+                            "UPDATE scrobbles SET attempts = attempts + 1 WHERE id = ?",
+                            [(i,) for i in failed],
+                        )
+                        given_up = self._conn.execute(
+                            "DELETE FROM scrobbles WHERE attempts >= ?", (self.max_attempts,)
+                        ).rowcount
+                        if given_up:
+                            logging.error(
+                                "Giving up %d scrobble(s) after too many attempts", given_up
+                            )
+                    self._conn.execute("COMMIT")
+                except sqlite3.Error as exc:
+                    logging.error("Error writing to the scrobble journal: %s", exc)
+                    if self._conn.in_transaction:
+                        self._conn.execute("ROLLBACK")
+                    error = exc
+            for pending in appends:
+                pending.error = error
+                pending.committed.set()
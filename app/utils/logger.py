@@ -1,15 +1,82 @@
 """
-This module provides a ColoredFormatter class for colored logging output.
+This module sets up the logging pipeline: records are queued by the threads logging them
+and written by a background listener, either coloured or as JSON lines.
+
+It also carries the correlation ID tying the log records of a scrobble together,
+from the webhook request to the TVTime responses.
 """
 
+import atexit
+import contextlib
+import contextvars
+import copy
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import uuid
+from datetime import UTC, datetime
 
 from termcolor import colored
 
+correlation_id: contextvars.ContextVar[str] = contextvars.ContextVar("correlation_id", default="")
+
+_handler: logging.handlers.QueueHandler = None
+_listener: logging.handlers.QueueListener = None
+
+
+def new_correlation_id() -> str:
+    """
+    Generates a correlation ID.
+
+    Returns:
+        str: A short random hexadecimal ID.
+    """
+    return uuid.uuid4().hex[:12]
+
+
+def current_correlation_id() -> str:
+    """
+    Returns the correlation ID of the current context, generating one if there is none.
+
+    Returns:
+        str: The correlation ID.
+    """
+    return correlation_id.get() or new_correlation_id()
+
+
+@contextlib.contextmanager
+def correlation(value: str):
+    """
+    Tags the log records emitted within the block with a correlation ID.
+
+    Args:
+        value (str): The correlation ID.
+    """
+    token = correlation_id.set(value)
+    try:
+        yield value
+    finally:
+        correlation_id.reset(token)
+
+
+class CorrelationFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """
+    This class stamps every record with the correlation ID of the thread logging it.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = correlation_id.get()
+        return True
+
 
 class ColoredFormatter(logging.Formatter):
     """
     This class provides a formatter for logging output with colors.
+
+    The level name is coloured on a copy of the record, the record itself being
+    shared with the other handlers.
     """
 
     COLORS = {
@@ -19,6 +86,7 @@ class ColoredFormatter(logging.Formatter):
         "CRITICAL": "red",
         "ERROR": "red",
     }
+    LEVELS = {level: colored(level, color) for level, color in COLORS.items()}
 
     def format(self, record):
         """
@@ -30,18 +98,85 @@ class ColoredFormatter(logging.Formatter):
         Returns:
             str: The formatted log record.
         """
-        colored_record = record
-        levelname = record.levelname
-        if levelname in self.COLORS:
-            colored_levelname = colored(levelname, self.COLORS[levelname])
-            colored_record.levelname = colored_levelname
-        return super().format(colored_record)
+        record = copy.copy(record)
+        record.levelname = self.LEVELS.get(record.levelname, record.levelname)
+        if getattr(record, "correlation_id", ""):
+            record.msg = f"[{record.correlation_id}] {record.getMessage()}"
+            record.args = None
+        return super().format(record)
 
 
-def setup_logging():
+class JsonFormatter(logging.Formatter):
+    """
+    This class formats log records as JSON lines, for log aggregators.
+    """
+
+    def format(self, record):
+        """
+        Formats the log record as a JSON object.
+
+        Args:
+            record (logging.LogRecord): The log record to format.
+
+        Returns:
+            str: The JSON object, on a single line.
+        """
+        entry = {
+            "time": datetime.fromtimestamp(record.created, UTC).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "correlation_id", ""):
+            entry["correlation_id"] = record.correlation_id
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the arguments into the message now, as they may change once the call returns,
+        # but leave the formatting itself to the listener
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _start_listener(stream_handler: logging.Handler) -> None:
+    global _listener  # pylint: disable=global-statement
+    _handler.queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(
+        _handler.queue, stream_handler, respect_handler_level=True
+    )
+    _listener.start()
+
+
+def _restart_after_fork() -> None:
+    # The listener thread does not survive a fork, such as gunicorn starting its workers
+    if _listener is not None:
+        _start_listener(_listener.handlers[0])
+
+
+def _stop_listener() -> None:
+    if _listener is not None:
+        _listener.stop()
+
+
+def setup_logging(log_format: str = "text"):
     """
     This function sets up the logging configuration.
+
+    The threads logging a record only queue it: a background listener formats it and
+    writes it to the standard error, so a slow terminal never holds a request up.
+
+    Args:
+        log_format (str): Either "text" for coloured lines or "json" for JSON lines.
     """
+    global _handler  # pylint: disable=global-statement
     loggers = logging.Logger.manager.loggerDict
     for name in loggers:
         logging.getLogger(name).setLevel(logging.WARNING)
@@ -51,7 +186,18 @@ def setup_logging():
     ch = logging.StreamHandler()
     ch.setLevel(logging.DEBUG)
 
-    formatter = ColoredFormatter("%(asctime)s - %(levelname)s - %(message)s")
+    if log_format == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = ColoredFormatter("%(asctime)s - %(levelname)s - %(message)s")
     ch.setFormatter(formatter)
 
-    logger.addHandler(ch)
+    if _handler is None:
+        _handler = _QueueHandler(queue.SimpleQueue())
+        _handler.addFilter(CorrelationFilter())
+        logger.addHandler(_handler)
+        os.register_at_fork(after_in_child=_restart_after_fork)
+        atexit.register(_stop_listener)
+    else:
+        _stop_listener()
+    _start_listener(ch)
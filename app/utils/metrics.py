@@ -0,0 +1,393 @@
+"""
+This module provides minimal Prometheus-style metrics and their text exposition.
+It also declares the metrics shared by the webhook and the TVTime clients.
+"""
+
+import functools
+import inspect
+import math
+import threading
+import time
+from collections.abc import Callable
+
+from utils.trace import record_span  # pylint: disable=import-error
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values, strict=True)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    This class is the base of every metric: a name, a help text and label names.
+
+    Args:
+        name (str): The metric name.
+        documentation (str): The help text of the metric.
+        labelnames (tuple): The names of the labels of the metric.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> list[str]:
+        """
+        Returns the exposition lines of the metric samples.
+
+        Returns:
+            list: The sample lines, without the HELP and TYPE headers.
+        """
+        with self._lock:
+            values = dict(self._values)
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+    def render(self) -> str:
+        """
+        Returns the exposition of the metric, headers included.
+
+        Returns:
+            str: The metric in the Prometheus text format.
+        """
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self.samples(),
+        ]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """
+    A monotonically increasing counter.
+    """
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """
+        Increments the counter.
+
+        Args:
+            amount (float): The increment.
+            **labels: The label values of the sample.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that can go up and down, or be computed when the metrics are collected.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._function: Callable[[], dict[tuple, float]] = None
+
+    def set(self, value: float, **labels) -> None:
+        """
+        Sets the gauge.
+
+        Args:
+            value (float): The value.
+            **labels: The label values of the sample.
+        """
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """
+        Increments the gauge.
+
+        Args:
+            amount (float): The increment, negative to decrement.
+            **labels: The label values of the sample.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_function(self, function: Callable[[], dict[tuple, float]]) -> None:
+        """
+        Computes the gauge samples with a function when the metrics are collected.
+
+        Args:
+            function (Callable): A function returning a mapping of label value tuples to values.
+        """
+        self._function = function
+
+    def samples(self) -> list[str]:
+        if self._function is None:
+            return super().samples()
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._function().items())
+        ]
+
+
+class Span:  # pylint: disable=too-few-public-methods
+    """
+    A timed section of code, whose outcome can be set before it ends.
+    """
+
+    __slots__ = ("outcome", "started_at", "duration")
+
+    def __init__(self) -> None:
+        self.outcome = "success"
+        self.started_at = time.perf_counter()
+        self.duration = 0.0
+
+
+class Histogram(Metric):
+    """
+    A distribution of observed values, counted in cumulative buckets.
+
+    Args:
+        name (str): The metric name.
+        documentation (str): The help text of the metric.
+        labelnames (tuple): The names of the labels of the metric.
+        buckets (tuple): The upper bounds of the buckets.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple = (), buckets=DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._observations: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        """
+        Records an observation.
+
+        Args:
+            value (float): The observed value.
+            **labels: The label values of the sample.
+        """
+        key = self._key(labels)
+        with self._lock:
+            observation = self._observations.get(key)
+            if observation is None:
+                observation = self._observations[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    observation[0][i] += 1
+                    break
+            observation[1] += value
+            observation[2] += 1
+
+    def time(self, **labels) -> "_Timer":
+        """
+        Times a block of code, labelled with the outcome set on the yielded span.
+
+        The outcome defaults to "success", and is "error" if the block raises.
+
+        Args:
+            **labels: The label values of the sample, apart from the outcome.
+
+        Returns:
+            A context manager yielding a Span.
+        """
+        return _Timer(self, labels)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            observations = {
+                key: (list(buckets), total, count)
+                for key, (buckets, total, count) in self._observations.items()
+            }
+        lines = []
+        for key, (buckets, total, count) in sorted(observations.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, buckets, strict=True):
+                cumulative += bucket
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict) -> None:
+        self.histogram = histogram
+        self.labels = labels
+        self.span = Span()
+
+    def __enter__(self) -> Span:
+        self.span.started_at = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self.span.outcome = "error"
+        self.span.duration = time.perf_counter() - self.span.started_at
+        self.histogram.observe(self.span.duration, outcome=self.span.outcome, **self.labels)
+        if "stage" in self.labels:
+            record_span(
+                self.labels["stage"], self.span.started_at, self.span.duration, self.span.outcome
+            )
+
+
+class MetricsRegistry:
+    """
+    This class holds the metrics exposed by the /metrics endpoint.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Registers a metric.
+
+        Args:
+            metric (Metric): The metric to register.
+
+        Returns:
+            Metric: The registered metric.
+        """
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """
+        Renders every registered metric.
+
+        Returns:
+            str: The metrics in the Prometheus text format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+def timed(stage: str, failure_values: tuple = (False,)) -> Callable:
+    """
+    Decorates a TVTime client method, or coroutine, to record its latency under the given stage.
+
+    The outcome is "failure" when the method returns one of the failure values,
+    "error" when it raises, and "success" otherwise.
+
+    Args:
+        stage (str): The stage label of the observations.
+        failure_values (tuple): The return values meaning the call failed.
+
+    Returns:
+        Callable: The decorator.
+    """
+
+    def decorator(method: Callable) -> Callable:
+        if inspect.iscoroutinefunction(method):
+
+            @functools.wraps(method)
+            async def async_wrapper(self, *args, **kwargs):
+                with STAGE_SECONDS.time(stage=stage, user=self.user) as span:
+                    result = await method(self, *args, **kwargs)
+                    if any(result is value for value in failure_values):
+                        span.outcome = "failure"
+                    return result
+
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with STAGE_SECONDS.time(stage=stage, user=self.user) as span:
+                result = method(self, *args, **kwargs)
+                if any(result is value for value in failure_values):
+                    span.outcome = "failure"
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.register(
+    Histogram(
+        "plex_tvtime_stage_duration_seconds",
+        "Time spent in each stage of the webhook and of the TVTime calls.",
+        ("stage", "user", "outcome"),
+    )
+)
+WEBHOOKS = REGISTRY.register(
+    Counter("plex_tvtime_webhooks_total", "Plex webhook requests by response status.", ("status",))
+)
+IN_FLIGHT = REGISTRY.register(
+    Gauge("plex_tvtime_in_flight_requests", "Plex webhook requests being handled.")
+)
+SCROBBLES = REGISTRY.register(
+    Counter("plex_tvtime_scrobbles_total", "Scrobbles processed by outcome.", ("user", "outcome"))
+)
+TOKEN_AGE = REGISTRY.register(
+    Gauge("plex_tvtime_token_age_seconds", "Age of the TVTime token of each account.", ("user",))
+)
+QUEUE_DEPTH = REGISTRY.register(
+    Gauge("plex_tvtime_queue_depth", "Scrobbles waiting in the queue of each account.", ("user",))
+)
+OFFLINE_BUFFER = REGISTRY.register(
+    Gauge(
+        "plex_tvtime_offline_buffer",
+        "Scrobbles buffered while TVTime is unavailable, for each account.",
+        ("user",),
+    )
+)
+FLUSHED = REGISTRY.register(
+    Counter(
+        "plex_tvtime_flushed_total",
+        "Buffered scrobbles sent once TVTime was available again.",
+        ("user",),
+    )
+)
+PREWARMS = REGISTRY.register(
+    Counter(
+        "plex_tvtime_prewarms_total",
+        "Items pre-warmed on playback, by outcome.",
+        ("user", "outcome"),
+    )
+)
+SEND_SECONDS = REGISTRY.register(
+    Histogram(
+        "plex_tvtime_scrobble_send_seconds",
+        "Time to send a single scrobble to TVTime, whether its item was pre-warmed or not.",
+        ("prewarmed", "outcome"),
+    )
+)
@@ -0,0 +1,69 @@
+"""
+This module provides a streaming reader extracting a single field from a multipart body.
+"""
+
+from typing import BinaryIO
+
+from werkzeug.sansio.multipart import Data, Epilogue, Field, MultipartDecoder, NeedData
+
+CHUNK_SIZE = 64 * 1024
+
+
+class FieldTooLarge(ValueError):
+    """
+    Raised when the field read from a multipart body exceeds its maximum size.
+    """
+
+
+def read_field(
+    stream: BinaryIO,
+    boundary: bytes,
+    name: str,
+    max_size: int = 1024 * 1024,
+    chunk_size: int = CHUNK_SIZE,
+) -> bytes | None:
+    """
+    Reads the value of a form field from a multipart body, without buffering the other parts.
+
+    File parts, such as the thumbnail attached by Plex, are never decoded or kept in
+    memory. Once the field is read, the rest of the body is drained without being parsed.
+    Line breaks around the value are dropped: the decoder leaves some of those separating
+    the parts in a value split across chunks.
+
+    Args:
+        stream (BinaryIO): The request body.
+        boundary (bytes): The multipart boundary.
+        name (str): The name of the field.
+        max_size (int): The maximum size of the field, in bytes.
+        chunk_size (int): The number of bytes read from the stream at a time.
+
+    Raises:
+        FieldTooLarge: If the field is larger than max_size.
+        ValueError: If the body is not valid multipart data.
+
+    Returns:
+        bytes: The value of the field, or None if the body does not have it.
+    """
+    decoder = MultipartDecoder(boundary)
+    value: bytearray = None
+    reading = False
+    while value is None or reading:
+        chunk = stream.read(chunk_size)
+        decoder.receive_data(chunk or None)
+        event = decoder.next_event()
+        while not isinstance(event, NeedData | Epilogue):
+            if isinstance(event, Field) and event.name == name:
+                value, reading = bytearray(), True
+            elif isinstance(event, Data) and reading:
+                value += event.data
+                if len(value) > max_size:
+                    raise FieldTooLarge(f"The {name} field is larger than {max_size} bytes")
+                reading = event.more_data
+                if not reading:
+                    break
+            event = decoder.next_event()
+        if isinstance(event, Epilogue) or not chunk:
+            break
+    while chunk and stream.read(chunk_size):
+        pass
+    return bytes(value.strip(b"\r\n")) if value is not None and not reading else None
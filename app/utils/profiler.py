@@ -0,0 +1,89 @@
+"""
+This module contains the StackSampler class, a sampling profiler of every thread of the process
+whose output is in the collapsed stack format read by flame graph tools.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+def frame_label(code) -> str:
+    """
+    Returns the label of a frame in a collapsed stack.
+
+    Args:
+        code: The code object of the frame.
+
+    Returns:
+        str: The qualified function name with its file and first line.
+    """
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    This class samples the call stacks of every thread of the process at a fixed interval.
+
+    Unlike cProfile, which only sees the thread that enabled it, sampling sees the request,
+    scrobble, event loop and browser threads together, at a cost bounded by the interval.
+    Only one sampler runs at a time in a process.
+
+    Args:
+        interval (float): The number of seconds between two samples.
+    """
+
+    _running = threading.Lock()
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.samples = 0
+        self.stacks: Counter = Counter()
+
+    def run(self, seconds: float) -> bool:
+        """
+        Samples the other threads for a number of seconds, blocking the calling thread.
+
+        Args:
+            seconds (float): The length of the profiling window.
+
+        Returns:
+            bool: True if the window was profiled, False if another sampler was running.
+        """
+        if not StackSampler._running.acquire(blocking=False):
+            return False
+        try:
+            me = threading.get_ident()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                frames = sys._current_frames()  # pylint: disable=protected-access
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in frames.items():
+                    if ident != me:
+                        self.stacks[self._collapse(names.get(ident, str(ident)), frame)] += 1
+                self.samples += 1
+                time.sleep(self.interval)
+        finally:
+            StackSampler._running.release()
+        return True
+
+    @staticmethod
+    def _collapse(thread_name: str, frame) -> str:
+        labels = []
+        while frame is not None:
+            labels.append(frame_label(frame.f_code))
+            frame = frame.f_back
+        labels.append(thread_name)
+        return ";".join(reversed(labels))
+
+    def collapsed(self) -> str:
+        """
+        Returns the samples in the collapsed stack format, one "frame;frame;... count" per line.
+
+        Returns:
+            str: The stacks, the most sampled first, readable by flamegraph.pl or speedscope.
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
@@ -0,0 +1,134 @@
+"""
+This module contains the TokenBucket class used to rate limit calls.
+"""
+
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    This class is a thread-safe token bucket.
+
+    Tokens are added continuously at the given rate, up to the burst size, and
+    every call consumes one. A rate of 0 or less disables the limit.
+
+    Args:
+        rate (float): The number of tokens added per second.
+        burst (float): The maximum number of tokens, defaulting to one second worth of tokens.
+    """
+
+    def __init__(self, rate: float, burst: float = None) -> None:
+        self.rate = rate
+        self.burst = max(1.0, burst if burst is not None else rate)
+        self.throttled = 0
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def _take(self, tokens: float, count: bool = False) -> float:
+        """
+        Consumes tokens if they are available.
+
+        Args:
+            tokens (float): The number of tokens to consume.
+            count (bool): Whether to count the call as throttled if it has to wait.
+
+        Returns:
+            float: 0 if the tokens were consumed, otherwise the number of seconds to wait for them.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            if count:
+                self.throttled += 1
+            return (tokens - self._tokens) / self.rate
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """
+        Consumes tokens if they are available, without waiting.
+
+        Args:
+            tokens (float): The number of tokens to consume.
+
+        Returns:
+            bool: True if the tokens were consumed, False otherwise.
+        """
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens: float = 1, timeout: float = None) -> bool:
+        """
+        Consumes tokens, waiting for them to be available.
+
+        Args:
+            tokens (float): The number of tokens to consume.
+            timeout (float): The maximum number of seconds to wait, None waiting forever.
+
+        Returns:
+            bool: True if the tokens were consumed, False if the timeout expired.
+        """
+        if self.rate <= 0:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        wait = self._take(tokens, count=True)
+        while wait:
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+            wait = self._take(tokens)
+        return True
+
+    async def wait(self, tokens: float = 1) -> None:
+        """
+        Consumes tokens, asynchronously waiting for them to be available.
+
+        Args:
+            tokens (float): The number of tokens to consume.
+        """
+        if self.rate <= 0:
+            return
+        wait = self._take(tokens, count=True)
+        while wait:
+            await asyncio.sleep(wait)
+            wait = self._take(tokens)
+
+    @property
+    def available(self) -> float:
+        """
+        Returns the number of tokens currently available.
+        """
+        if self.rate <= 0:
+            return float("inf")
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+    def stats(self) -> dict:
+        """
+        Returns the saturation of the bucket.
+
+        Returns:
+            dict: The rate, the burst, the tokens available and the number of throttled calls.
+        """
+        if self.rate <= 0:
+            return {"rate": None}
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "available": round(self.available, 2),
+            "throttled": self.throttled,
+        }
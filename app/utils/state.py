@@ -0,0 +1,540 @@
+"""
+This module contains the state backends shared by the replicas of the webhook: a SQLite file,
+for replicas sharing a volume, and a Redis server, spoken to over its wire protocol.
+
+Both offer the same few operations: expiring keys, leases, queues and expiring group members.
+"""
+
+import abc
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import unquote, urlparse
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS kv (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        expires_at REAL
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS queues (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        value TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS queues_name ON queues (name, id)",
+    """
+    CREATE TABLE IF NOT EXISTS members (
+        grp TEXT NOT NULL,
+        member TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        PRIMARY KEY (grp, member)
+    ) WITHOUT ROWID
+    """,
+)
+# The number of writes after which the expired keys are deleted
+PURGE_EVERY = 1000
+
+
+class StateError(Exception):
+    """
+    Raised when the shared state cannot be read or written.
+    """
+
+
+class StateBackend(abc.ABC):
+    """
+    This class is the base of the shared state backends.
+
+    Keys, queue and group names are namespaced by the backend, values are strings
+    and times to live are in seconds.
+    """
+
+    @abc.abstractmethod
+    def get(self, key: str) -> str | None:
+        """
+        Reads a key.
+
+        Returns:
+            str: The value of the key, or None if it is not set or expired.
+        """
+
+    @abc.abstractmethod
+    def set(self, key: str, value: str, ttl: float = None) -> None:
+        """
+        Sets a key, expiring after ttl seconds if given.
+        """
+
+    @abc.abstractmethod
+    def add(self, key: str, value: str, ttl: float = None) -> bool:
+        """
+        Sets a key unless it is already set.
+
+        Returns:
+            bool: True if the key was set, False if it already was.
+        """
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        """
+        Deletes a key.
+        """
+
+    @abc.abstractmethod
+    def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        """
+        Takes a lease, or extends it if the owner already holds it.
+
+        Returns:
+            bool: True if the owner holds the lease for ttl seconds, False if another owner does.
+        """
+
+    @abc.abstractmethod
+    def release(self, key: str, owner: str) -> None:
+        """
+        Gives a lease up, if the owner holds it.
+        """
+
+    @abc.abstractmethod
+    def push(self, name: str, values: list[str]) -> None:
+        """
+        Appends values to a queue.
+        """
+
+    @abc.abstractmethod
+    def pop(self, name: str, count: int = 1) -> list[str]:
+        """
+        Removes values from the front of a queue.
+
+        Returns:
+            list: At most count values, oldest first.
+        """
+
+    @abc.abstractmethod
+    def length(self, name: str) -> int:
+        """
+        Returns the number of values in a queue.
+        """
+
+    @abc.abstractmethod
+    def heartbeat(self, group: str, member: str, ttl: float) -> None:
+        """
+        Records a member of a group as alive for ttl seconds.
+        """
+
+    @abc.abstractmethod
+    def members(self, group: str) -> list[str]:
+        """
+        Returns the members of a group still alive, sorted.
+        """
+
+    @abc.abstractmethod
+    def close(self) -> None:
+        """
+        Closes the connections of this process.
+        """
+
+
+class SQLiteState(StateBackend):
+    """
+    This class keeps the shared state in a SQLite database in WAL mode.
+
+    The replicas must share the file, such as through a volume, and a host: SQLite
+    locking is not reliable over network filesystems. The connection is opened on
+    first use by each process, a connection not surviving a fork.
+
+    Args:
+        path (str): The path of the SQLite database.
+        namespace (str): The prefix of every key.
+    """
+
+    def __init__(self, path: str, namespace: str = "plex-tvtime:") -> None:
+        self.path = path
+        self.namespace = namespace
+        self._conn: sqlite3.Connection = None
+        self._pid: int = None
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(
+                self.path, timeout=10, check_same_thread=False, isolation_level=None
+            )
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                self._conn.execute(statement)
+            self._pid = os.getpid()
+        return self._conn
+
+    def _execute(self, statements: list[tuple[str, tuple]], write: bool = False) -> list:
+        # Runs statements in one transaction, returning the rows of the last one
+        with self._lock:
+            try:
+                conn = self._connection()
+                conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+                try:
+                    for sql, params in statements:
+                        rows = conn.execute(sql, params).fetchall()
+                    if write:
+                        self._writes += 1
+                        if self._writes % PURGE_EVERY == 0:
+                            now = time.time()
+                            conn.execute("DELETE FROM kv WHERE expires_at < ?", (now,))
+                            conn.execute("DELETE FROM members WHERE expires_at < ?", (now,))
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            except sqlite3.Error as exc:
+                raise StateError(f"Error accessing the shared state {self.path}: {exc}") from exc
+        return rows
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}{key}"
+
+    @staticmethod
+    def _expiry(ttl: float | None) -> float | None:
+        return time.time() + ttl if ttl is not None else None
+
+    def get(self, key: str) -> str | None:
+        rows = self._execute(
+            [
+                (
+                    "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at >= ?)",
+                    (self._key(key), time.time()),
+                )
+            ]
+        )
+        return rows[0][0] if rows else None
+
+    def set(self, key: str, value: str, ttl: float = None) -> None:
+        self._execute(
+            [
+                (
+                    "INSERT OR REPLACE INTO kv VALUES (?, ?, ?)",
+                    (self._key(key), value, self._expiry(ttl)),
+                )
+            ],
+            write=True,
+        )
+
+    def add(self, key: str, value: str, ttl: float = None) -> bool:
+        rows = self._execute(
+            [
+                ("DELETE FROM kv WHERE key = ? AND expires_at < ?", (self._key(key), time.time())),
+                (
+                    "INSERT OR IGNORE INTO kv VALUES (?, ?, ?) RETURNING key",
+                    (self._key(key), value, self._expiry(ttl)),
+                ),
+            ],
+            write=True,
+        )
+        return bool(rows)
+
+    def delete(self, key: str) -> None:
+        self._execute([("DELETE FROM kv WHERE key = ?", (self._key(key),))], write=True)
+
+    def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        rows = self._execute(
+            [
+                (
+                    "INSERT INTO kv VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE"
+                    " SET value = excluded.value, expires_at = excluded.expires_at"
+                    " WHERE kv.value = excluded.value OR kv.expires_at < ? RETURNING key",
+                    (self._key(key), owner, now + ttl, now),
+                )
+            ],
+            write=True,
+        )
+        return bool(rows)
+
+    def release(self, key: str, owner: str) -> None:
+        self._execute(
+            [("DELETE FROM kv WHERE key = ? AND value = ?", (self._key(key), owner))], write=True
+        )
+
+    def push(self, name: str, values: list[str]) -> None:
+        if values:
+            name = self._key(name)
+            self._execute(
+                [("INSERT INTO queues (name, value) VALUES (?, ?)", (name, v)) for v in values],
+                write=True,
+            )
+
+    def pop(self, name: str, count: int = 1) -> list[str]:
+        rows = self._execute(
+            [
+                (
+                    "DELETE FROM queues WHERE id IN"
+                    " (SELECT id FROM queues WHERE name = ? ORDER BY id LIMIT ?)"
+                    " RETURNING id, value",
+                    (self._key(name), count),
+                )
+            ],
+            write=True,
+        )
+        return [value for _, value in sorted(rows)]
+
+    def length(self, name: str) -> int:
+        rows = self._execute([("SELECT COUNT(*) FROM queues WHERE name = ?", (self._key(name),))])
+        return rows[0][0]
+
+    def heartbeat(self, group: str, member: str, ttl: float) -> None:
+        self._execute(
+            [
+                (
+                    "INSERT OR REPLACE INTO members VALUES (?, ?, ?)",
+                    (self._key(group), member, time.time() + ttl),
+                )
+            ],
+            write=True,
+        )
+
+    def members(self, group: str) -> list[str]:
+        rows = self._execute(
+            [
+                (
+                    "SELECT member FROM members WHERE grp = ? AND expires_at >= ? ORDER BY member",
+                    (self._key(group), time.time()),
+                )
+            ]
+        )
+        return [member for (member,) in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+
+class _RespConnection:
+    """
+    A connection to a Redis server, speaking RESP2.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float) -> None:
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+
+    def command(self, *args):
+        """
+        Sends a command and reads its reply.
+
+        Raises:
+            StateError: If the server answered with an error.
+        """
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self.sock.sendall(b"".join(parts))
+        return self._read()
+
+    def _read(self):
+        line = self.reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by the Redis server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise StateError(f"Redis error: {rest.decode()}")
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            if int(rest) < 0:
+                return None
+            data = self.reader.read(int(rest) + 2)
+            return data[:-2].decode()
+        if kind == b"*":
+            if int(rest) < 0:
+                return None
+            return [self._read() for _ in range(int(rest))]
+        raise ConnectionError(f"Unexpected reply from the Redis server: {line!r}")
+
+    def close(self) -> None:
+        """
+        Closes the connection.
+        """
+        self.reader.close()
+        self.sock.close()
+
+
+class RedisState(StateBackend):
+    """
+    This class keeps the shared state in a Redis server, or anything speaking its protocol.
+
+    Connections are pooled and opened on first use by each process. Leases are extended
+    inside a WATCH/MULTI/EXEC transaction, so an owner never extends a lease it lost.
+    Only commands of Redis 2.6.12 and later are used.
+
+    Args:
+        url (str): The URL of the server, such as "redis://:password@host:6379/0".
+        namespace (str): The prefix of every key.
+        timeout (float): The number of seconds to wait for a connection or a reply.
+    """
+
+    def __init__(self, url: str, namespace: str = "plex-tvtime:", timeout: float = 5) -> None:
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.namespace = namespace
+        self.timeout = timeout
+        self._pool: queue.LifoQueue = queue.LifoQueue()
+        self._pid = os.getpid()
+
+    def _connect(self) -> _RespConnection:
+        conn = _RespConnection(self.host, self.port, self.timeout)
+        if self.password:
+            conn.command("AUTH", self.password)
+        if self.db:
+            conn.command("SELECT", self.db)
+        return conn
+
+    def _run(self, function):
+        # Runs a function with a pooled connection, discarding the connection if it fails
+        if self._pid != os.getpid():
+            self._pool = queue.LifoQueue()
+            self._pid = os.getpid()
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            try:
+                conn = self._connect()
+            except OSError as exc:
+                raise StateError(f"Error connecting to Redis: {exc}") from exc
+        try:
+            result = function(conn)
+        except (OSError, ConnectionError) as exc:
+            conn.close()
+            raise StateError(f"Error talking to Redis: {exc}") from exc
+        except StateError:
+            conn.close()
+            raise
+        self._pool.put(conn)
+        return result
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}{key}"
+
+    def get(self, key: str) -> str | None:
+        return self._run(lambda c: c.command("GET", self._key(key)))
+
+    def set(self, key: str, value: str, ttl: float = None) -> None:
+        expiry = ("PX", max(1, int(ttl * 1000))) if ttl is not None else ()
+        self._run(lambda c: c.command("SET", self._key(key), value, *expiry))
+
+    def add(self, key: str, value: str, ttl: float = None) -> bool:
+        expiry = ("PX", max(1, int(ttl * 1000))) if ttl is not None else ()
+        return self._run(lambda c: c.command("SET", self._key(key), value, "NX", *expiry)) == "OK"
+
+    def delete(self, key: str) -> None:
+        self._run(lambda c: c.command("DEL", self._key(key)))
+
+    def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        key, ms = self._key(key), max(1, int(ttl * 1000))
+
+        def _acquire(conn: _RespConnection) -> bool:
+            if conn.command("SET", key, owner, "NX", "PX", ms) == "OK":
+                return True
+            conn.command("WATCH", key)
+            if conn.command("GET", key) != owner:
+                conn.command("UNWATCH")
+                return False
+            conn.command("MULTI")
+            conn.command("PEXPIRE", key, ms)
+            return conn.command("EXEC") is not None
+
+        return self._run(_acquire)
+
+    def release(self, key: str, owner: str) -> None:
+        key = self._key(key)
+
+        def _release(conn: _RespConnection) -> None:
+            conn.command("WATCH", key)
+            if conn.command("GET", key) != owner:
+                conn.command("UNWATCH")
+                return
+            conn.command("MULTI")
+            conn.command("DEL", key)
+            conn.command("EXEC")
+
+        self._run(_release)
+
+    def push(self, name: str, values: list[str]) -> None:
+        if values:
+            self._run(lambda c: c.command("RPUSH", self._key(name), *values))
+
+    def pop(self, name: str, count: int = 1) -> list[str]:
+        key = self._key(name)
+
+        def _pop(conn: _RespConnection) -> list[str]:
+            # Rather than LPOP with a count, which needs Redis 6.2
+            conn.command("MULTI")
+            conn.command("LRANGE", key, 0, count - 1)
+            conn.command("LTRIM", key, count, -1)
+            return conn.command("EXEC")[0]
+
+        return self._run(_pop)
+
+    def length(self, name: str) -> int:
+        return self._run(lambda c: c.command("LLEN", self._key(name)))
+
+    def heartbeat(self, group: str, member: str, ttl: float) -> None:
+        self._run(lambda c: c.command("ZADD", self._key(group), time.time() + ttl, member))
+
+    def members(self, group: str) -> list[str]:
+        def _members(conn: _RespConnection) -> list[str]:
+            now = time.time()
+            conn.command("ZREMRANGEBYSCORE", self._key(group), "-inf", f"({now}")
+            return conn.command("ZRANGEBYSCORE", self._key(group), now, "+inf")
+
+        return sorted(self._run(_members))
+
+    def close(self) -> None:
+        if self._pid != os.getpid():
+            return
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def open_state(url: str, namespace: str = "plex-tvtime:") -> StateBackend:
+    """
+    Opens the shared state backend of a URL.
+
+    Args:
+        url (str): Either "sqlite:///path/to/state.db", a relative path being written
+            "sqlite:///config/state.db", or "redis://[:password@]host[:port][/db]".
+        namespace (str): The prefix of every key.
+
+    Raises:
+        ValueError: If the scheme of the URL is not supported.
+
+    Returns:
+        StateBackend: The backend.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        return SQLiteState(url[len("sqlite:///") :] or "config/state.db", namespace)
+    if parsed.scheme == "redis":
+        return RedisState(url, namespace)
+    raise ValueError(f"Unsupported shared state URL: {url}")
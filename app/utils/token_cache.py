@@ -0,0 +1,158 @@
+"""
+This module contains the TokenCache class which persists TVTime tokens between restarts.
+"""
+
+import base64
+import binascii
+import json
+import logging
+import os
+import re
+import threading
+
+from utils.state import StateBackend, StateError  # pylint: disable=import-error
+
+
+def jwt_claims(token: str) -> dict:
+    """
+    Decodes the claims of a JWT without verifying its signature.
+
+    Args:
+        token (str): The JWT.
+
+    Returns:
+        dict: The claims of the token, empty if it cannot be decoded.
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return claims if isinstance(claims, dict) else {}
+    except (IndexError, ValueError, TypeError, AttributeError, binascii.Error):
+        return {}
+
+
+def jwt_expiry(token: str) -> float | None:
+    """
+    Decodes the expiry of a JWT without verifying its signature.
+
+    Args:
+        token (str): The JWT.
+
+    Returns:
+        float: The "exp" claim as a UNIX timestamp, or None if it cannot be decoded.
+    """
+    try:
+        return float(jwt_claims(token)["exp"])
+    except (KeyError, ValueError, TypeError):
+        return None
+
+
+class TokenCache:
+    """
+    This class stores the JWT and refresh token of every user in a permission-restricted directory.
+
+    Each user gets its own file, readable by the owner only, written atomically so
+    a crash never leaves a truncated token behind. With a shared state, the tokens are
+    also stored there and preferred to the file, so every replica uses the latest token.
+
+    Args:
+        directory (str): The directory of the token files.
+        state (StateBackend): The state shared by the replicas, if any.
+    """
+
+    def __init__(self, directory: str, state: StateBackend = None) -> None:
+        self.directory = directory
+        self.state = state
+        self._lock = threading.Lock()
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        os.chmod(directory, 0o700)
+
+    def _path(self, plex_user: str) -> str:
+        return os.path.join(self.directory, re.sub(r"[^\w.-]", "_", plex_user) + ".json")
+
+    def load(self, plex_user: str, tvtime_username: str) -> dict | None:
+        """
+        Loads the cached tokens of a user.
+
+        Args:
+            plex_user (str): The Plex user the tokens belong to.
+            tvtime_username (str): The TVTime username, tokens of another account being ignored.
+
+        Returns:
+            dict: The cached "token" and "refresh_token", or None if there are none.
+        """
+        entry = self._load_shared(plex_user)
+        if entry is not None and entry.get("username") == tvtime_username:
+            return entry
+        try:
+            with open(self._path(plex_user), encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as exc:
+            logging.warning("[%s] Ignoring unreadable token cache: %s", plex_user, exc)
+            return None
+        if entry.get("username") != tvtime_username:
+            return None
+        return entry
+
+    def save(self, plex_user: str, tvtime_username: str, token: str, refresh_token: str) -> None:
+        """
+        Saves the tokens of a user.
+
+        Args:
+            plex_user (str): The Plex user the tokens belong to.
+            tvtime_username (str): The TVTime username the tokens were issued for.
+            token (str): The JWT.
+            refresh_token (str): The refresh token.
+        """
+        path = self._path(plex_user)
+        tmp_path = f"{path}.tmp"
+        entry = {"username": tvtime_username, "token": token, "refresh_token": refresh_token}
+        if self.state is not None:
+            try:
+                self.state.set(self._key(plex_user), json.dumps(entry))
+            except StateError as exc:
+                logging.error("[%s] Error sharing the tokens: %s", plex_user, exc)
+        with self._lock:
+            try:
+                fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(entry, f)
+                os.replace(tmp_path, path)
+            except OSError as exc:
+                logging.error("[%s] Error saving token cache: %s", plex_user, exc)
+
+    def delete(self, plex_user: str) -> None:
+        """
+        Deletes the cached tokens of a user.
+
+        Args:
+            plex_user (str): The Plex user the tokens belong to.
+        """
+        if self.state is not None:
+            try:
+                self.state.delete(self._key(plex_user))
+            except StateError as exc:
+                logging.error("[%s] Error deleting the shared tokens: %s", plex_user, exc)
+        with self._lock:
+            try:
+                os.remove(self._path(plex_user))
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _key(plex_user: str) -> str:
+        return f"token:{plex_user}"
+
+    def _load_shared(self, plex_user: str) -> dict | None:
+        if self.state is None:
+            return None
+        try:
+            value = self.state.get(self._key(plex_user))
+            entry = json.loads(value) if value is not None else None
+        except (StateError, ValueError) as exc:
+            logging.warning("[%s] Ignoring the shared tokens: %s", plex_user, exc)
+            return None
+        return entry if isinstance(entry, dict) else None
@@ -0,0 +1,190 @@
+"""
+This module contains the request traces, recording the time spent in every stage of a webhook
+or a scrobble, and the SlowLog keeping the traces over a threshold.
+"""
+
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+
+
+class Trace:
+    """
+    The stages timed while handling a webhook or sending a scrobble.
+
+    Args:
+        name (str): What is traced, such as "webhook" or "scrobble".
+        correlation_id (str): The correlation ID of the traced work.
+    """
+
+    __slots__ = ("name", "correlation_id", "started_at", "origin", "spans")
+
+    def __init__(self, name: str, correlation_id: str = "") -> None:
+        self.name = name
+        self.correlation_id = correlation_id
+        self.started_at = time.time()
+        # The time.perf_counter() the offsets of the stages are relative to
+        self.origin = time.perf_counter()
+        self.spans: list[tuple[str, float, float, str]] = []
+
+    def add(self, stage: str, started_at: float, duration: float, outcome: str) -> None:
+        """
+        Records a timed stage.
+
+        Args:
+            stage (str): The name of the stage.
+            started_at (float): When the stage started, from time.perf_counter().
+            duration (float): The number of seconds the stage took.
+            outcome (str): The outcome of the stage.
+        """
+        self.spans.append((stage, started_at - self.origin, duration, outcome))
+
+    def elapsed(self) -> float:
+        """
+        Returns the number of seconds since the trace started.
+        """
+        return time.perf_counter() - self.origin
+
+    def summary(self) -> str:
+        """
+        Returns the time of every stage, the stages run several times being summed up.
+
+        Returns:
+            str: Such as "form 2.1 ms, watch_episode 12x 840.3 ms (max 95.2 ms, 1 error)".
+        """
+        stages: dict[str, list] = {}
+        for stage, _, duration, outcome in self.spans:
+            total = stages.setdefault(stage, [0, 0.0, 0.0, {}])
+            total[0] += 1
+            total[1] += duration
+            total[2] = max(total[2], duration)
+            if outcome != "success":
+                total[3][outcome] = total[3].get(outcome, 0) + 1
+        parts = []
+        for stage, (count, duration, longest, outcomes) in stages.items():
+            details = [f"max {longest * 1e3:.1f} ms"] if count > 1 else []
+            details += [f"{n} {outcome}" for outcome, n in outcomes.items()]
+            parts.append(
+                f"{stage} {f'{count}x ' if count > 1 else ''}{duration * 1e3:.1f} ms"
+                + (f" ({', '.join(details)})" if details else "")
+            )
+        return ", ".join(parts) or "no stage timed"
+
+    def to_dict(self, duration: float) -> dict:
+        """
+        Returns the trace as a JSON-serializable dictionary.
+
+        Args:
+            duration (float): The total number of seconds of the trace.
+        """
+        return {
+            "name": self.name,
+            "correlation_id": self.correlation_id,
+            "started_at": self.started_at,
+            "duration_ms": round(duration * 1e3, 3),
+            "spans": [
+                {
+                    "stage": stage,
+                    "offset_ms": round(offset * 1e3, 3),
+                    "duration_ms": round(span * 1e3, 3),
+                    "outcome": outcome,
+                }
+                for stage, offset, span, outcome in self.spans
+            ],
+        }
+
+
+class SlowLog:
+    """
+    This class logs the traces taking longer than a threshold, keeping the latest ones.
+
+    Args:
+        threshold (float): The number of seconds above which a trace is slow, 0 disabling the log.
+        keep (int): The number of slow traces kept.
+    """
+
+    def __init__(self, threshold: float = 1.0, keep: int = 100) -> None:
+        self.threshold = threshold
+        self.slow = 0
+        self._traces: deque = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    def configure(self, threshold: float, keep: int) -> None:
+        """
+        Changes the threshold and the number of slow traces kept.
+        """
+        with self._lock:
+            self.threshold = threshold
+            if keep != self._traces.maxlen:
+                self._traces = deque(self._traces, maxlen=keep)
+
+    def record(self, trace: Trace, duration: float) -> None:
+        """
+        Logs and keeps a trace if it is slow.
+
+        Args:
+            trace (Trace): The finished trace.
+            duration (float): The total number of seconds of the trace.
+        """
+        if self.threshold <= 0 or duration < self.threshold:
+            return
+        with self._lock:
+            self.slow += 1
+            self._traces.append(trace.to_dict(duration))
+        logging.warning("Slow %s took %.0f ms: %s", trace.name, duration * 1e3, trace.summary())
+
+    def traces(self) -> list[dict]:
+        """
+        Returns the slow traces kept, the latest last.
+        """
+        with self._lock:
+            return list(self._traces)
+
+    def stats(self) -> dict:
+        """
+        Returns the threshold and the number of slow traces seen.
+        """
+        with self._lock:
+            return {"threshold": self.threshold, "slow": self.slow, "kept": len(self._traces)}
+
+
+SLOW_LOG = SlowLog()
+
+_current: contextvars.ContextVar[Trace | None] = contextvars.ContextVar("trace", default=None)
+
+
+@contextlib.contextmanager
+def tracing(name: str, correlation_id: str = "", queued: float = None):
+    """
+    Traces the stages timed within the block, recording the trace in the slow log at the end.
+
+    Args:
+        name (str): What is traced, such as "webhook" or "scrobble".
+        correlation_id (str): The correlation ID of the traced work.
+        queued (float): The number of seconds the work waited in a queue before the block,
+            recorded as a "queue" stage and counted in the total.
+
+    Yields:
+        Trace: The trace.
+    """
+    trace = Trace(name, correlation_id)
+    if queued is not None:
+        trace.add("queue", trace.origin - queued, queued, "success")
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+        SLOW_LOG.record(trace, trace.elapsed() + (queued or 0.0))
+
+
+def record_span(stage: str, started_at: float, duration: float, outcome: str) -> None:
+    """
+    Records a timed stage in the trace of the current context, if any.
+    """
+    trace = _current.get()
+    if trace is not None:
+        trace.add(stage, started_at, duration, outcome)
@@ -0,0 +1,236 @@
+"""
+This module contains the WatchedSet class, a compact on-disk mirror of what a TVTime account
+has already watched.
+"""
+
+import base64
+import bisect
+import fcntl
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from array import array
+from collections.abc import Iterable
+
+
+class WatchedSet:  # pylint: disable=too-many-instance-attributes
+    """
+    This class mirrors the watched episodes and movies of a TVTime account.
+
+    Episode IDs are kept in a sorted array of 32-bit integers, so a lookup is a binary
+    search and a hundred thousand episodes take 400 KB. Movies, only known by the UUIDs
+    this webhook marked as watched, are kept in a set. The mirror is persisted to a JSON
+    file, the episodes as the base64 of the array, written atomically every flush_every
+    changes and on save(). Several processes may share the file: a save merges what the
+    others persisted since, under a file lock, rather than overwriting it.
+
+    Args:
+        path (str): The JSON file the mirror is persisted to, if any.
+        owner (str): The TVTime username the mirror belongs to, a mirror persisted for
+            another username being discarded.
+        flush_every (int): The number of changes after which the mirror is saved to disk.
+    """
+
+    def __init__(self, path: str = None, owner: str = None, flush_every: int = 20) -> None:
+        self.path = path
+        self.owner = owner
+        self.flush_every = flush_every
+        self.synced_at = 0.0
+        self.hits = 0
+        self._episodes = array("I")
+        self._movies: set[str] = set()
+        self._dirty = 0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        if path:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._episodes) + len(self._movies)
+
+    def has_episode(self, episode_id: int) -> bool:
+        """
+        Tells whether an episode is watched, counting a hit if it is.
+
+        Args:
+            episode_id (int): The TVDB ID of the episode.
+
+        Returns:
+            bool: True if the episode is watched, False otherwise.
+        """
+        with self._lock:
+            found = self._contains(episode_id)
+            self.hits += found
+        return found
+
+    def has_movie(self, movie_uuid: str) -> bool:
+        """
+        Tells whether a movie is watched, counting a hit if it is.
+
+        Args:
+            movie_uuid (str): The TVTime UUID of the movie.
+
+        Returns:
+            bool: True if the movie is watched, False otherwise.
+        """
+        with self._lock:
+            found = movie_uuid in self._movies
+            self.hits += found
+        return found
+
+    def add_episodes(self, episode_ids: Iterable[int], flush: bool = True) -> int:
+        """
+        Records episodes as watched.
+
+        Args:
+            episode_ids (Iterable): The TVDB IDs of the episodes.
+            flush (bool): Whether to save the mirror once flush_every changes are pending.
+
+        Returns:
+            int: The number of episodes that were not already recorded.
+        """
+        with self._lock:
+            new = sorted(
+                {
+                    i
+                    for i in episode_ids
+                    if isinstance(i, int) and 0 <= i <= 0xFFFFFFFF and not self._contains(i)
+                }
+            )
+            if not new:
+                return 0
+            if len(new) == 1:
+                self._episodes.insert(bisect.bisect_left(self._episodes, new[0]), new[0])
+            else:
+                self._episodes = array("I", sorted([*self._episodes, *new]))
+            self._dirty += len(new)
+            flush = flush and self.path and self._dirty >= self.flush_every
+        if flush:
+            self.save()
+        return len(new)
+
+    def add_movie(self, movie_uuid: str) -> None:
+        """
+        Records a movie as watched.
+
+        Args:
+            movie_uuid (str): The TVTime UUID of the movie.
+        """
+        with self._lock:
+            if movie_uuid in self._movies:
+                return
+            self._movies.add(movie_uuid)
+            self._dirty += 1
+            flush = self.path and self._dirty >= self.flush_every
+        if flush:
+            self.save()
+
+    def mark_synced(self) -> None:
+        """
+        Records that the mirror was just synced with TVTime, and saves it.
+        """
+        with self._lock:
+            self.synced_at = time.time()
+            self._dirty += 1
+        if self.path:
+            self.save()
+
+    def stats(self) -> dict:
+        """
+        Returns the size and usage of the mirror.
+
+        Returns:
+            dict: The number of watched episodes and movies, of scrobbles answered from
+            the mirror, and the time of the last sync.
+        """
+        with self._lock:
+            return {
+                "episodes": len(self._episodes),
+                "movies": len(self._movies),
+                "hits": self.hits,
+                "synced_at": self.synced_at,
+            }
+
+    def load(self) -> None:
+        """
+        Loads the mirror persisted on disk.
+        """
+        persisted = self._read()
+        if persisted is None:
+            return
+        episodes, movies, synced_at = persisted
+        with self._lock:
+            self._episodes = array("I", sorted(episodes))
+            self._movies = movies
+            self.synced_at = synced_at
+
+    def _read(self) -> tuple[array, set[str], float] | None:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            episodes = array("I")
+            episodes.frombytes(base64.b64decode(data.get("episodes", "")))
+            if sys.byteorder != "little":
+                episodes.byteswap()
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, TypeError, AttributeError) as exc:
+            logging.warning("Ignoring the invalid watched state %s: %s", self.path, exc)
+            return None
+        if self.owner is not None and data.get("owner") != self.owner:
+            logging.info("Discarding the watched state of another account in %s", self.path)
+            return None
+        return episodes, set(data.get("movies") or []), float(data.get("synced_at") or 0.0)
+
+    def save(self) -> None:
+        """
+        Persists the mirror to disk, atomically, merged with what other processes persisted.
+        """
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+            try:
+                if os.path.dirname(self.path):
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(f"{self.path}.lock", "a", encoding="utf-8") as lock:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                    self._merge(self._read())
+                    self._write()
+            except OSError as exc:
+                logging.error("Error saving the watched state %s: %s", self.path, exc)
+
+    def _merge(self, persisted: tuple[array, set[str], float] | None) -> None:
+        if persisted is None:
+            return
+        episodes, movies, synced_at = persisted
+        self.add_episodes(episodes, flush=False)
+        with self._lock:
+            self._movies |= movies
+            self.synced_at = max(self.synced_at, synced_at)
+
+    def _write(self) -> None:
+        with self._lock:
+            episodes = array("I", self._episodes)
+            data = {
+                "owner": self.owner,
+                "synced_at": self.synced_at,
+                "movies": sorted(self._movies),
+            }
+            self._dirty = 0
+        if sys.byteorder != "little":
+            episodes.byteswap()
+        data["episodes"] = base64.b64encode(episodes.tobytes()).decode("ascii")
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def _contains(self, episode_id: int) -> bool:
+        i = bisect.bisect_left(self._episodes, episode_id)
+        return i < len(self._episodes) and self._episodes[i] == episode_id
@@ -0,0 +1,167 @@
+"""
+This module contains the CrossReference class, an on-disk table mapping the GUIDs of
+Plex items to their TVDB IDs.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+from collections.abc import Iterable
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS guids (
+    media_type TEXT NOT NULL,
+    guid TEXT NOT NULL,
+    tvdb_id INTEGER NOT NULL,
+    PRIMARY KEY (media_type, guid)
+) WITHOUT ROWID
+"""
+# SQLite limits the number of parameters of a statement
+MAX_GUIDS = 100
+
+
+class CrossReference:
+    """
+    This class stores which TVDB ID every known GUID, such as "tmdb://603", stands for.
+
+    The table is clustered on its key, so a lookup is a single B-tree search and the
+    file holds little more than the GUIDs themselves. The connection is opened on first
+    use by each process, a connection not surviving a fork.
+
+    Args:
+        path (str): The path of the SQLite database.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._conn: sqlite3.Connection = None
+        self._pid: int = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.learnt = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(SCHEMA)
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, media_type: str, guids: list[str]) -> dict[str, int]:
+        """
+        Looks the TVDB IDs of GUIDs up.
+
+        Args:
+            media_type (str): Either "movie" or "show".
+            guids (list): The GUIDs to look up.
+
+        Returns:
+            dict: The TVDB ID of every GUID found in the table.
+        """
+        guids = guids[:MAX_GUIDS]
+        if not guids:
+            return {}
+        placeholders = ",".join("?" * len(guids))
+        try:
+            with self._lock:
+                rows = (
+                    self._connection()
+                    .execute(
+                        "SELECT guid, tvdb_id FROM guids"
+                        f" WHERE media_type = ? AND guid IN ({placeholders})",
+                        (media_type, *guids),
+                    )
+                    .fetchall()
+                )
+        except sqlite3.Error as exc:
+            logging.error("Error reading the GUID cross-references: %s", exc)
+            return {}
+        return dict(rows)
+
+    def lookup(self, media_type: str, guids: list[str]) -> int | None:
+        """
+        Resolves an item to its TVDB ID from the first of its GUIDs found in the table.
+
+        Args:
+            media_type (str): Either "movie" or "show".
+            guids (list): The GUIDs of the item, the most reliable first.
+
+        Returns:
+            int: The TVDB ID, or None if none of the GUIDs is known.
+        """
+        found = self.get(media_type, guids)
+        tvdb_id = next((found[guid] for guid in guids if guid in found), None)
+        with self._lock:
+            if tvdb_id is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return tvdb_id
+
+    def load(self, rows: Iterable[tuple[str, str, int]]) -> int:
+        """
+        Stores cross-references, replacing those of the same GUIDs.
+
+        Args:
+            rows (Iterable): The media type, GUID and TVDB ID of every cross-reference.
+
+        Returns:
+            int: The number of cross-references stored.
+        """
+        with self._lock:
+            try:
+                conn = self._connection()
+                with conn:
+                    conn.execute("BEGIN")
+                    count = conn.executemany(
+                        "INSERT OR REPLACE INTO guids VALUES (?, ?, ?)", rows
+                    ).rowcount
+            except sqlite3.Error as exc:
+                logging.error("Error writing the GUID cross-references: %s", exc)
+                return 0
+        return count
+
+    def learn(self, media_type: str, tvdb_id: int, guids: list[str]) -> int:
+        """
+        Records the GUIDs of an item whose TVDB ID is known, skipping those already recorded.
+
+        Args:
+            media_type (str): Either "movie" or "show".
+            tvdb_id (int): The TVDB ID of the item.
+            guids (list): The other GUIDs of the item.
+
+        Returns:
+            int: The number of cross-references added or changed.
+        """
+        known = self.get(media_type, guids)
+        rows = [(media_type, g, tvdb_id) for g in guids if known.get(g) != tvdb_id]
+        if not rows:
+            return 0
+        count = self.load(rows)
+        with self._lock:
+            self.learnt += count
+        return count
+
+    def stats(self) -> dict:
+        """
+        Returns the statistics of the table.
+
+        Returns:
+            dict: The number of hits, misses and learnt cross-references since startup.
+        """
+        return {"hits": self.hits, "misses": self.misses, "learnt": self.learnt}
+
+    def close(self) -> None:
+        """
+        Closes the database.
+        """
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
@@ -0,0 +1,167 @@
+"""
+backfill_check.py
+
+This check runs backfill.py against local stand-ins of a Plex server and of TVTime: the
+history is read page by page, a failing page interrupts the first run, and a second run
+resumes from the checkpoint, every item being sent exactly once at the configured rate.
+
+Usage: python3 benchmarks/backfill_check.py [--items 300] [--page-size 50] [--rate 100]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import requests
+from fake_plex import TOKEN, FakePlex
+from fake_tvtime import FakeTVTime, make_jwt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+# pylint: disable=import-error,wrong-import-position
+from backfill import Backfill, Checkpoint, iter_plex_history
+from tvtime import TVTime
+from utils.token_cache import TokenCache
+
+# pylint: enable=import-error,wrong-import-position
+
+USER = "alice"
+USERNAME = "alice@example.com"
+
+
+def create_client(tvtime_url: str, directory: str) -> TVTime:
+    """
+    Creates a TVTime client of the stand-in, logged in with a cached token so no browser starts.
+
+    Args:
+        tvtime_url (str): The base URL of the TVTime stand-in.
+        directory (str): The directory of the token cache.
+
+    Returns:
+        TVTime: The logged in client.
+    """
+    token_cache = TokenCache(os.path.join(directory, "tokens"))
+    token_cache.save(USER, USERNAME, make_jwt(), "refresh")
+    client = TVTime(
+        plex_user=USER,
+        tvtime_username=USERNAME,
+        tvtime_password="secret",
+        token_cache=token_cache,
+        api_url=tvtime_url,
+        auth_url=f"{tvtime_url}/sidecar?o=https://auth.tvtime.com/v1",
+        # Without the watched mirror, an item sent twice reaches TVTime twice
+        watched_path=None,
+        # Only the backfill paces the items, its own rate being checked
+        rate_limits={"watched_episodes": {"rate": 0}},
+    )
+    client.login()
+    return client
+
+
+def check(name: str, passed: bool, details: str) -> bool:
+    """
+    Prints the outcome of a check.
+
+    Returns:
+        bool: Whether the check passed.
+    """
+    print(f"{'ok  ' if passed else 'FAIL'} {name}: {details}")
+    return passed
+
+
+def main() -> int:  # pylint: disable=too-many-locals
+    """
+    Runs an interrupted backfill then its resumption, checking paging, checkpoint and rate.
+
+    Returns:
+        int: The exit status, 1 if a check failed.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--items", type=int, default=300, help="Episodes in the history.")
+    parser.add_argument("--page-size", type=int, default=50, help="Items per history page.")
+    parser.add_argument("--fail-page", type=int, default=3, help="Page failing the first run.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Items sent at the same time.")
+    parser.add_argument("--rate", type=float, default=100, help="Items sent per second.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    fail_at = args.fail_page * args.page_size
+    plex = FakePlex(items=args.items, fail_at=fail_at).start()
+    tvtime = FakeTVTime(latency=0.01).start()
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        client = create_client(tvtime.url, directory)
+        path = os.path.join(directory, "backfill.json")
+
+        def run() -> tuple[dict, float, Exception]:
+            backfill = Backfill(
+                client,
+                concurrency=args.concurrency,
+                rate=args.rate,
+                checkpoint=Checkpoint(path, plex.url),
+                progress_interval=3600,
+            )
+            started, error = time.monotonic(), None
+            try:
+                backfill.run(iter_plex_history(plex.url, TOKEN, page_size=args.page_size))
+            except requests.HTTPError as exc:
+                error = exc
+            return backfill.stats, time.monotonic() - started, error
+
+        try:
+            stats, _, error = run()
+            pages = [start for start, _ in plex.pages]
+            results.append(
+                check(
+                    "paging",
+                    pages == list(range(0, fail_at + 1, args.page_size)),
+                    f"pages requested from {pages}",
+                )
+            )
+            position = Checkpoint(path, plex.url).position
+            results.append(
+                check(
+                    "interrupted run",
+                    error is not None and position == fail_at == len(tvtime.history),
+                    f"{error}, checkpoint at {position}, {len(tvtime.history)} item(s) sent",
+                )
+            )
+
+            stats, elapsed, error = run()
+            sent = args.items - fail_at
+            results.append(
+                check(
+                    "resumed run",
+                    error is None and stats["read"] == stats["succeeded"] == sent,
+                    f"{stats['read']} item(s) read, {stats['succeeded']} sent",
+                )
+            )
+            # The bucket lets as many items as the concurrency through at once
+            minimum = max(0, sent - args.concurrency) / args.rate
+            results.append(
+                check(
+                    "rate limit",
+                    minimum * 0.95 <= elapsed <= minimum * 1.5 + 1,
+                    f"{sent / elapsed:.1f} item(s)/s for a limit of {args.rate:g}",
+                )
+            )
+            watched = tvtime.history
+            results.append(
+                check(
+                    "every item once",
+                    sorted(watched) == list(range(1, args.items + 1)),
+                    f"{len(watched)} item(s) sent, {len(set(watched))} distinct",
+                )
+            )
+        finally:
+            client.close()
+            plex.stop()
+            tvtime.stop()
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
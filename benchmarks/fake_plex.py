@@ -0,0 +1,197 @@
+"""
+fake_plex.py
+
+This module runs a local stand-in of the Plex watch history and metadata endpoints read
+by backfill.py, serving a history of episodes page by page, and failing a page on demand.
+
+Usage: python3 benchmarks/fake_plex.py [--port 32400] [--items 1000]
+"""
+
+import argparse
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+from xml.sax.saxutils import quoteattr
+
+HISTORY_PATH = "/status/sessions/history/all"
+METADATA_PATH = "/library/metadata/"
+TOKEN = "plex-token"
+
+
+class FakePlex(ThreadingHTTPServer):
+    """
+    A threaded HTTP server mimicking the watch history endpoint of a Plex server.
+
+    The history holds episodes whose TVDB IDs run from 1 to items, oldest first, paged with
+    the X-Plex-Container-Start and X-Plex-Container-Size headers as Plex does. The rating
+    key of an episode is its TVDB ID, its metadata holding its GUIDs.
+
+    Args:
+        port (int): The port to listen on, 0 picking a free one.
+        items (int): The number of episodes in the history.
+        fail_at (int): The start of a page answered with a 500 once, as when Plex restarts.
+        without_guids (set): The episodes listed in the history without their GUIDs,
+            as by servers ignoring includeGuids.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self, port: int = 0, items: int = 1000, fail_at: int = None, without_guids: set = ()
+    ) -> None:
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.items = items
+        self.fail_at = fail_at
+        self.without_guids = frozenset(without_guids)
+        # The rating keys of every metadata request, in order
+        self.lookups: list[str] = []
+        # The start and size of every page requested, in order
+        self.pages: list[tuple[int, int]] = []
+        self._lock = threading.Lock()
+        self._thread: threading.Thread = None
+
+    @property
+    def url(self) -> str:
+        """
+        Returns the base URL of the server.
+        """
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def page(self, start: int, size: int) -> bool:
+        """
+        Records a page request, telling whether it should fail.
+
+        Args:
+            start (int): The index of the first item of the page.
+            size (int): The number of items of the page.
+
+        Returns:
+            bool: True if the page is answered, False if it fails.
+        """
+        with self._lock:
+            self.pages.append((start, size))
+            if start == self.fail_at:
+                self.fail_at = None
+                return False
+            return True
+
+    def lookup(self, rating_key: str) -> bool:
+        """
+        Records a metadata request, telling whether the item exists.
+
+        Args:
+            rating_key (str): The rating key of the item.
+
+        Returns:
+            bool: True if the item is in the library, False otherwise.
+        """
+        with self._lock:
+            self.lookups.append(rating_key)
+        return rating_key.isdigit() and 1 <= int(rating_key) <= self.items
+
+    def handle_error(self, request, client_address) -> None:
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def start(self) -> "FakePlex":
+        """
+        Serves requests in a background thread.
+
+        Returns:
+            FakePlex: The server.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-plex", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops serving requests.
+        """
+        self.shutdown()
+        self.server_close()
+
+
+def episode(tvdb_id: int, guids: bool = True) -> str:
+    """
+    Returns the XML element of a watched episode, with the GUIDs Plex includes.
+
+    Args:
+        tvdb_id (int): The TVDB ID of the episode.
+        guids (bool): Whether to include the GUIDs.
+    """
+    title = quoteattr(f"Show {tvdb_id // 100}")
+    children = f'<Guid id="tvdb://{tvdb_id}"/><Guid id="imdb://tt{tvdb_id:07d}"/>' if guids else ""
+    return (
+        f'<Video type="episode" ratingKey="{tvdb_id}" grandparentTitle={title} '
+        f'viewedAt="{1600000000 + tvdb_id}">{children}</Video>'
+    )
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakePlex
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+        pass
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        path = urlparse(self.path).path
+        if self.headers.get("X-Plex-Token") != TOKEN:
+            self._reply(401, b"")
+            return
+        if path.startswith(METADATA_PATH):
+            self._metadata(path[len(METADATA_PATH) :])
+            return
+        if path != HISTORY_PATH:
+            self._reply(404, b"")
+            return
+        start = int(self.headers.get("X-Plex-Container-Start") or 0)
+        size = int(self.headers.get("X-Plex-Container-Size") or 50)
+        if not self.server.page(start, size):
+            self._reply(500, b"")
+            return
+        ids = range(start + 1, min(start + size, self.server.items) + 1)
+        body = (
+            f'<MediaContainer size="{len(ids)}" totalSize="{self.server.items}" offset="{start}">'
+            + "".join(episode(i, i not in self.server.without_guids) for i in ids)
+            + "</MediaContainer>"
+        )
+        self._reply(200, body.encode())
+
+    def _metadata(self, rating_key: str) -> None:
+        if not self.server.lookup(rating_key):
+            self._reply(404, b"")
+            return
+        body = f'<MediaContainer size="1">{episode(int(rating_key))}</MediaContainer>'
+        self._reply(200, body.encode())
+
+    def _reply(self, status: int, data: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main() -> None:
+    """
+    Runs the stand-in until interrupted.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--port", type=int, default=32400)
+    parser.add_argument("--items", type=int, default=1000, help="Episodes in the history.")
+    args = parser.parse_args()
+    server = FakePlex(args.port, args.items)
+    print(f"Fake Plex listening on {server.url}, token {TOKEN}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
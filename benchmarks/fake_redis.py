@@ -0,0 +1,282 @@
+"""
+fake_redis.py
+
+This module runs a local stand-in of a Redis server, answering the commands used by the
+shared state of the webhook over the Redis protocol, so several replicas can be run
+without a Redis server.
+
+Usage: python3 benchmarks/fake_redis.py [--port 6379]
+"""
+
+import argparse
+import socketserver
+import threading
+import time
+
+
+class FakeRedis(socketserver.ThreadingTCPServer):
+    """
+    A threaded TCP server keeping strings, lists and sorted sets in memory.
+
+    Every command runs under a single lock, so they are atomic as in Redis, and every
+    write bumps the version of its key, so WATCH can abort a transaction.
+
+    Args:
+        port (int): The port to listen on, 0 picking a free one.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port: int = 0) -> None:
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.data: dict[str, object] = {}
+        self.expiry: dict[str, float] = {}
+        self.versions: dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.commands = 0
+        self._thread: threading.Thread = None
+
+    @property
+    def url(self) -> str:
+        """
+        Returns the URL of the server.
+        """
+        return f"redis://127.0.0.1:{self.server_address[1]}/0"
+
+    def start(self) -> "FakeRedis":
+        """
+        Serves requests in a background thread.
+
+        Returns:
+            FakeRedis: The server.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-redis", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops serving requests.
+        """
+        self.shutdown()
+        self.server_close()
+
+    def value(self, key: str, default=None):
+        """
+        Returns the value of a key, deleting it if it expired. The lock must be held.
+        """
+        expires_at = self.expiry.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self.remove(key)
+        return self.data.get(key, default)
+
+    def store(self, key: str, value, ttl_ms: int = None) -> None:
+        """
+        Stores the value of a key. The lock must be held.
+        """
+        self.data[key] = value
+        self.expiry.pop(key, None)
+        if ttl_ms is not None:
+            self.expiry[key] = time.time() + ttl_ms / 1000
+        self.touch(key)
+
+    def remove(self, key: str) -> bool:
+        """
+        Deletes a key. The lock must be held.
+        """
+        self.expiry.pop(key, None)
+        if self.data.pop(key, None) is None:
+            return False
+        self.touch(key)
+        return True
+
+    def touch(self, key: str) -> None:
+        """
+        Bumps the version of a key. The lock must be held.
+        """
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: FakeRedis
+
+    def setup(self) -> None:
+        super().setup()
+        self.watched: dict[str, int] = {}
+        self.queued: list[list[str]] | None = None
+
+    def handle(self) -> None:
+        while True:
+            try:
+                args = self._read_command()
+            except (ConnectionError, ValueError):
+                return
+            if args is None:
+                return
+            self.wfile.write(self._dispatch(args))
+
+    def _read_command(self) -> list[str] | None:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.decode().split()
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2].decode())
+        return args
+
+    def _dispatch(self, args: list[str]) -> bytes:
+        name = args[0].upper()
+        if self.queued is not None and name not in ("EXEC", "DISCARD", "MULTI", "WATCH"):
+            self.queued.append(args)
+            return b"+QUEUED\r\n"
+        with self.server.lock:
+            self.server.commands += 1
+            try:
+                return self._encode(self._run(name, args[1:]))
+            except (ValueError, IndexError) as exc:
+                return f"-ERR {exc}\r\n".encode()
+
+    def _run(self, name: str, args: list[str]):  # pylint: disable=too-many-return-statements
+        server = self.server
+        if name in ("PING", "AUTH", "SELECT"):
+            return "PONG" if name == "PING" else "OK"
+        if name == "MULTI":
+            self.queued = []
+            return "OK"
+        if name == "DISCARD":
+            self.queued, self.watched = None, {}
+            return "OK"
+        if name == "WATCH":
+            for key in args:
+                server.value(key)
+                self.watched[key] = server.versions.get(key, 0)
+            return "OK"
+        if name == "UNWATCH":
+            self.watched = {}
+            return "OK"
+        if name == "EXEC":
+            queued, self.queued = self.queued or [], None
+            watched, self.watched = self.watched, {}
+            for key, version in watched.items():
+                server.value(key)
+                if server.versions.get(key, 0) != version:
+                    return _NIL_ARRAY
+            return [self._run(args[0].upper(), args[1:]) for args in queued]
+        return self._run_data(name, args)
+
+    def _run_data(self, name: str, args: list[str]):  # pylint: disable=too-many-branches
+        server = self.server
+        if name == "GET":
+            return server.value(args[0])
+        if name == "SET":
+            key, value, options = args[0], args[1], [a.upper() for a in args[2:]]
+            ttl_ms = None
+            if "PX" in options:
+                ttl_ms = int(args[2 + options.index("PX") + 1])
+            elif "EX" in options:
+                ttl_ms = int(args[2 + options.index("EX") + 1]) * 1000
+            exists = server.value(key) is not None
+            if ("NX" in options and exists) or ("XX" in options and not exists):
+                return None
+            server.store(key, value, ttl_ms)
+            return "OK"
+        if name == "DEL":
+            return sum(server.remove(key) for key in args)
+        if name == "PEXPIRE":
+            if server.value(args[0]) is None:
+                return 0
+            server.expiry[args[0]] = time.time() + int(args[1]) / 1000
+            server.touch(args[0])
+            return 1
+        if name == "RPUSH":
+            values = server.value(args[0], [])
+            values.extend(args[1:])
+            server.store(args[0], values)
+            return len(values)
+        if name in ("LRANGE", "LTRIM"):
+            values = server.value(args[0], [])
+            start, stop = _list_slice(len(values), int(args[1]), int(args[2]))
+            if name == "LRANGE":
+                return values[start:stop]
+            if start >= stop:
+                server.remove(args[0])
+            elif (start, stop) != (0, len(values)):
+                server.store(args[0], values[start:stop])
+            return "OK"
+        if name == "LLEN":
+            return len(server.value(args[0], []))
+        if name == "ZADD":
+            members = server.value(args[0], {})
+            for score, member in zip(args[1::2], args[2::2], strict=True):
+                members[member] = float(score)
+            server.store(args[0], members)
+            return len(args[1:]) // 2
+        if name in ("ZRANGEBYSCORE", "ZREMRANGEBYSCORE"):
+            members = server.value(args[0], {})
+            matched = [m for m, s in members.items() if _in_range(s, args[1], args[2])]
+            if name == "ZRANGEBYSCORE":
+                return sorted(matched, key=lambda m: (members[m], m))
+            for member in matched:
+                del members[member]
+            if matched:
+                server.touch(args[0])
+            return len(matched)
+        raise ValueError(f"unknown command '{name}'")
+
+    def _encode(self, value) -> bytes:
+        if value is _NIL_ARRAY:
+            return b"*-1\r\n"
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(self._encode(v) for v in value)
+        if value in ("OK", "PONG", "QUEUED"):
+            return f"+{value}\r\n".encode()
+        data = str(value).encode()
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+_NIL_ARRAY = object()
+
+
+def _list_slice(length: int, start: int, stop: int) -> tuple[int, int]:
+    # Redis list indexes are inclusive, negative ones counting from the end
+    start = max(0, start + length if start < 0 else start)
+    stop = min(length, (stop + length if stop < 0 else stop) + 1)
+    return start, max(start, stop)
+
+
+def _in_range(score: float, low: str, high: str) -> bool:
+    def bound(text: str) -> tuple[float, bool]:
+        exclusive = text.startswith("(")
+        return float(text.lstrip("(")), exclusive
+
+    (lo, lo_ex), (hi, hi_ex) = bound(low), bound(high)
+    return (score > lo if lo_ex else score >= lo) and (score < hi if hi_ex else score <= hi)
+
+
+def main() -> None:
+    """
+    Runs the stand-in until interrupted.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    server = FakeRedis(args.port)
+    print(f"Fake Redis listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+fake_tvtime.py
+
+This module runs a local stand-in of the TVTime API, answering the sidecar routes
+used by tvtime.py with a configurable latency and error rate.
+
+Usage: python3 benchmarks/fake_tvtime.py [--port 8765] [--latency 0.05] [--error-rate 0.01]
+"""
+
+import argparse
+import base64
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+EPISODE_ROUTE = re.compile(r"/v2/watched_episodes/episode/(\d+)")
+HISTORY_ROUTE = re.compile(r"/v2/watched_episodes$")
+MOVIE_ROUTE = re.compile(r"/prod/v1/tracking/([\w-]+)/watch")
+SEARCH_ROUTE = re.compile(r"/v1/search/series,movie")
+AUTH_ROUTE = re.compile(r"/v1/(login|refresh)$")
+
+
+def make_jwt(lifetime: float = 3600) -> str:
+    """
+    Builds an unsigned JWT with the "iat" and "exp" claims the client reads, unique to the call.
+
+    Args:
+        lifetime (float): The number of seconds the token is valid.
+
+    Returns:
+        str: The token.
+    """
+
+    def encode(part: dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(part).encode()).rstrip(b"=").decode()
+
+    now = int(time.time())
+    claims = {"iat": now, "exp": now + int(lifetime), "jti": uuid.uuid4().hex}
+    return f"{encode({'alg': 'none'})}.{encode(claims)}.sig"
+
+
+class FakeTVTime(ThreadingHTTPServer):
+    """
+    A threaded HTTP server mimicking the TVTime sidecar routes.
+
+    Args:
+        port (int): The port to listen on, 0 picking a free one.
+        latency (float): The number of seconds every response is delayed by.
+        jitter (float): The maximum random number of seconds added to the latency.
+        error_rate (float): The share of requests answered with a 503.
+        seed (int): The seed of the random generator.
+        history (int): The number of episodes every account already watched, from 1 to history.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port: int = 0,
+        latency: float = 0.05,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = 0,
+        history: int = 0,
+    ) -> None:  # pylint: disable=too-many-arguments
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.counts: dict[str, int] = {}
+        # The watched episodes, the most recently watched first
+        self.history: list[int] = list(range(history, 0, -1))
+        self.tokens: set[str] = set()
+        self.revoked: set[str] = set()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread = None
+
+    @property
+    def url(self) -> str:
+        """
+        Returns the base URL of the server.
+        """
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, route: str) -> None:
+        """
+        Counts a request to a route.
+
+        Args:
+            route (str): The name of the route.
+        """
+        with self._lock:
+            self.counts[route] = self.counts.get(route, 0) + 1
+
+    def revoke_tokens(self) -> None:
+        """
+        Rejects the tokens used so far with a 401, as when they expire.
+        """
+        with self._lock:
+            self.revoked |= self.tokens
+
+    def authorized(self, token: str) -> bool:
+        """
+        Records a token, telling whether it was revoked.
+
+        Args:
+            token (str): The bearer token of a request.
+
+        Returns:
+            bool: False if the token was revoked, True otherwise.
+        """
+        with self._lock:
+            self.tokens.add(token)
+            return token not in self.revoked
+
+    def watch(self, episode_id: int) -> None:
+        """
+        Records an episode as the most recently watched.
+
+        Args:
+            episode_id (int): The ID of the episode.
+        """
+        with self._lock:
+            self.history.insert(0, episode_id)
+
+    def stats(self) -> dict:
+        """
+        Returns the number of requests answered by route.
+
+        Returns:
+            dict: A mapping of route names to request counts.
+        """
+        with self._lock:
+            return dict(self.counts)
+
+    def handle_error(self, request, client_address) -> None:
+        # Clients hanging up, such as a webhook being stopped, are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def start(self) -> "FakeTVTime":
+        """
+        Serves requests in a background thread.
+
+        Returns:
+            FakeTVTime: The server.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-tvtime", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops serving requests.
+        """
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakeTVTime
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+        pass
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        self._handle()
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        self._handle()
+
+    def _handle(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        target = (parse_qs(urlparse(self.path).query).get("o") or [""])[0]
+        server = self.server
+        delay = server.latency + server.random.uniform(0, server.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        route, body = self._route(urlparse(target).path, parse_qs(urlparse(self.path).query))
+        server.count(route)
+        token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+        if route == "unknown":
+            self._reply(404, {"status": "error"})
+        elif route != "auth" and not server.authorized(token):
+            server.count("unauthorized")
+            self._reply(401, {"message": "Unauthorized"})
+        elif server.random.random() < server.error_rate:
+            server.count("errors")
+            self._reply(503, None)
+        else:
+            if route == "watched_episodes":
+                server.watch(int(EPISODE_ROUTE.search(target).group(1)))
+            self._reply(200, body)
+
+    def _route(self, path: str, query: dict) -> tuple[str, dict]:
+        if HISTORY_ROUTE.search(path):
+            page, limit = int(query.get("page", ["0"])[0]), int(query.get("limit", ["100"])[0])
+            episodes = self.server.history[page * limit : (page + 1) * limit]
+            return "history", {"result": "OK", "watched_episodes": [{"id": i} for i in episodes]}
+        if match := EPISODE_ROUTE.search(path):
+            episode = int(match.group(1))
+            return "watched_episodes", {
+                "result": "OK",
+                "number": episode % 20 + 1,
+                "season": {"number": 1},
+                "show": {"name": "Some Show"},
+            }
+        if MOVIE_ROUTE.search(path):
+            return "tracking", {"status": "success"}
+        if SEARCH_ROUTE.search(path):
+            movie_id = int(query.get("q", ["0"])[0])
+            return "search", {
+                "status": "success",
+                "data": [{"id": movie_id, "uuid": f"00000000-0000-0000-0000-{movie_id:012d}"}],
+            }
+        if AUTH_ROUTE.search(path):
+            return "auth", {"data": {"jwt_token": make_jwt(), "jwt_refresh_token": "refresh"}}
+        return "unknown", {}
+
+    def _reply(self, status: int, body: dict | None) -> None:
+        data = json.dumps(body).encode() if body is not None else b"<html>Unavailable</html>"
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json" if body is not None else "text/html")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main() -> None:
+    """
+    Runs the stand-in until interrupted.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per response.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of 503 responses.")
+    parser.add_argument("--history", type=int, default=0, help="Episodes already watched.")
+    args = parser.parse_args()
+    server = FakeTVTime(args.port, args.latency, args.jitter, args.error_rate, history=args.history)
+    print(f"Fake TVTime listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+load.py
+
+This benchmark starts the webhook against a local stand-in of TVTime and drives a mix of
+Plex events to /tvtime/plex, reporting the latency and throughput for every number of users.
+With --replicas, several webhooks share a state backend and the requests are spread over them.
+
+Usage: python3 benchmarks/load.py [--users 1,10,50] [--duration 10] [--concurrency 16]
+                                  [--replicas 1] [--state sqlite|redis]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+from fake_redis import FakeRedis
+from fake_tvtime import FakeTVTime, make_jwt
+from payloads import PayloadGenerator
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+APP = os.path.join(ROOT, "app", "app.py")
+CONFIG = os.path.join(ROOT, "config", "config.yml")
+# Replicas rebalance the accounts every third of it
+LEASE_TTL = 3
+
+
+def free_port() -> int:
+    """
+    Returns a port nothing listens on.
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: list[float], share: float) -> float:
+    """
+    Returns the value below which a share of the sorted values fall.
+    """
+    return values[min(len(values) - 1, int(share * len(values)))] if values else 0.0
+
+
+def write_config(
+    directory: str,
+    users: list[str],
+    tvtime_url: str,
+    port: int,
+    mode: str,
+    state_url: str = None,
+) -> None:  # pylint: disable=too-many-arguments
+    """
+    Writes the configuration of the webhook under test, with tokens already cached for every
+    user so no browser is started.
+
+    Args:
+        directory (str): The working directory of the webhook.
+        users (list): The Plex users, each with its own TVTime account.
+        tvtime_url (str): The base URL of the TVTime stand-in.
+        port (int): The port the webhook listens on.
+        mode (str): The server mode, "production" or "development".
+        state_url (str): The URL of the state shared with other replicas, if any.
+    """
+    with open(CONFIG, encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    config["users"] = {
+        user: {"tvtime": {"username": f"{user}@example.com", "password": "secret"}}
+        for user in users
+    }
+    config["tvtime"] = {
+        "api_url": tvtime_url,
+        "auth_url": f"{tvtime_url}/sidecar?o=https://auth.tvtime.com/v1",
+    }
+    config["logging"]["level"] = "WARNING"
+    config["reload"]["interval"] = 0
+    config["server"].update({"mode": mode, "host": "127.0.0.1", "port": port})
+    if state_url:
+        config["state"].update({"enabled": True, "url": state_url, "lease_ttl": LEASE_TTL})
+    os.makedirs(os.path.join(directory, "config", "tokens"), mode=0o700)
+    with open(os.path.join(directory, "config", "config.yml"), "w", encoding="utf-8") as f:
+        yaml.safe_dump(config, f)
+    for user in users:
+        path = os.path.join(directory, "config", "tokens", f"{user}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"username": f"{user}@example.com", "token": make_jwt(), "refresh_token": "r"}, f
+            )
+
+
+def wait_healthy(
+    port: int, process: subprocess.Popen, timeout: float = 60, interval: float = 0.2
+) -> None:
+    """
+    Waits for the webhook to report every account as logged in.
+
+    Args:
+        port (int): The port the webhook listens on.
+        process (subprocess.Popen): The webhook process.
+        timeout (float): The maximum number of seconds to wait.
+        interval (float): The number of seconds between two health checks.
+
+    Raises:
+        RuntimeError: If the webhook exits or is not healthy in time.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The webhook exited with code {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(interval)
+    raise RuntimeError("The webhook did not become healthy in time")
+
+
+def drive(ports: list[int], generator: PayloadGenerator, duration: float, concurrency: int) -> dict:
+    """
+    Posts generated requests to the webhooks from several keep-alive connections,
+    spread round-robin over the replicas.
+
+    Args:
+        ports (list): The ports the replicas of the webhook listen on.
+        generator (PayloadGenerator): The source of requests.
+        duration (float): The number of seconds to send requests for.
+        concurrency (int): The number of connections sending requests at the same time.
+
+    Returns:
+        dict: The latencies in seconds, the response counts by status and the elapsed time.
+    """
+    lock = threading.Lock()
+    latencies: list[float] = []
+    statuses: dict[int | str, int] = {}
+    deadline = time.monotonic() + duration
+
+    def _worker(port: int) -> None:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        while time.monotonic() < deadline:
+            with lock:
+                _, body, content_type = generator.next()
+            started = time.perf_counter()
+            try:
+                conn.request("POST", "/tvtime/plex", body, {"Content-Type": content_type})
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                status = "error"
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+        conn.close()
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i in range(concurrency):
+            pool.submit(_worker, ports[i % len(ports)])
+    return {
+        "latencies": sorted(latencies),
+        "statuses": statuses,
+        "elapsed": time.monotonic() - started,
+    }
+
+
+def cluster_stats(port: int) -> dict:
+    """
+    Returns the "cluster" section of the health of a replica, empty if it cannot be read.
+    """
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        conn.request("GET", "/health")
+        return json.loads(conn.getresponse().read()).get("cluster") or {}
+    except (OSError, ValueError, http.client.HTTPException):
+        return {}
+
+
+def wait_balanced(ports: list[int], users: int, timeout: float = 30) -> None:
+    """
+    Waits for the replicas to own a share of the accounts each.
+
+    Args:
+        ports (list): The ports the replicas of the webhook listen on.
+        users (int): The number of accounts.
+        timeout (float): The maximum number of seconds to wait.
+
+    Raises:
+        RuntimeError: If the accounts are not balanced in time.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        owned = [len(cluster_stats(port).get("owned", [])) for port in ports]
+        if sum(owned) == users and max(owned) - min(owned) <= 1:
+            return
+        time.sleep(0.2)
+    raise RuntimeError("The replicas did not split the accounts in time")
+
+
+def run(users: int, args: argparse.Namespace, tvtime: FakeTVTime, redis: FakeRedis) -> dict:
+    """
+    Runs the replicas of the webhook with a number of users and drives them.
+
+    Returns:
+        dict: The results of drive(), with the cluster stats of every replica.
+    """
+    names = [f"user{i}" for i in range(users)]
+    ports = [free_port() for _ in range(args.replicas)]
+    processes = []
+    with tempfile.TemporaryDirectory() as shared:
+        state_url = None
+        if args.replicas > 1:
+            state_url = redis.url if redis else f"sqlite:///{shared}/state.db"
+        try:
+            for i, port in enumerate(ports):
+                directory = os.path.join(shared, f"replica{i}")
+                write_config(directory, names, tvtime.url, port, args.mode, state_url)
+                processes.append(
+                    subprocess.Popen(  # pylint: disable=consider-using-with
+                        [sys.executable, APP],
+                        cwd=directory,
+                        stdout=subprocess.DEVNULL,
+                        stderr=None if args.verbose else subprocess.DEVNULL,
+                    )
+                )
+            for port, process in zip(ports, processes, strict=True):
+                wait_healthy(port, process)
+            if state_url:
+                wait_balanced(ports, users)
+            generator = PayloadGenerator(
+                names, args.scrobble_ratio, args.movie_ratio, args.thumb_ratio
+            )
+            result = drive(ports, generator, args.duration, args.concurrency)
+            result["cluster"] = [cluster_stats(port) for port in ports]
+            return result
+        finally:
+            for process in processes:
+                process.send_signal(signal.SIGTERM)
+            for process in processes:
+                try:
+                    process.wait(timeout=60)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+
+def main() -> None:
+    """
+    Runs the benchmark for every number of users and prints the results.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--users", default="1,10,50", help="Comma-separated numbers of users.")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per run.")
+    parser.add_argument("--concurrency", type=int, default=16, help="Connections to the webhook.")
+    parser.add_argument("--mode", default="production", choices=("production", "development"))
+    parser.add_argument("--scrobble-ratio", type=float, default=0.2)
+    parser.add_argument("--movie-ratio", type=float, default=0.3)
+    parser.add_argument("--thumb-ratio", type=float, default=0.5)
+    parser.add_argument("--latency", type=float, default=0.05, help="TVTime seconds per response.")
+    parser.add_argument("--jitter", type=float, default=0.02, help="TVTime random extra seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="TVTime share of 503s.")
+    parser.add_argument("--replicas", type=int, default=1, help="Webhooks sharing a state.")
+    parser.add_argument("--state", default="sqlite", choices=("sqlite", "redis"))
+    parser.add_argument("--verbose", action="store_true", help="Show the logs of the webhook.")
+    args = parser.parse_args()
+
+    tvtime = FakeTVTime(0, args.latency, args.jitter, args.error_rate).start()
+    redis = FakeRedis().start() if args.replicas > 1 and args.state == "redis" else None
+    print(f"{'users':>6}{'requests':>10}{'req/s':>10}{'p50 (ms)':>10}{'p99 (ms)':>10}  statuses")
+    try:
+        for users in (int(n) for n in args.users.split(",")):
+            result = run(users, args, tvtime, redis)
+            latencies = result["latencies"]
+            statuses = ", ".join(
+                f"{k}: {v}" for k, v in sorted(result["statuses"].items(), key=str)
+            )
+            print(
+                f"{users:>6}{len(latencies):>10}{len(latencies) / result['elapsed']:>10.1f}"
+                f"{percentile(latencies, 0.5) * 1e3:>10.1f}"
+                f"{percentile(latencies, 0.99) * 1e3:>10.1f}  {statuses}"
+            )
+            for stats in result["cluster"] if args.replicas > 1 else ():
+                print(
+                    f"{'':>6}{stats.get('replica', '?')}: {len(stats.get('owned', []))} account(s),"
+                    f" {stats.get('forwarded', 0)} forwarded, {stats.get('received', 0)} received"
+                )
+        print(f"TVTime requests: {tvtime.stats()}")
+    finally:
+        tvtime.stop()
+        if redis:
+            redis.stop()
+
+
+if __name__ == "__main__":
+    main()
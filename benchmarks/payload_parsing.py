@@ -0,0 +1,134 @@
+"""
+payload_parsing.py
+
+This benchmark compares the parsing of Plex webhook requests by the full form parser,
+which the webhook used to do, with the streaming fast path it now uses.
+
+Usage: python3 benchmarks/payload_parsing.py [--iterations N] [--thumb-size BYTES]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from io import BytesIO
+
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from payloads import make_payload  # pylint: disable=wrong-import-position
+from utils.multipart import read_field  # pylint: disable=import-error,wrong-import-position
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+USERS = ("alice", "bob")
+EVENTS = ("media.play", "media.pause", "media.resume", "media.rate", "media.scrobble")
+
+
+def make_request(payload: bytes, thumb: bytes = None) -> dict:
+    """
+    Builds the WSGI environment of a webhook request, with a thumbnail part if given.
+
+    Args:
+        payload (bytes): The JSON payload.
+        thumb (bytes): The thumbnail image.
+
+    Returns:
+        dict: The WSGI environment.
+    """
+    data = {"payload": payload.decode()}
+    if thumb is not None:
+        data["thumb"] = (BytesIO(thumb), "thumb.jpg", "image/jpeg")
+    builder = EnvironBuilder(
+        method="POST", path="/tvtime/plex", data=data, content_type="multipart/form-data"
+    )
+    try:
+        return builder.get_environ()
+    finally:
+        builder.close()
+
+
+def full_parse(environ: dict) -> bool:
+    """
+    Parses a request like the webhook used to: the whole form, then the whole payload.
+    """
+    request = Request(environ)
+    form = request.form.to_dict(flat=False)
+    _ = request.files.to_dict(flat=False)
+    data = json.loads(form["payload"][0])
+    return data.get("event") == "media.scrobble" and data["Account"]["title"].lower() in USERS
+
+
+def fast_parse(environ: dict) -> bool:
+    """
+    Parses a request like the webhook does: the payload field only, scanned before being decoded.
+    """
+    request = Request(environ)
+    boundary = request.mimetype_params["boundary"].encode()
+    payload = read_field(request.stream, boundary, "payload")
+    if b'"media.scrobble"' not in payload:
+        return False
+    lowered = payload.lower()
+    if not any(user.encode() in lowered for user in USERS):
+        return False
+    data = json_loads(payload)
+    return data.get("event") == "media.scrobble" and data["Account"]["title"].lower() in USERS
+
+
+def bench(parse, requests: list[tuple[bytes, dict]], iterations: int) -> float:
+    """
+    Times a parser over a set of requests.
+
+    Returns:
+        float: The average time per request, in microseconds.
+    """
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for body, environ in requests:
+            environ["wsgi.input"] = BytesIO(body)
+            parse(environ)
+    return (time.perf_counter() - started) / (iterations * len(requests)) * 1e6
+
+
+def main() -> None:
+    """
+    Runs the benchmark and prints the average time per request of both parsers.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--thumb-size", type=int, default=150 * 1024)
+    args = parser.parse_args()
+
+    thumb = os.urandom(args.thumb_size)
+    scenarios = {
+        "scrobble, no thumbnail": [(make_payload("media.scrobble", "alice"), None)],
+        "scrobble, thumbnail": [(make_payload("media.scrobble", "alice"), thumb)],
+        "play/pause/resume/rate, thumbnail": [
+            (make_payload(event, "alice"), thumb) for event in EVENTS[:-1]
+        ],
+        "scrobble of an unknown user, thumbnail": [(make_payload("media.scrobble", "eve"), thumb)],
+    }
+    print(f"{'scenario':<42}{'full (us)':>12}{'fast (us)':>12}{'speedup':>10}")
+    for name, payloads in scenarios.items():
+        requests = []
+        for payload, image in payloads:
+            environ = make_request(payload, image)
+            requests.append((environ["wsgi.input"].read(), environ))
+        for body, environ in requests:
+            environ["wsgi.input"] = BytesIO(body)
+            expected = full_parse(environ)
+            environ["wsgi.input"] = BytesIO(body)
+            assert fast_parse(environ) == expected, name
+        full = bench(full_parse, requests, args.iterations)
+        fast = bench(fast_parse, requests, args.iterations)
+        print(f"{name:<42}{full:>12.1f}{fast:>12.1f}{full / fast:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
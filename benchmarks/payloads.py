@@ -0,0 +1,151 @@
+"""
+payloads.py
+
+This module generates Plex webhook requests: movie and episode scrobbles, and the
+other events Plex sends to the webhook, with or without a thumbnail.
+"""
+
+import json
+import os
+import random
+import uuid
+
+NOISE_EVENTS = ("media.play", "media.pause", "media.resume", "media.stop", "media.rate")
+THUMB_SIZE = 150 * 1024
+
+
+def make_payload(event: str, user: str, media_type: str = "show", media_id: int = 7000001) -> bytes:
+    """
+    Builds a payload shaped like the ones sent by Plex.
+
+    Args:
+        event (str): The event name, such as "media.scrobble".
+        user (str): The Plex account title.
+        media_type (str): Either "show" for an episode or "movie".
+        media_id (int): The TVDB ID of the episode or the movie.
+
+    Returns:
+        bytes: The JSON payload.
+    """
+    metadata = {
+        "librarySectionType": media_type,
+        "ratingKey": str(media_id),
+        "key": f"/library/metadata/{media_id}",
+        "guid": f"plex://{'episode' if media_type == 'show' else 'movie'}/{uuid.uuid4().hex[:24]}",
+        "type": "episode" if media_type == "show" else "movie",
+        "title": "Pilot" if media_type == "show" else f"Movie {media_id}",
+        "summary": "A summary of the media. " * 20,
+        "year": 2020,
+        "thumb": f"/library/metadata/{media_id}/thumb/1600000000",
+        "duration": 2700000,
+        "Guid": [
+            {"id": "imdb://tt0000001"},
+            {"id": f"tmdb://{media_id + 1000}"},
+            {"id": f"tvdb://{media_id}"},
+        ],
+        "Role": [{"tag": f"Actor {i}", "role": f"Role {i}"} for i in range(15)],
+    }
+    if media_type == "show":
+        metadata.update(
+            {
+                "grandparentTitle": "Some Show",
+                "parentTitle": "Season 1",
+                "index": 1,
+                "parentIndex": 1,
+            }
+        )
+    payload = {
+        "event": event,
+        "user": True,
+        "owner": True,
+        "Account": {"id": 1, "thumb": "https://plex.tv/users/abc/avatar", "title": user},
+        "Server": {"title": "plex", "uuid": "0" * 40},
+        "Player": {
+            "local": True,
+            "publicAddress": "203.0.113.1",
+            "title": "Living Room",
+            "uuid": "1" * 24,
+        },
+        "Metadata": metadata,
+    }
+    return json.dumps(payload).encode()
+
+
+def make_body(payload: bytes, thumb: bytes = None) -> tuple[bytes, str]:
+    """
+    Encodes a payload, and a thumbnail if given, as the multipart body Plex posts.
+
+    Args:
+        payload (bytes): The JSON payload.
+        thumb (bytes): The JPEG thumbnail.
+
+    Returns:
+        tuple: The body and its content type.
+    """
+    boundary = uuid.uuid4().hex
+    parts = [
+        f"--{boundary}\r\n".encode(),
+        b'Content-Disposition: form-data; name="payload"\r\n',
+        b"Content-Type: application/json\r\n\r\n",
+        payload,
+        b"\r\n",
+    ]
+    if thumb is not None:
+        parts += [
+            f"--{boundary}\r\n".encode(),
+            b'Content-Disposition: form-data; name="thumb"; filename="thumb.jpg"\r\n',
+            b"Content-Type: image/jpeg\r\n\r\n",
+            thumb,
+            b"\r\n",
+        ]
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class PayloadGenerator:  # pylint: disable=too-few-public-methods
+    """
+    This class generates a random mix of webhook requests.
+
+    Args:
+        users (list): The Plex account titles the events are sent for.
+        scrobble_ratio (float): The share of scrobbles, the other requests being noise events.
+        movie_ratio (float): The share of movies among the scrobbles.
+        thumb_ratio (float): The share of requests carrying a thumbnail.
+        seed (int): The seed of the random generator, for reproducible runs.
+    """
+
+    def __init__(
+        self,
+        users: list[str],
+        scrobble_ratio: float = 0.2,
+        movie_ratio: float = 0.3,
+        thumb_ratio: float = 0.5,
+        seed: int = 0,
+    ) -> None:  # pylint: disable=too-many-arguments
+        self.users = users
+        self.scrobble_ratio = scrobble_ratio
+        self.movie_ratio = movie_ratio
+        self.thumb_ratio = thumb_ratio
+        self.random = random.Random(seed)
+        self.thumb = os.urandom(THUMB_SIZE)
+        self._next_id = 7000000
+
+    def next(self) -> tuple[str, bytes, str]:
+        """
+        Generates a request.
+
+        Returns:
+            tuple: The kind of request ("movie", "episode" or "noise"), its body and content type.
+        """
+        self._next_id += 1
+        user = self.random.choice(self.users)
+        if self.random.random() < self.scrobble_ratio:
+            media_type = "movie" if self.random.random() < self.movie_ratio else "show"
+            kind = "movie" if media_type == "movie" else "episode"
+            payload = make_payload("media.scrobble", user, media_type, self._next_id)
+        else:
+            kind = "noise"
+            payload = make_payload(self.random.choice(NOISE_EVENTS), user, "show", self._next_id)
+        thumb = self.thumb if self.random.random() < self.thumb_ratio else None
+        body, content_type = make_body(payload, thumb)
+        return kind, body, content_type
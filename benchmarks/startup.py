@@ -0,0 +1,125 @@
+"""
+startup.py
+
+This benchmark profiles the cold start of the webhook with cached TVTime tokens: the time
+to import the app module, whether Selenium was imported, and the time from launch to the
+first healthy /health.
+
+Usage: python3 benchmarks/startup.py [--users 1] [--runs 5] [--mode production]
+"""
+
+import argparse
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_tvtime import FakeTVTime
+from load import APP, free_port, wait_healthy, write_config
+
+# Timed in a fresh interpreter, from the working directory of the webhook
+IMPORT_PROBE = f"""
+import sys, time
+sys.path.insert(0, {os.path.dirname(APP)!r})
+started = time.perf_counter()
+import app
+print(time.perf_counter() - started, "selenium" in sys.modules)
+"""
+TARGET = 1.0
+
+
+def time_import(directory: str) -> tuple[float, bool]:
+    """
+    Imports the app module in a fresh interpreter.
+
+    Args:
+        directory (str): The working directory of the webhook.
+
+    Returns:
+        tuple: The number of seconds the import took and whether it imported Selenium.
+    """
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE],
+        cwd=directory,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+    return float(output[-2]), output[-1] == "True"
+
+
+def time_ready(directory: str, port: int, verbose: bool) -> float:
+    """
+    Launches the webhook and waits for it to be healthy.
+
+    Args:
+        directory (str): The working directory of the webhook.
+        port (int): The port the webhook listens on.
+        verbose (bool): Whether to show the logs of the webhook.
+
+    Returns:
+        float: The number of seconds from launch to the first healthy /health.
+    """
+    started = time.perf_counter()
+    with subprocess.Popen(
+        [sys.executable, APP],
+        cwd=directory,
+        stdout=subprocess.DEVNULL,
+        stderr=None if verbose else subprocess.DEVNULL,
+    ) as process:
+        try:
+            wait_healthy(port, process, interval=0.01)
+            return time.perf_counter() - started
+        finally:
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def main() -> None:
+    """
+    Runs the benchmark and prints the results.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--users", type=int, default=1, help="Number of users.")
+    parser.add_argument("--runs", type=int, default=5, help="Number of cold starts.")
+    parser.add_argument("--mode", default="production", choices=("production", "development"))
+    parser.add_argument("--verbose", action="store_true", help="Show the logs of the webhook.")
+    args = parser.parse_args()
+
+    tvtime = FakeTVTime(0, latency=0.0).start()
+    imports, readies, selenium = [], [], False
+    try:
+        for _ in range(args.runs):
+            port = free_port()
+            with tempfile.TemporaryDirectory() as directory:
+                write_config(
+                    directory, [f"user{i}" for i in range(args.users)], tvtime.url, port, args.mode
+                )
+                seconds, imported = time_import(directory)
+                imports.append(seconds)
+                selenium = selenium or imported
+                readies.append(time_ready(directory, port, args.verbose))
+    finally:
+        tvtime.stop()
+
+    print(f"{'':>20}{'min (ms)':>10}{'median (ms)':>13}{'max (ms)':>10}")
+    for name, values in (("import app", imports), ("first /health", readies)):
+        print(
+            f"{name:>20}{min(values) * 1e3:>10.1f}{statistics.median(values) * 1e3:>13.1f}"
+            f"{max(values) * 1e3:>10.1f}"
+        )
+    print(f"Selenium imported: {'yes' if selenium else 'no'}")
+    ready = statistics.median(readies)
+    print(
+        f"Ready in {ready:.2f}s, {'within' if ready <= TARGET else 'over'} the {TARGET:.0f}s target"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Tests of the history readers and of the checkpoint of the backfill.
+"""
+
+import io
+import json
+import os
+import sys
+
+import backfill
+import pytest
+from backfill import Backfill, Checkpoint, iter_json_items, iter_plex_history
+from tvtime import TVTimeAuthError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+from fake_plex import TOKEN, FakePlex  # noqa: E402 pylint: disable=wrong-import-position
+
+
+class FakeClient:
+    """
+    A TVTime client recording the episodes marked as watched, refusing some on demand.
+    """
+
+    def __init__(self, failing: set = (), auth_error: bool = False) -> None:
+        self.user = "alice"
+        self.failing = failing
+        self.auth_error = auth_error
+        self.watched: list[int] = []
+
+    def watch_episode(self, episode_id: int) -> bool:
+        if self.auth_error:
+            raise TVTimeAuthError("wrong password")
+        if episode_id in self.failing:
+            return False
+        self.watched.append(episode_id)
+        return True
+
+
+def episodes(*ids: int) -> list[dict]:
+    return [
+        {"type": "episode", "grandparentTitle": "Show", "Guid": [{"id": f"tvdb://{i}"}]}
+        for i in ids
+    ]
+
+
+@pytest.fixture
+def plex():
+    server = FakePlex(items=5, without_guids={2, 3}).start()
+    yield server
+    server.stop()
+
+
+def test_json_items_of_a_top_level_array():
+    export = io.StringIO(json.dumps(episodes(1, 2, 3)))
+
+    assert list(iter_json_items(export, chunk_size=7)) == episodes(1, 2, 3)
+
+
+def test_json_items_of_a_plex_api_response():
+    response = {"MediaContainer": {"size": 2, "Metadata": episodes(1, 2)}}
+
+    assert list(iter_json_items(io.StringIO(json.dumps(response)), chunk_size=5)) == episodes(1, 2)
+
+
+def test_json_export_without_an_array_of_items():
+    response = json.dumps({"MediaContainer": {"Video": episodes(1)}})
+
+    with pytest.raises(ValueError, match="Metadata"):
+        list(iter_json_items(io.StringIO(response)))
+
+
+def test_json_prefix_scan_is_bounded():
+    export = io.StringIO(json.dumps({"padding": "x" * 10000, "Metadata": episodes(1)}))
+
+    with pytest.raises(ValueError, match="first 100 characters"):
+        list(iter_json_items(export, chunk_size=10, max_prefix=100))
+    assert export.tell() < 200
+
+
+def test_plex_history_looks_missing_guids_up(plex):
+    items = list(iter_plex_history(plex.url, TOKEN, page_size=2))
+
+    assert [item["Guid"][0]["id"] for item in items] == [f"tvdb://{i}" for i in range(1, 6)]
+    assert plex.lookups == ["2", "3"]
+    assert plex.pages == [(0, 2), (2, 2), (4, 2)]
+
+
+def test_the_checkpoint_only_moves_past_items_done_in_order(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    run = Backfill(FakeClient(), checkpoint=Checkpoint(path, "history.json"), progress_interval=0)
+
+    # Items complete out of order
+    run._complete(1, True)  # pylint: disable=protected-access
+    run._complete(2, None)  # pylint: disable=protected-access
+    assert not os.path.exists(path)
+    run._complete(0, False)  # pylint: disable=protected-access
+
+    assert Checkpoint(path, "history.json").position == 3
+    # The checkpoint of another source is ignored
+    assert Checkpoint(path, "other.json").position == 0
+
+
+def test_a_run_resumes_from_the_checkpoint(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    Checkpoint(path, "history.json").save(2)
+    client = FakeClient(failing={4})
+
+    stats = Backfill(client, rate=0, checkpoint=Checkpoint(path, "history.json")).run(
+        iter(episodes(1, 2, 3, 4) + [{"type": "track"}])
+    )
+
+    assert client.watched == [3]
+    assert (stats["read"], stats["succeeded"], stats["failed"], stats["skipped"]) == (3, 1, 1, 1)
+    assert Checkpoint(path, "history.json").position == 5
+
+
+def test_a_run_stops_before_an_item_the_account_cannot_log_in_for(tmp_path, monkeypatch):
+    monkeypatch.setattr(backfill, "UNAVAILABLE_DELAY", 0)
+    path = str(tmp_path / "checkpoint.json")
+
+    stats = Backfill(
+        FakeClient(auth_error=True), concurrency=1, rate=0, checkpoint=Checkpoint(path, "h")
+    ).run(iter(episodes(1, 2, 3)))
+
+    assert stats["unsent"] == 1
+    assert Checkpoint(path, "h").position == 0
@@ -0,0 +1,96 @@
+"""
+Tests of the batches grouping the episode scrobbles queued for an account.
+"""
+
+import threading
+
+from scrobbler import AccountWorkers, BatchSettings, ScrobbleJob
+
+
+class FakeClient:
+    """
+    A TVTime client recording how episodes and movies are sent, refusing some episodes.
+    """
+
+    def __init__(self, refused: set = ()) -> None:
+        self.user = "alice"
+        self.refused = refused
+        self.batches: list[list[int]] = []
+        self.sent: list[tuple] = []
+        self._lock = threading.Lock()
+
+    def watch_episode(self, episode_id: int) -> bool:
+        with self._lock:
+            self.sent.append(("episode", episode_id))
+        return episode_id not in self.refused
+
+    def watch_episodes(self, episode_ids: list[int], max_workers: int = 4) -> dict[int, bool]:
+        with self._lock:
+            self.batches.append(list(episode_ids))
+        return {episode_id: episode_id not in self.refused for episode_id in episode_ids}
+
+    def get_movie_uuid(self, movie_id: int) -> str:
+        return f"uuid-{movie_id}"
+
+    def watch_movie(self, movie_uuid: str) -> bool:
+        with self._lock:
+            self.sent.append(("movie", movie_uuid))
+        return True
+
+
+def run(client: FakeClient, jobs: list[ScrobbleJob], **batch) -> AccountWorkers:
+    account = AccountWorkers(client, 1, 100, batch=BatchSettings(**batch))
+    for queued in jobs:
+        account.put(queued, "reject", None)
+    account.stop(timeout=5)
+    return account
+
+
+def episode(media_id: int) -> ScrobbleJob:
+    return ScrobbleJob("alice", "show", media_id, "Show")
+
+
+def test_episodes_are_sent_in_batches_of_at_most_size():
+    client = FakeClient()
+
+    account = run(client, [episode(i) for i in range(1, 6)], linger=1, size=3)
+
+    assert client.batches == [[1, 2, 3], [4, 5]]
+    assert account.stats()["processed"] == 5
+
+
+def test_each_episode_of_a_batch_has_its_own_result():
+    client = FakeClient(refused={2})
+
+    account = run(client, [episode(1), episode(2), episode(3)], linger=1)
+
+    stats = account.stats()
+    assert (stats["processed"], stats["failed"]) == (2, 1)
+
+
+def test_movies_are_sent_on_their_own():
+    client = FakeClient()
+    movie = ScrobbleJob("alice", "movie", 10, "Movie")
+
+    run(client, [episode(1), movie, episode(2)], linger=1)
+
+    assert client.batches == [[1, 2]]
+    assert client.sent == [("movie", "uuid-10")]
+
+
+def test_a_lone_episode_is_not_batched():
+    client = FakeClient()
+
+    run(client, [episode(1)], linger=0.01)
+
+    assert not client.batches
+    assert client.sent == [("episode", 1)]
+
+
+def test_a_linger_of_zero_disables_batches():
+    client = FakeClient()
+
+    run(client, [episode(1), episode(2)], linger=0)
+
+    assert not client.batches
+    assert client.sent == [("episode", 1), ("episode", 2)]
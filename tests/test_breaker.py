@@ -0,0 +1,93 @@
+"""
+Tests of the circuit breaker guarding the TVTime endpoints.
+"""
+
+import types
+
+import pytest
+from utils import breaker
+from utils.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = types.SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(breaker, "time", types.SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+
+def fail(circuit: CircuitBreaker, times: int) -> list[bool]:
+    opened = []
+    for _ in range(times):
+        circuit.before_call()
+        opened.append(circuit.record_failure())
+    return opened
+
+
+def test_the_circuit_opens_after_consecutive_failures(clock):
+    circuit = CircuitBreaker("alice/watched_episodes", failure_threshold=3, reset_timeout=30)
+
+    assert fail(circuit, 3) == [False, False, True]
+    assert circuit.state == OPEN
+    with pytest.raises(CircuitOpenError) as error:
+        circuit.before_call()
+    assert error.value.retry_after == 30
+    assert circuit.stats()["refused"] == 1
+
+
+def test_a_success_resets_the_failures(clock):
+    circuit = CircuitBreaker("circuit", failure_threshold=2)
+    fail(circuit, 1)
+    circuit.before_call()
+    circuit.record_success()
+
+    assert fail(circuit, 1) == [False]
+    assert circuit.state == CLOSED
+
+
+def test_a_single_probe_is_let_through_once_the_timeout_elapsed(clock):
+    circuit = CircuitBreaker("circuit", failure_threshold=1, reset_timeout=10)
+    fail(circuit, 1)
+    clock.value += 10
+
+    circuit.before_call()
+    assert circuit.state == HALF_OPEN
+    # Only one probe at a time
+    with pytest.raises(CircuitOpenError):
+        circuit.before_call()
+    circuit.record_success()
+
+    assert circuit.state == CLOSED
+    circuit.before_call()
+
+
+def test_a_failed_probe_opens_the_circuit_again(clock):
+    circuit = CircuitBreaker("circuit", failure_threshold=3, reset_timeout=10)
+    fail(circuit, 3)
+    clock.value += 10
+
+    assert fail(circuit, 1) == [True]
+    assert circuit.retry_after() == 10
+    assert circuit.stats()["opened"] == 2
+
+
+def test_a_lost_probe_lets_another_one_through(clock):
+    circuit = CircuitBreaker("circuit", failure_threshold=1, reset_timeout=10)
+    fail(circuit, 1)
+    clock.value += 10
+    circuit.before_call()  # Never recorded
+
+    clock.value += 10
+    circuit.before_call()
+
+
+def test_check_does_not_start_a_probe(clock):
+    circuit = CircuitBreaker("circuit", failure_threshold=1, reset_timeout=10)
+    fail(circuit, 1)
+    with pytest.raises(CircuitOpenError):
+        circuit.check()
+    clock.value += 10
+
+    circuit.check()
+    assert circuit.state == OPEN
+    assert circuit.stats()["refused"] == 0
@@ -0,0 +1,149 @@
+"""
+Tests of the cache of movie UUIDs, of its expiry and of its negative entries.
+"""
+
+import asyncio
+import os
+import sys
+import time
+import types
+
+import pytest
+import utils.cache as cache_module
+from tvtime import ENDPOINTS, AsyncTVTime
+from utils.cache import MISSING, TTLCache
+from utils.state import SQLiteState
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+from fake_tvtime import FakeTVTime, make_jwt  # noqa: E402 pylint: disable=wrong-import-position
+
+
+class Clock:
+    """
+    A wall clock only moving forward when told to.
+    """
+
+    def __init__(self) -> None:
+        self.now = time.time()
+
+    def time(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(cache_module, "time", types.SimpleNamespace(time=fake.time))
+    return fake
+
+
+def test_a_value_expires_after_its_ttl(clock):
+    cache = TTLCache(ttl=100, negative_ttl=10)
+    cache.set("1", "uuid-1")
+
+    clock.advance(99)
+    assert cache.get("1") == "uuid-1"
+    clock.advance(2)
+    assert cache.get("1") is MISSING
+    assert cache.stats() == {"size": 0, "hits": 1, "negative_hits": 0, "misses": 1}
+
+
+def test_a_negative_entry_expires_after_the_negative_ttl(clock):
+    cache = TTLCache(ttl=100, negative_ttl=10)
+    cache.set("1", None)
+
+    # A negative entry is a hit, telling the key has no match
+    assert cache.get("1") is None
+    clock.advance(11)
+    assert cache.get("1") is MISSING
+    assert cache.stats()["negative_hits"] == 1
+
+
+def test_the_least_recently_used_entry_is_evicted():
+    cache = TTLCache(max_size=2)
+    cache.set("1", "uuid-1")
+    cache.set("2", "uuid-2")
+    cache.get("1")
+
+    cache.set("3", "uuid-3")
+
+    assert cache.get("2") is MISSING
+    assert (cache.get("1"), cache.get("3")) == ("uuid-1", "uuid-3")
+
+
+def test_unexpired_entries_are_persisted(tmp_path, clock):
+    path = str(tmp_path / "cache" / "movies.json")
+    cache = TTLCache(ttl=100, negative_ttl=10, path=path)
+    cache.set("1", "uuid-1")
+    cache.set("2", None)
+    cache.save()
+
+    clock.advance(50)
+    reloaded = TTLCache(ttl=100, negative_ttl=10, path=path)
+
+    assert reloaded.get("1") == "uuid-1"
+    assert reloaded.get("2") is MISSING
+
+
+def test_the_cache_is_saved_every_flush_every_writes(tmp_path):
+    path = str(tmp_path / "movies.json")
+    cache = TTLCache(path=path, flush_every=2)
+
+    cache.set("1", "uuid-1")
+    assert not os.path.exists(path)
+    cache.set("2", "uuid-2")
+    assert TTLCache(path=path).get("2") == "uuid-2"
+
+
+def test_an_unreadable_file_is_ignored(tmp_path):
+    path = tmp_path / "movies.json"
+    path.write_text("[not json", encoding="utf-8")
+
+    assert TTLCache(path=str(path)).get("1") is MISSING
+
+
+def test_replicas_share_their_lookups(tmp_path):
+    state = SQLiteState(str(tmp_path / "state.db"))
+    first = TTLCache(state=state)
+    second = TTLCache(state=state)
+
+    first.set("1", "uuid-1")
+    first.set("2", None)
+
+    assert second.get("1") == "uuid-1"
+    assert second.get("2") is None
+    assert second.stats()["size"] == 2
+    state.close()
+
+
+def test_a_cached_movie_is_not_searched_again():
+    server = FakeTVTime(latency=0).start()
+    cache = TTLCache()
+
+    async def scenario() -> list:
+        client = AsyncTVTime(
+            "alice",
+            "alice@example.com",
+            "secret",
+            movie_cache=cache,
+            api_url=server.url,
+            auth_url=f"{server.url}/sidecar?o=https://auth.tvtime.com/v1",
+            rate_limits={endpoint: {"rate": 0} for endpoint in ENDPOINTS},
+        )
+        client._set_tokens(make_jwt(), "refresh", persist=False)  # pylint: disable=W0212
+        try:
+            return [await client.get_movie_uuid(42) for _ in range(3)]
+        finally:
+            await client.close()
+
+    try:
+        uuids = asyncio.run(scenario())
+    finally:
+        server.stop()
+
+    assert len(set(uuids)) == 1 and uuids[0]
+    assert server.stats()["search"] == 1
+    assert cache.stats()["hits"] == 2
@@ -0,0 +1,185 @@
+"""
+Tests of the split of the accounts between the replicas and of the forwarded scrobbles.
+"""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+from cluster import Cluster, queue_name
+from registry import TVTimeRegistry
+from scrobbler import BatchSettings, ScrobbleDispatcher, ScrobbleJob
+from utils.journal import ScrobbleJournal
+from utils.metrics import SCROBBLES
+from utils.state import RedisState, SQLiteState
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+from fake_redis import FakeRedis  # noqa: E402 pylint: disable=wrong-import-position
+
+USERS = ["alice", "bob", "carol", "dave"]
+
+
+class BlockingClient:
+    """
+    A TVTime client holding the first episode until released, so the account queue fills up.
+    """
+
+    def __init__(self, user: str) -> None:
+        self.user = user
+        self.started = threading.Event()
+        self.released = threading.Event()
+        self.watched: list[int] = []
+
+    def watch_episode(self, episode_id: int) -> bool:
+        self.started.set()
+        self.released.wait(5)
+        self.watched.append(episode_id)
+        return True
+
+
+def wait_for(condition, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def state(tmp_path):
+    shared = SQLiteState(str(tmp_path / "state.db"))
+    yield shared
+    shared.close()
+
+
+@pytest.fixture
+def client():
+    blocking = BlockingClient("alice")
+    yield blocking
+    blocking.released.set()
+
+
+def replica(state, name: str, deliver=lambda plex_user, fields: None, **options) -> Cluster:
+    return Cluster(state, lambda: USERS, deliver, poll_interval=0.01, replica_id=name, **options)
+
+
+def dispatcher_of(client, **options) -> ScrobbleDispatcher:
+    registry = TVTimeRegistry()
+    registry.register(client)
+    return ScrobbleDispatcher(
+        registry, workers=1, depth=1, block_timeout=0.05, batch=BatchSettings(linger=0), **options
+    )
+
+
+def test_the_accounts_are_split_between_the_replicas(state):
+    first, second = replica(state, "first"), replica(state, "second")
+    first.rebalance()
+    assert first.owned == frozenset(USERS)
+
+    # The second replica waits for the first one to give its share up
+    second.rebalance()
+    assert not second.owned
+    first.rebalance()
+    second.rebalance()
+
+    assert len(first.owned) == len(second.owned) == 2
+    assert first.owned | second.owned == frozenset(USERS)
+    # The leases are kept on renewal
+    owned = first.owned
+    first.rebalance()
+    assert first.owned == owned
+
+
+def test_the_accounts_of_a_stopped_replica_are_taken_over(state):
+    first, second = replica(state, "first", lease_ttl=0.1), replica(state, "second")
+    first.rebalance()
+    second.rebalance()
+    first.rebalance()
+    first.stop()
+
+    # Until the replica is no longer seen alive, only the released share is taken
+    second.rebalance()
+    assert len(second.owned) == 2
+    time.sleep(0.2)
+    second.rebalance()
+
+    assert second.owned == frozenset(USERS)
+
+
+def test_a_forwarded_scrobble_is_delivered_by_the_owner(state):
+    delivered = []
+    owner = replica(state, "owner", lambda plex_user, fields: delivered.append((plex_user, fields)))
+    owner.start()
+    other = replica(state, "other")
+
+    assert other.forward("alice", {"media_id": 1})
+    assert other.forward("alice", {"media_id": 2})
+    wait_for(lambda: len(delivered) == 2)
+    owner.stop()
+
+    assert delivered == [("alice", {"media_id": 1}), ("alice", {"media_id": 2})]
+    assert other.stats()["forwarded"] == 2
+    assert owner.stats()["received"] == 2
+
+
+def test_redis_pops_the_head_of_a_queue():
+    server = FakeRedis().start()
+    redis = RedisState(server.url)
+    redis.push("queue", [str(i) for i in range(5)])
+
+    assert redis.pop("queue", 2) == ["0", "1"]
+    assert redis.length("queue") == 3
+    assert redis.pop("queue", 10) == ["2", "3", "4"]
+    assert redis.pop("queue") == []
+    redis.close()
+    server.stop()
+
+
+def test_a_forwarded_scrobble_without_room_is_forwarded_again(state, client, tmp_path):
+    journal = ScrobbleJournal(str(tmp_path / "journal.db"))
+    cluster = replica(state, "owner")
+    cluster.owned = frozenset(["alice"])
+    dispatcher = dispatcher_of(client, journal=journal, cluster=cluster)
+    fields = {"media_type": "show", "media_name": "Show"}
+    dispatcher.deliver("alice", {"media_id": 1, **fields})
+    client.started.wait(5)
+    dispatcher.deliver("alice", {"media_id": 2, **fields})
+
+    dispatcher.deliver("alice", {"media_id": 3, **fields})
+
+    wait_for(lambda: [entry[3] for entry in journal.pending()] == [1, 2])
+    assert state.length(queue_name("alice")) == 1
+    client.released.set()
+    dispatcher.shutdown(timeout=5)
+    assert client.watched == [1, 2]
+
+
+def test_a_forwarded_scrobble_of_an_unknown_user_is_counted(state, client):
+    cluster = replica(state, "owner")
+    dispatcher = dispatcher_of(client, cluster=cluster)
+
+    dispatcher.deliver("mallory", {"media_type": "show", "media_id": 1, "media_name": "Show"})
+
+    assert 'user="mallory",outcome="undeliverable"' in "".join(SCROBBLES.samples())
+    assert state.length(queue_name("mallory")) == 0
+    dispatcher.shutdown(timeout=5)
+
+
+def test_replay_keeps_the_entries_of_a_full_queue(client, tmp_path):
+    path = str(tmp_path / "journal.db")
+    journal = ScrobbleJournal(path)
+    entries = [journal.append("alice", "show", media_id, "Show") for media_id in (2, 3, 4)]
+    dispatcher = dispatcher_of(client, journal=journal)
+    dispatcher.submit(ScrobbleJob("alice", "show", 1, "Show"))
+    client.started.wait(5)
+
+    # The queue only has room for the first entry
+    assert dispatcher.replay() == 1
+
+    client.released.set()
+    dispatcher.shutdown(timeout=5)
+    assert client.watched == [1, 2]
+    journal = ScrobbleJournal(path)
+    assert [entry[0] for entry in journal.pending()] == entries[1:]
+    journal.close()
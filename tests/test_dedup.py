@@ -0,0 +1,91 @@
+"""
+Tests of the window suppressing repeated scrobbles.
+"""
+
+import types
+
+import pytest
+from utils import dedup
+from utils.dedup import DedupWindow
+from utils.state import SQLiteState, StateError
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = types.SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(dedup, "time", types.SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+
+@pytest.fixture
+def state(tmp_path):
+    shared = SQLiteState(str(tmp_path / "state.db"))
+    yield shared
+    shared.close()
+
+
+class BrokenState(SQLiteState):
+    def add(self, key: str, value: str, ttl: float = None) -> bool:
+        raise StateError("unreachable")
+
+
+def test_a_repeated_key_is_a_duplicate_within_the_window(clock):
+    window = DedupWindow(window=10)
+
+    assert not window.is_duplicate(("alice", 1))
+    clock.value += 9.9
+    assert window.is_duplicate(("alice", 1))
+    assert not window.is_duplicate(("bob", 1))
+    assert window.stats() == {"keys": 2, "passed": 2, "suppressed": 1}
+
+
+def test_a_key_passes_again_once_the_window_elapsed(clock):
+    window = DedupWindow(window=10)
+    window.is_duplicate("key")
+    # A repeat does not extend the window
+    clock.value += 5
+    window.is_duplicate("key")
+    clock.value += 5
+
+    assert not window.is_duplicate("key")
+
+
+def test_the_oldest_keys_are_evicted_beyond_max_keys(clock):
+    window = DedupWindow(window=10, max_keys=2)
+    for key in ("a", "b", "c"):
+        window.is_duplicate(key)
+        clock.value += 1
+
+    assert window.stats()["keys"] == 2
+    assert window.is_duplicate("c")
+    assert not window.is_duplicate("a")
+
+
+def test_a_forgotten_key_passes_again(clock):
+    window = DedupWindow()
+    window.is_duplicate("key")
+    window.forget("key")
+    window.forget("unknown")
+
+    assert not window.is_duplicate("key")
+
+
+def test_a_key_passes_once_across_replicas(state):
+    first, second = DedupWindow(state=state), DedupWindow(state=state)
+
+    assert not first.is_duplicate(("alice", "show", 1))
+    assert second.is_duplicate(("alice", "show", 1))
+    assert not second.is_duplicate(("alice", "show", 2))
+
+    first.forget(("alice", "show", 1))
+    assert not first.is_duplicate(("alice", "show", 1))
+    assert second.is_duplicate(("alice", "show", 1))
+
+
+def test_a_key_passes_when_the_shared_state_fails(tmp_path):
+    broken = BrokenState(str(tmp_path / "state.db"))
+    window = DedupWindow(state=broken)
+
+    assert not window.is_duplicate("key")
+    assert window.is_duplicate("key")
+    broken.close()
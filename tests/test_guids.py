@@ -0,0 +1,135 @@
+"""
+Tests of the normalization of Plex GUIDs and their resolution to TVDB IDs.
+"""
+
+import pytest
+from guids import GuidResolver, normalize_guid, parse_guids, read_dump
+from utils.xref import CrossReference
+
+
+@pytest.fixture
+def xref(tmp_path):
+    table = CrossReference(str(tmp_path / "guids.db"))
+    yield table
+    table.close()
+
+
+@pytest.mark.parametrize(
+    ("guid", "expected"),
+    [
+        ("tmdb://603", "tmdb://603"),
+        ("  imdb://tt0133093 ", "imdb://tt0133093"),
+        ("plex://movie/5d7768ba96b655001fdc0408?lang=en", "plex://movie/5d7768ba96b655001fdc0408"),
+        ("com.plexapp.agents.imdb://tt0133093?lang=en", "imdb://tt0133093"),
+        ("com.plexapp.agents.themoviedb://603?lang=en", "tmdb://603"),
+        ("com.plexapp.agents.thetvdb://12345/1/2?lang=en", "tvdb://12345/1/2"),
+        ("com.plexapp.agents.hama://anidb-1", "hama://anidb-1"),
+        ("local://42", "local://42"),
+        ("", None),
+        (None, None),
+        ("not a guid", None),
+    ],
+)
+def test_normalize_guid(guid, expected):
+    assert normalize_guid(guid) == expected
+
+
+def test_parse_guids_reads_the_tvdb_id_and_orders_the_others():
+    item = {
+        "guid": "plex://episode/abc",
+        "Guid": [{"id": "imdb://tt1"}, {"id": "tvdb://42"}, {"id": "tmdb://7"}, "ignored"],
+    }
+
+    assert parse_guids(item) == (42, ["tmdb://7", "imdb://tt1", "plex://episode/abc"])
+
+
+def test_parse_guids_keeps_the_first_tvdb_id_and_drops_duplicates():
+    item = {
+        "Guid": [{"id": "tvdb://1"}, {"id": "tvdb://2"}, {"id": "tmdb://7"}],
+        "guid": "tmdb://7",
+    }
+
+    assert parse_guids(item) == (1, ["tmdb://7"])
+
+
+def test_parse_guids_of_a_legacy_agent():
+    assert parse_guids({"guid": "com.plexapp.agents.thetvdb://12345?lang=en"}) == (12345, [])
+    # The leading ID of an episode GUID is the series', not the episode's
+    assert parse_guids({"guid": "com.plexapp.agents.thetvdb://12345/1/2?lang=en"}) == (
+        None,
+        ["tvdb://12345/1/2"],
+    )
+
+
+def test_parse_guids_ignores_an_invalid_tvdb_id():
+    assert parse_guids({"Guid": [{"id": "tvdb://abc"}, {"id": "imdb://tt1"}]}) == (
+        None,
+        ["imdb://tt1"],
+    )
+
+
+def test_parse_guids_of_an_item_without_guids():
+    assert parse_guids({}) == (None, [])
+    assert parse_guids({"Guid": None, "guid": None}) == (None, [])
+
+
+def test_resolver_without_a_table_only_uses_the_tvdb_guid():
+    resolver = GuidResolver()
+
+    assert resolver.resolve("movie", {"Guid": [{"id": "tvdb://5"}]}) == 5
+    assert resolver.resolve("movie", {"Guid": [{"id": "tmdb://603"}]}) is None
+    assert resolver.stats() == {}
+
+
+def test_resolver_learns_the_guids_of_items_with_a_tvdb_id(xref):
+    resolver = GuidResolver(xref)
+
+    assert resolver.resolve("movie", {"Guid": [{"id": "tvdb://5"}, {"id": "tmdb://603"}]}) == 5
+    assert resolver.resolve("movie", {"Guid": [{"id": "tmdb://603"}]}) == 5
+    # The table is per media type
+    assert resolver.resolve("show", {"Guid": [{"id": "tmdb://603"}]}) is None
+    assert resolver.stats() == {"hits": 1, "misses": 1, "learnt": 1}
+
+
+def test_resolver_without_learning_only_reads_the_table(xref):
+    resolver = GuidResolver(xref, learn=False)
+
+    assert resolver.resolve("movie", {"Guid": [{"id": "tvdb://5"}, {"id": "tmdb://603"}]}) == 5
+    assert resolver.resolve("movie", {"Guid": [{"id": "tmdb://603"}]}) is None
+
+
+def test_resolver_prefers_the_most_reliable_guid(xref):
+    xref.load([("movie", "imdb://tt1", 1), ("movie", "tmdb://2", 2)])
+    resolver = GuidResolver(xref)
+
+    assert resolver.resolve("movie", {"Guid": [{"id": "imdb://tt1"}, {"id": "tmdb://2"}]}) == 2
+
+
+def test_resolver_relearns_a_changed_tvdb_id(xref):
+    resolver = GuidResolver(xref)
+    resolver.resolve("show", {"Guid": [{"id": "tvdb://1"}, {"id": "imdb://tt9"}]})
+    resolver.resolve("show", {"Guid": [{"id": "tvdb://2"}, {"id": "imdb://tt9"}]})
+
+    assert resolver.resolve("show", {"Guid": [{"id": "imdb://tt9"}]}) == 2
+
+
+def test_resolver_looks_a_legacy_episode_up_in_the_table(xref):
+    xref.load([("show", "tvdb://12345/1/2", 777)])
+    resolver = GuidResolver(xref)
+
+    assert resolver.resolve("show", {"guid": "com.plexapp.agents.thetvdb://12345/1/2"}) == 777
+
+
+def test_read_dump():
+    rows = [
+        {"media_type": "Movie", "tvdb": "5", "tmdb": "603", "imdb": "tt0133093", "plex": ""},
+        {"media_type": "episode", "tvdb": "tvdb://9", "plex": "5d9c0874"},
+        {"media_type": "movie", "tvdb": "not an id", "tmdb": "1"},
+        {"media_type": "music", "tvdb": "3", "tmdb": "1"},
+    ]
+
+    assert list(read_dump(rows)) == [
+        ("movie", "tmdb://603", 5),
+        ("movie", "imdb://tt0133093", 5),
+        ("show", "plex://episode/5d9c0874", 9),
+    ]
@@ -0,0 +1,135 @@
+"""
+Tests of the scrobble journal, its group commit and the replay of its entries.
+"""
+
+import threading
+import time
+
+import pytest
+from registry import TVTimeRegistry
+from scrobbler import BatchSettings, ScrobbleDispatcher
+from utils.journal import ScrobbleJournal
+
+
+class FakeClient:
+    """
+    A TVTime client recording the episodes marked as watched.
+    """
+
+    def __init__(self, user: str) -> None:
+        self.user = user
+        self.watched: list[int] = []
+
+    def watch_episode(self, episode_id: int) -> bool:
+        self.watched.append(episode_id)
+        return True
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "journal.db")
+
+
+def wait_for(condition, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_entries_are_kept_until_done(path):
+    journal = ScrobbleJournal(path)
+    first = journal.append("alice", "show", 1, "Show")
+    second = journal.append("bob", "movie", 2, "Movie")
+    journal.mark_done(first)
+    journal.close()
+
+    journal = ScrobbleJournal(path)
+    assert journal.pending() == [(second, "bob", "movie", 2, "Movie")]
+    journal.close()
+
+
+def test_entries_are_given_up_after_too_many_attempts(path):
+    journal = ScrobbleJournal(path, max_attempts=2)
+    entry_id = journal.append("alice", "show", 1, "Show")
+    journal.mark_failed(entry_id)
+    journal.append("alice", "show", 2, "Show")  # Waits for the failure to be committed
+    assert [entry[0] for entry in journal.pending()] == [entry_id, entry_id + 1]
+
+    journal.mark_failed(entry_id)
+    journal.close()
+
+    journal = ScrobbleJournal(path)
+    assert [entry[0] for entry in journal.pending()] == [entry_id + 1]
+    journal.close()
+
+
+def test_concurrent_appends_are_group_committed(path):
+    journal = ScrobbleJournal(path)
+    commits = []
+    journal._conn.set_trace_callback(  # pylint: disable=protected-access
+        lambda statement: commits.append(statement) if statement == "COMMIT" else None
+    )
+    ids = []
+
+    def append(media_id: int) -> None:
+        ids.append(journal.append("alice", "show", media_id, "Show"))
+
+    # Hold the writer on the database while the appends pile up behind the first one
+    with journal._db_lock:  # pylint: disable=protected-access
+        threads = [threading.Thread(target=append, args=(1,))]
+        threads[0].start()
+        wait_for(lambda: not journal._appends)  # pylint: disable=protected-access
+        threads += [threading.Thread(target=append, args=(i,)) for i in range(2, 51)]
+        for thread in threads[1:]:
+            thread.start()
+        wait_for(lambda: len(journal._appends) == 49)  # pylint: disable=protected-access
+    for thread in threads:
+        thread.join()
+
+    assert len(commits) == 2
+    assert sorted(ids) == list(range(1, 51))
+    assert sorted(entry[3] for entry in journal.pending()) == list(range(1, 51))
+    journal.close()
+
+
+def test_append_fails_once_closed(path):
+    journal = ScrobbleJournal(path)
+    journal.close()
+
+    with pytest.raises(RuntimeError):
+        journal.append("alice", "show", 1, "Show")
+
+
+def test_only_one_journal_replays(path):
+    first, second = ScrobbleJournal(path), ScrobbleJournal(path)
+
+    assert first.acquire_replay_lock()
+    assert first.acquire_replay_lock()
+    assert not second.acquire_replay_lock()
+    first.close()
+    assert second.acquire_replay_lock()
+    second.close()
+
+
+def test_replay_sends_the_entries_of_registered_users(path):
+    journal = ScrobbleJournal(path)
+    for media_id in (1, 2, 3):
+        journal.append("alice", "show", media_id, "Show")
+    orphan = journal.append("bob", "show", 4, "Show")
+    journal.close()
+
+    registry = TVTimeRegistry()
+    client = FakeClient("alice")
+    registry.register(client)
+    journal = ScrobbleJournal(path)
+    dispatcher = ScrobbleDispatcher(
+        registry, workers=1, journal=journal, batch=BatchSettings(linger=0)
+    )
+    assert dispatcher.replay() == 3
+    dispatcher.shutdown(timeout=5)
+
+    assert client.watched == [1, 2, 3]
+    journal = ScrobbleJournal(path)
+    assert [entry[0] for entry in journal.pending()] == [orphan]
+    journal.close()
@@ -0,0 +1,163 @@
+"""
+Tests of the buffer keeping the scrobbles of an account while TVTime is unavailable.
+"""
+
+import time
+
+import pytest
+from scrobbler import AccountWorkers, BatchSettings, OfflineSettings, ScrobbleJob
+from tvtime import TVTimeAuthError, TVTimeUnavailableError
+from utils.breaker import CircuitBreaker
+from utils.journal import ScrobbleJournal
+
+
+class FakeClient:
+    """
+    A TVTime client which is either available, unavailable or refusing its credentials.
+    """
+
+    def __init__(self, user: str = "alice") -> None:
+        self.user = user
+        self.down = False
+        self.refused = False
+        self.calls = 0
+        self.watched: list[int] = []
+        self.breakers = {
+            endpoint: CircuitBreaker(endpoint) for endpoint in ("auth", "watched_episodes")
+        }
+
+    def token_expires_soon(self) -> bool:
+        return self.refused
+
+    def watch_episode(self, episode_id: int) -> bool:
+        self.calls += 1
+        if self.refused:
+            raise TVTimeAuthError("wrong password")
+        if self.down:
+            raise TVTimeUnavailableError("TVTime answered 503")
+        self.watched.append(episode_id)
+        return True
+
+    def watch_episodes(self, episode_ids: list[int], max_workers: int = 4) -> dict[int, bool]:
+        results = {}
+        for episode_id in episode_ids:
+            try:
+                results[episode_id] = self.watch_episode(episode_id)
+            except (TVTimeAuthError, TVTimeUnavailableError):
+                results[episode_id] = None
+        return results
+
+
+def job(media_id: int, journal_id: int = None) -> ScrobbleJob:
+    return ScrobbleJob("alice", "show", media_id, "Show", journal_id=journal_id)
+
+
+def wait_for(condition, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def client():
+    return FakeClient()
+
+
+def account_of(client, workers: int = 1, **settings) -> AccountWorkers:
+    return AccountWorkers(
+        client, workers, 100, batch=BatchSettings(linger=0), offline=OfflineSettings(**settings)
+    )
+
+
+def test_scrobbles_are_buffered_then_flushed_in_order(client):
+    client.down = True
+    account = account_of(client, retry_interval=0.05)
+    for media_id in (1, 2, 3):
+        assert account.put(job(media_id), "reject", None)
+    wait_for(lambda: account.stats()["buffered"] == 3)
+    assert account.stats()["offline"]
+
+    client.down = False
+    wait_for(lambda: account.stats()["processed"] == 3)
+
+    assert client.watched == [1, 2, 3]
+    assert not account.stats()["offline"]
+    assert account.stats()["flushed"] == 3
+    account.stop(timeout=5)
+
+
+def test_the_retry_interval_doubles_up_to_the_maximum(client):
+    account = account_of(client, workers=0, retry_interval=1, max_retry_interval=5)
+
+    intervals = []
+    for media_id in range(5):
+        account._go_offline([job(media_id)], 0)  # pylint: disable=protected-access
+        intervals.append(account._retry_after)  # pylint: disable=protected-access
+    # The circuit of the endpoint may ask for a longer wait
+    account._go_offline([job(5)], 30)  # pylint: disable=protected-access
+
+    assert intervals == [1, 2, 4, 5, 5]
+    assert account._retry_after == 30  # pylint: disable=protected-access
+    account.stop(timeout=5)
+
+
+def test_a_media_is_buffered_once_and_the_buffer_is_bounded(client):
+    account = account_of(client, workers=0, retry_interval=60, max_buffer=2)
+    account._go_offline([job(1)], 0)  # pylint: disable=protected-access
+
+    assert account.put(job(1), "reject", None)
+    assert account.put(job(2), "reject", None)
+    assert not account.put(job(3), "reject", None)
+
+    stats = account.stats()
+    assert (stats["buffered"], stats["deduplicated"], stats["rejected"]) == (2, 1, 1)
+    assert [buffered.media_id for buffered in account.buffer] == [1, 2]
+    account.stop(timeout=5)
+
+
+def test_an_account_refused_its_credentials_is_locked_out(client, tmp_path):
+    journal = ScrobbleJournal(str(tmp_path / "journal.db"), max_attempts=1)
+    client.refused = True
+    account = AccountWorkers(
+        client,
+        1,
+        100,
+        journal=journal,
+        batch=BatchSettings(linger=0),
+        offline=OfflineSettings(retry_interval=0.01, max_auth_failures=3),
+    )
+    for media_id in (1, 2):
+        account.put(job(media_id, journal.append("alice", "show", media_id, "Show")), "reject", 0)
+    wait_for(lambda: account.stats()["failed"] == 2)
+    calls = client.calls
+
+    # The next scrobbles fail without trying to log in again
+    account.put(job(3), "reject", None)
+    wait_for(lambda: account.stats()["failed"] == 3)
+    assert client.calls == calls
+    assert not account.stats()["offline"]
+
+    # Until the client is replaced with new credentials
+    account.client = FakeClient()
+    account.put(job(4), "reject", None)
+    wait_for(lambda: account.stats()["processed"] == 1)
+    assert account.client.watched == [4]
+    account.stop(timeout=5)
+    journal.close()
+
+    journal = ScrobbleJournal(str(tmp_path / "journal.db"))
+    assert not journal.pending()
+    journal.close()
+
+
+def test_an_unreachable_authentication_endpoint_is_not_a_lockout(client):
+    client.refused = True
+    client.breakers["auth"].record_failure()
+    account = account_of(client, workers=0, retry_interval=60, max_auth_failures=2)
+
+    for media_id in range(5):
+        assert not account._go_offline([job(media_id)], 0)  # pylint: disable=protected-access
+
+    assert account.stats()["buffered"] == 5
+    account.stop(timeout=5)
@@ -0,0 +1,107 @@
+"""
+Tests of the streaming read of the webhook payload and of its early rejection.
+"""
+
+import io
+import json
+import types
+
+import pytest
+from registry import TVTimeRegistry
+from utils.multipart import FieldTooLarge, read_field
+
+from app import Webhook, WebhookHandler
+
+BOUNDARY = b"----plex"
+
+
+def multipart(*parts: tuple[str, bytes, str]) -> io.BytesIO:
+    """
+    Builds a multipart body from (name, value, file name) parts, as Plex sends them.
+    """
+    body = b""
+    for name, value, filename in parts:
+        disposition = f'form-data; name="{name}"'
+        if filename:
+            disposition += f'; filename="{filename}"\r\nContent-Type: image/jpeg'
+        body += b"--" + BOUNDARY + f"\r\nContent-Disposition: {disposition}\r\n\r\n".encode()
+        body += value + b"\r\n"
+    return io.BytesIO(body + b"--" + BOUNDARY + b"--\r\n")
+
+
+def payload(event: str, user: str) -> bytes:
+    return json.dumps({"event": event, "Account": {"title": user}}).encode()
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    users = TVTimeRegistry()
+    monkeypatch.setattr(Webhook, "registry", users)
+    monkeypatch.setattr(Webhook, "prewarmer", None)
+    return users
+
+
+def register(registry: TVTimeRegistry, user: str) -> None:
+    registry.register(types.SimpleNamespace(user=user))
+
+
+def test_the_field_is_read_past_a_file_part():
+    value = payload("media.scrobble", "Alice")
+    body = multipart(("thumb", b"\xff" * 200000, "thumb.jpg"), ("payload", value, None))
+
+    assert read_field(body, BOUNDARY, "payload", chunk_size=4096) == value
+    assert body.read() == b""
+
+
+@pytest.mark.parametrize("first", [True, False])
+def test_a_field_split_across_chunks_is_read_whole(first):
+    value = payload("media.scrobble", "Alice")
+    parts = [("payload", value, None), ("thumb", b"\xff" * 100, "thumb.jpg")]
+    body = multipart(*(parts if first else reversed(parts))).getvalue()
+
+    # Wherever the chunks end, even next to a boundary
+    for chunk_size in range(1, len(body) + 1):
+        assert read_field(io.BytesIO(body), BOUNDARY, "payload", chunk_size=chunk_size) == value
+
+
+def test_the_body_is_drained_once_the_field_is_read():
+    body = multipart(("payload", b"{}", None), ("thumb", b"\xff" * 200000, "thumb.jpg"))
+
+    assert read_field(body, BOUNDARY, "payload", chunk_size=4096) == b"{}"
+    assert body.read() == b""
+
+
+def test_a_missing_field_is_none():
+    assert read_field(multipart(("other", b"{}", None)), BOUNDARY, "payload") is None
+
+
+def test_a_field_larger_than_max_size_is_refused():
+    body = multipart(("payload", b"x" * 2000, None))
+
+    with pytest.raises(FieldTooLarge):
+        read_field(body, BOUNDARY, "payload", max_size=1000, chunk_size=100)
+
+
+def test_only_scrobbles_of_configured_users_are_candidates(registry):
+    register(registry, "alice")
+
+    assert WebhookHandler.is_candidate(payload("media.scrobble", "Alice"))
+    assert not WebhookHandler.is_candidate(payload("media.scrobble", "Bob"))
+    assert not WebhookHandler.is_candidate(payload("media.pause", "Alice"))
+    assert not WebhookHandler.is_candidate(payload("media.play", "Alice"))
+
+
+def test_playback_events_are_candidates_when_pre_warming(registry, monkeypatch):
+    register(registry, "alice")
+    monkeypatch.setattr(Webhook, "prewarmer", object())
+
+    assert WebhookHandler.is_candidate(payload("media.play", "Alice"))
+    assert WebhookHandler.is_candidate(payload("media.stop", "Alice"))
+    assert not WebhookHandler.is_candidate(payload("media.pause", "Alice"))
+
+
+def test_a_name_a_json_encoder_may_escape_is_not_looked_for(registry):
+    register(registry, "zoë")
+
+    # Encoded as "zoë", the name could not be found as is
+    assert WebhookHandler.is_candidate(payload("media.scrobble", "Someone else"))
@@ -0,0 +1,111 @@
+"""
+Tests of the bounded scrobble queue of an account and of its back-pressure policies.
+"""
+
+import threading
+import time
+
+import pytest
+from registry import TVTimeRegistry
+from scrobbler import AccountWorkers, BatchSettings, ScrobbleDispatcher, ScrobbleJob
+
+
+class BlockingClient:
+    """
+    A TVTime client holding every episode until released, so the account queue fills up.
+    """
+
+    def __init__(self, user: str = "alice") -> None:
+        self.user = user
+        self.started = threading.Event()
+        self.released = threading.Event()
+        self.watched: list[int] = []
+
+    def watch_episode(self, episode_id: int) -> bool:
+        self.started.set()
+        self.released.wait(5)
+        self.watched.append(episode_id)
+        return True
+
+
+def job(media_id: int) -> ScrobbleJob:
+    return ScrobbleJob("alice", "show", media_id, "Show")
+
+
+@pytest.fixture
+def client():
+    blocking = BlockingClient()
+    yield blocking
+    blocking.released.set()
+
+
+@pytest.fixture
+def account(client):
+    """
+    An account whose single worker holds episode 1, with room for 2 more jobs.
+    """
+    workers = AccountWorkers(client, 1, 2, batch=BatchSettings(linger=0))
+    workers.put(job(1), "reject", None)
+    client.started.wait(5)
+    workers.put(job(2), "reject", None)
+    workers.put(job(3), "reject", None)
+    yield workers
+    client.released.set()
+    workers.stop(timeout=5)
+
+
+def test_reject_refuses_a_job_when_full(account, client):
+    assert not account.put(job(4), "reject", None)
+
+    client.released.set()
+    account.stop(timeout=5)
+    assert client.watched == [1, 2, 3]
+    stats = account.stats()
+    assert (stats["enqueued"], stats["processed"], stats["rejected"]) == (3, 3, 1)
+
+
+def test_drop_oldest_makes_room_for_the_newest_job(account, client):
+    assert account.put(job(4), "drop_oldest", None)
+
+    client.released.set()
+    account.stop(timeout=5)
+    assert client.watched == [1, 3, 4]
+    assert account.stats()["dropped"] == 1
+
+
+def test_block_gives_up_after_the_timeout(account):
+    started = time.monotonic()
+
+    assert not account.put(job(4), "block", 0.1)
+    assert time.monotonic() - started >= 0.1
+    assert account.stats()["rejected"] == 1
+
+
+def test_block_waits_for_room(account, client):
+    threading.Timer(0.05, client.released.set).start()
+
+    assert account.put(job(4), "block", 5)
+
+    account.stop(timeout=5)
+    assert client.watched == [1, 2, 3, 4]
+
+
+def test_the_jobs_of_each_account_go_to_their_own_queue():
+    registry = TVTimeRegistry()
+    clients = [BlockingClient("alice"), BlockingClient("bob")]
+    for client in clients:
+        client.released.set()
+        registry.register(client)
+    dispatcher = ScrobbleDispatcher(registry, workers=1, batch=BatchSettings(linger=0))
+
+    assert dispatcher.submit(ScrobbleJob("alice", "show", 1, "Show"))
+    assert dispatcher.submit(ScrobbleJob("bob", "show", 2, "Show"))
+    assert not dispatcher.submit(ScrobbleJob("mallory", "show", 3, "Show"))
+    assert set(dispatcher.stats()) == {"alice", "bob"}
+    dispatcher.shutdown(timeout=5)
+
+    assert [client.watched for client in clients] == [[1], [2]]
+
+
+def test_an_unknown_policy_falls_back_to_reject():
+    assert ScrobbleDispatcher(TVTimeRegistry(), full_policy="wait").full_policy == "reject"
@@ -0,0 +1,122 @@
+"""
+Tests of the token bucket rate limiting the TVTime requests and the backfill.
+"""
+
+import asyncio
+import threading
+import types
+
+import pytest
+from utils import ratelimit
+from utils.ratelimit import TokenBucket
+
+
+class Clock:
+    """
+    A monotonic clock only moving when slept on.
+    """
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+        self.sleeps: list[float] = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    async def async_sleep(self, seconds: float) -> None:
+        self.sleep(seconds)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(
+        ratelimit, "time", types.SimpleNamespace(monotonic=fake.monotonic, sleep=fake.sleep)
+    )
+    monkeypatch.setattr(ratelimit, "asyncio", types.SimpleNamespace(sleep=fake.async_sleep))
+    return fake
+
+
+@pytest.mark.parametrize("rate", [0, -1])
+def test_a_rate_of_zero_or_less_is_unlimited(clock, rate):
+    bucket = TokenBucket(rate)
+
+    assert all(bucket.try_acquire() for _ in range(1000))
+    assert bucket.acquire(100)
+    assert bucket.available == float("inf")
+    assert bucket.stats() == {"rate": None}
+    assert not clock.sleeps
+
+
+def test_the_burst_defaults_to_a_second_of_tokens_and_at_least_one(clock):
+    assert TokenBucket(5).burst == 5
+    assert TokenBucket(0.1).burst == 1
+    assert TokenBucket(5, burst=0).burst == 1
+
+
+def test_try_acquire_refuses_once_the_burst_is_spent(clock):
+    bucket = TokenBucket(2, burst=3)
+
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+    clock.now += 0.5
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+
+def test_tokens_refill_up_to_the_burst(clock):
+    bucket = TokenBucket(10, burst=2)
+    bucket.try_acquire(2)
+    clock.now += 60
+
+    assert bucket.available == 2
+
+
+def test_acquire_waits_for_the_missing_tokens(clock):
+    bucket = TokenBucket(4, burst=1)
+    bucket.acquire()
+
+    assert bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.25)]
+    assert bucket.stats()["throttled"] == 1
+
+
+def test_acquire_gives_up_without_sleeping_past_the_timeout(clock):
+    bucket = TokenBucket(1, burst=1)
+    bucket.acquire()
+
+    assert not bucket.acquire(timeout=0.5)
+    assert not clock.sleeps
+    assert bucket.acquire(timeout=1)
+
+
+def test_wait_sleeps_asynchronously(clock):
+    bucket = TokenBucket(2, burst=1)
+
+    async def spend() -> None:
+        for _ in range(3):
+            await bucket.wait()
+
+    asyncio.run(spend())
+
+    assert clock.sleeps == [pytest.approx(0.5), pytest.approx(0.5)]
+
+
+def test_throttled_calls_are_counted_across_threads():
+    bucket = TokenBucket(1e-6, burst=1)
+
+    def spend() -> None:
+        for _ in range(2000):
+            bucket.acquire(timeout=0)
+
+    threads = [threading.Thread(target=spend) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Only the first call found a token
+    assert bucket.throttled == 8 * 2000 - 1
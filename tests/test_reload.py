@@ -0,0 +1,149 @@
+"""
+Tests of the reload of the configuration and of the users it adds, changes or removes.
+"""
+
+import os
+import threading
+import time
+
+import pytest
+import registry as registry_module
+from registry import TVTimeRegistry
+from scrobbler import BatchSettings, ScrobbleDispatcher, ScrobbleJob
+from utils.config import Config
+
+
+class FakeTVTime:
+    """
+    A TVTime client logging in unless its password is "wrong", recording its scrobbles.
+    """
+
+    def __init__(self, plex_user: str, tvtime_username: str, tvtime_password: str, **_) -> None:
+        self.user = plex_user
+        self.username = tvtime_username
+        self.password = tvtime_password
+        self.watched: list[int] = []
+        self.closed = threading.Event()
+
+    def login(self) -> None:
+        if self.password == "wrong":
+            raise RuntimeError("wrong password")
+
+    def watch_episode(self, episode_id: int) -> bool:
+        self.watched.append(episode_id)
+        return True
+
+    def close(self) -> None:
+        self.closed.set()
+
+
+def wait_for(condition, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def fake_tvtime(monkeypatch):
+    monkeypatch.setattr(registry_module, "TVTime", FakeTVTime)
+
+
+@pytest.fixture
+def config(tmp_path):
+    path = tmp_path / "config.yml"
+    path.write_text("logging:\n  level: INFO\n", encoding="utf-8")
+    loaded = Config(str(path))
+    loaded.load()
+    return loaded
+
+
+def rewrite(config: Config, content: str) -> None:
+    with open(config.config_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    # Tell the rewrite apart from the previous write on coarse file systems
+    stamp = time.time_ns() + 10**9
+    os.utime(config.config_path, ns=(stamp, stamp))
+
+
+def test_an_unchanged_file_is_not_reloaded(config):
+    assert not config.reload()
+    rewrite(config, "logging:\n  level: INFO\n")
+
+    assert not config.reload()
+
+
+def test_a_changed_file_is_reloaded(config):
+    rewrite(config, "logging:\n  level: DEBUG\n")
+
+    assert config.reload()
+    assert config.get_config_of("logging.level") == "DEBUG"
+
+
+def test_an_invalid_file_keeps_the_configuration(config):
+    rewrite(config, "logging: [\n")
+
+    assert not config.reload()
+    assert config.get_config_of("logging.level") == "INFO"
+
+
+def test_only_added_and_changed_users_log_in(fake_tvtime):
+    users = TVTimeRegistry()
+    users.sync([("Alice", "alice@example.com", "a"), ("Bob", "bob@example.com", "b")])
+    alice, bob = users.get("alice"), users.get("bob")
+
+    logged_in, removed, retired = users.sync(
+        [
+            ("Alice", "alice@example.com", "a"),
+            ("Bob", "bob@example.com", "new"),
+            ("Carol", "carol@example.com", "c"),
+        ]
+    )
+
+    assert sorted(logged_in) == ["bob", "carol"]
+    assert not removed
+    assert retired == [bob]
+    assert users.get("alice") is alice
+    assert users.get("bob").password == "new"
+
+
+def test_removed_users_are_unregistered(fake_tvtime):
+    users = TVTimeRegistry()
+    users.sync([("Alice", "alice@example.com", "a"), ("Bob", "bob@example.com", "b")])
+    bob = users.get("bob")
+
+    assert users.sync([("Alice", "alice@example.com", "a")]) == ([], ["bob"], [bob])
+    assert "bob" not in users
+
+
+def test_a_user_keeps_its_client_if_the_new_credentials_fail(fake_tvtime):
+    users = TVTimeRegistry()
+    users.sync([("Alice", "alice@example.com", "a")])
+    alice = users.get("alice")
+
+    logged_in, _, retired = users.sync([("Alice", "alice@example.com", "wrong")])
+
+    assert logged_in == ["alice"]
+    assert not retired
+    assert users.get("alice") is alice
+
+
+def test_the_dispatcher_follows_the_registry(fake_tvtime):
+    users = TVTimeRegistry()
+    users.sync([("Alice", "alice@example.com", "a"), ("Bob", "bob@example.com", "b")])
+    alice, bob = users.get("alice"), users.get("bob")
+    dispatcher = ScrobbleDispatcher(users, workers=1, batch=BatchSettings(linger=0))
+    dispatcher.submit(ScrobbleJob("alice", "show", 1, "Show"))
+    dispatcher.submit(ScrobbleJob("bob", "show", 2, "Show"))
+    wait_for(lambda: (alice.watched, bob.watched) == ([1], [2]))
+
+    _, _, retired = users.sync([("Alice", "alice@example.com", "new")])
+    dispatcher.sync(retired)
+    dispatcher.submit(ScrobbleJob("alice", "show", 3, "Show"))
+
+    # The replaced and removed clients are closed once their queues are drained
+    assert alice.closed.wait(5) and bob.closed.wait(5)
+    assert set(dispatcher.stats()) == {"alice"}
+    assert not dispatcher.submit(ScrobbleJob("bob", "show", 4, "Show"))
+    dispatcher.shutdown(timeout=5)
+    assert users.get("alice").watched == [3]
@@ -0,0 +1,119 @@
+"""
+Tests of the single login of an account whose token TVTime rejected.
+"""
+
+import asyncio
+import contextlib
+import os
+import sys
+
+import pytest
+from tvtime import ENDPOINTS, AsyncTVTime, TVTimeAuthError
+from utils.token_cache import TokenCache
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+from fake_tvtime import FakeTVTime, make_jwt  # noqa: E402 pylint: disable=wrong-import-position
+
+
+class BrokenBrowserPool:
+    """
+    A browser pool failing to start a browser, counting the attempts.
+    """
+
+    def __init__(self) -> None:
+        self.starts = 0
+
+    @contextlib.contextmanager
+    def driver(self):
+        self.starts += 1
+        raise OSError("no browser")
+        yield  # pylint: disable=unreachable
+
+
+@pytest.fixture
+def tvtime():
+    server = FakeTVTime(latency=0.01).start()
+    yield server
+    server.stop()
+
+
+def client_of(server: FakeTVTime, **options) -> AsyncTVTime:
+    client = AsyncTVTime(
+        "alice",
+        "alice@example.com",
+        "secret",
+        api_url=server.url,
+        auth_url=f"{server.url}/sidecar?o=https://auth.tvtime.com/v1",
+        rate_limits={endpoint: {"rate": 0} for endpoint in ENDPOINTS},
+        **options,
+    )
+    client._set_tokens(make_jwt(), "refresh", persist=False)  # pylint: disable=protected-access
+    return client
+
+
+def test_concurrent_rejected_requests_log_in_once(tvtime):
+    async def scenario() -> tuple:
+        client = client_of(tvtime)
+        await client.watch_episode(100)
+        tvtime.revoke_tokens()
+        results = await client.watch_episodes(list(range(1, 11)), max_workers=10)
+        await client.close()
+        return results, client
+
+    results, client = asyncio.run(scenario())
+
+    assert all(results.values())
+    assert client.relogins == 1
+    assert client.relogin_waits >= 1
+    assert tvtime.stats()["auth"] == 1
+
+
+def test_a_caller_whose_token_was_replaced_does_not_log_in(tvtime):
+    async def scenario() -> AsyncTVTime:
+        client = client_of(tvtime)
+        await client.relogin("an older token")
+        await client.close()
+        return client
+
+    client = asyncio.run(scenario())
+
+    assert client.relogins == 0
+    assert "auth" not in tvtime.stats()
+
+
+def test_a_token_another_replica_renewed_is_reused(tvtime, tmp_path):
+    cache = TokenCache(str(tmp_path / "tokens"))
+    renewed = make_jwt()
+
+    async def scenario() -> AsyncTVTime:
+        client = client_of(tvtime, token_cache=cache)
+        rejected = client.token
+        cache.save("alice", "alice@example.com", renewed, "renewed refresh")
+        await client.relogin(rejected)
+        await client.close()
+        return client
+
+    client = asyncio.run(scenario())
+
+    assert client.token == renewed
+    assert "auth" not in tvtime.stats()
+
+
+def test_every_waiter_fails_with_the_single_login(tvtime):
+    browsers = BrokenBrowserPool()
+
+    async def scenario() -> list:
+        client = client_of(tvtime, browser_pool=browsers)
+        # The refresh token is refused too
+        client.auth_url = f"{tvtime.url}/sidecar?o=https://auth.tvtime.com/unknown"
+        rejected = client.token
+        results = await asyncio.gather(
+            *(client.relogin(rejected) for _ in range(5)), return_exceptions=True
+        )
+        await client.close()
+        return results
+
+    results = asyncio.run(scenario())
+
+    assert all(isinstance(result, TVTimeAuthError) for result in results)
+    assert browsers.starts == 1
@@ -0,0 +1,148 @@
+"""
+Tests of the token cache and of the way an account renews its token.
+"""
+
+import asyncio
+import base64
+import os
+import stat
+import sys
+import time
+
+import pytest
+from tvtime import ENDPOINTS, AsyncTVTime, TVTimeAuthError
+from utils.state import SQLiteState
+from utils.token_cache import TokenCache, jwt_expiry
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+from fake_tvtime import FakeTVTime, make_jwt  # noqa: E402 pylint: disable=wrong-import-position
+
+
+class NoBrowserPool:
+    """
+    A browser pool failing to start a browser, so a full login fails.
+    """
+
+    def driver(self):
+        raise OSError("no browser")
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return TokenCache(str(tmp_path / "tokens"))
+
+
+@pytest.fixture
+def tvtime():
+    server = FakeTVTime(latency=0).start()
+    yield server
+    server.stop()
+
+
+def login(server: FakeTVTime, cache: TokenCache, auth_path: str = "/v1") -> AsyncTVTime:
+    async def scenario() -> AsyncTVTime:
+        client = AsyncTVTime(
+            "alice",
+            "alice@example.com",
+            "secret",
+            token_cache=cache,
+            api_url=server.url,
+            auth_url=f"{server.url}/sidecar?o=https://auth.tvtime.com{auth_path}",
+            browser_pool=NoBrowserPool(),
+            rate_limits={endpoint: {"rate": 0} for endpoint in ENDPOINTS},
+        )
+        try:
+            await client.login()
+        finally:
+            await client.close()
+        return client
+
+    return asyncio.run(scenario())
+
+
+def test_jwt_expiry():
+    assert jwt_expiry(make_jwt(3600)) == pytest.approx(time.time() + 3600, abs=5)
+
+
+@pytest.mark.parametrize(
+    "token",
+    ["", "not a jwt", "a.b.c", f"a.{base64.urlsafe_b64encode(b'[1]').decode()}.c", None],
+)
+def test_jwt_expiry_of_an_invalid_token(token):
+    assert jwt_expiry(token) is None
+
+
+def test_tokens_are_kept_by_the_owner_only(cache):
+    cache.save("alice", "alice@example.com", "token", "refresh")
+
+    assert cache.load("alice", "alice@example.com") == {
+        "username": "alice@example.com",
+        "token": "token",
+        "refresh_token": "refresh",
+    }
+    assert stat.S_IMODE(os.stat(cache.directory).st_mode) == 0o700
+    assert stat.S_IMODE(os.stat(cache._path("alice")).st_mode) == 0o600  # pylint: disable=W0212
+
+
+def test_tokens_of_another_account_are_ignored(cache):
+    cache.save("alice", "old@example.com", "token", "refresh")
+
+    assert cache.load("alice", "new@example.com") is None
+
+
+def test_an_unreadable_cache_is_ignored(cache):
+    with open(cache._path("alice"), "w", encoding="utf-8") as f:  # pylint: disable=W0212
+        f.write("{not json")
+
+    assert cache.load("alice", "alice@example.com") is None
+
+
+def test_deleted_tokens_are_gone(cache):
+    cache.save("alice", "alice@example.com", "token", "refresh")
+    cache.delete("alice")
+    cache.delete("alice")
+
+    assert cache.load("alice", "alice@example.com") is None
+
+
+def test_replicas_share_the_latest_tokens(tmp_path):
+    state = SQLiteState(str(tmp_path / "state.db"))
+    first = TokenCache(str(tmp_path / "first"), state)
+    second = TokenCache(str(tmp_path / "second"), state)
+    second.save("alice", "alice@example.com", "old", "refresh")
+
+    first.save("alice", "alice@example.com", "new", "refresh")
+
+    assert second.load("alice", "alice@example.com")["token"] == "new"
+    state.close()
+
+
+def test_a_valid_cached_token_is_reused(tvtime, cache):
+    token = make_jwt(3600)
+    cache.save("alice", "alice@example.com", token, "refresh")
+
+    client = login(tvtime, cache)
+
+    assert client.token == token
+    assert "auth" not in tvtime.stats()
+
+
+def test_an_expiring_token_is_refreshed(tvtime, cache):
+    token = make_jwt(60)
+    cache.save("alice", "alice@example.com", token, "refresh")
+
+    client = login(tvtime, cache)
+
+    assert client.token != token
+    assert not client.token_expires_soon()
+    assert tvtime.stats()["auth"] == 1
+    # The renewed tokens are cached for the next start
+    assert cache.load("alice", "alice@example.com")["token"] == client.token
+
+
+def test_a_refused_refresh_falls_back_to_a_full_login(tvtime, cache):
+    cache.save("alice", "alice@example.com", make_jwt(60), "refresh")
+
+    with pytest.raises(TVTimeAuthError, match="Selenium"):
+        login(tvtime, cache, auth_path="/unknown")
+    assert tvtime.stats()["unknown"] == 1
@@ -0,0 +1,82 @@
+"""
+Tests of the on-disk mirror of the watched episodes and movies.
+"""
+
+import json
+
+from utils.watched import WatchedSet
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "alice.json")
+    watched = WatchedSet(path, owner="alice@example.com")
+    assert watched.add_episodes([30, 10, 20, 10]) == 3
+    watched.add_movie("uuid-1")
+    watched.mark_synced()
+
+    restored = WatchedSet(path, owner="alice@example.com")
+
+    assert len(restored) == 4
+    assert all(restored.has_episode(i) for i in (10, 20, 30))
+    assert not restored.has_episode(15)
+    assert restored.has_movie("uuid-1")
+    assert restored.synced_at == watched.synced_at
+    assert restored.stats()["hits"] == 4
+
+
+def test_episodes_out_of_range_are_ignored():
+    watched = WatchedSet()
+
+    assert watched.add_episodes([-1, 2**32, "3", 0, 2**32 - 1]) == 2
+    assert watched.has_episode(0)
+    assert watched.has_episode(2**32 - 1)
+
+
+def test_changes_are_saved_every_flush_every(tmp_path):
+    path = tmp_path / "alice.json"
+    watched = WatchedSet(str(path), flush_every=3)
+    watched.add_episodes([1, 2])
+    assert not path.exists()
+
+    watched.add_movie("uuid-1")
+
+    assert WatchedSet(str(path)).has_episode(2)
+
+
+def test_a_mirror_of_another_account_is_discarded(tmp_path):
+    path = str(tmp_path / "alice.json")
+    watched = WatchedSet(path, owner="old@example.com")
+    watched.add_episodes([1])
+    watched.save()
+
+    assert len(WatchedSet(path, owner="new@example.com")) == 0
+
+
+def test_an_invalid_file_is_ignored(tmp_path):
+    path = tmp_path / "alice.json"
+    path.write_text(json.dumps({"episodes": "not base64!"}), encoding="utf-8")
+
+    assert len(WatchedSet(str(path))) == 0
+
+
+def test_saves_of_several_processes_are_merged(tmp_path):
+    path = str(tmp_path / "alice.json")
+    first, second = WatchedSet(path), WatchedSet(path)
+    first.add_episodes([1, 2])
+    first.add_movie("uuid-1")
+    first.save()
+    second.add_episodes([3])
+    second.add_movie("uuid-2")
+    second.save()
+
+    merged = WatchedSet(path)
+
+    assert all(merged.has_episode(i) for i in (1, 2, 3))
+    assert merged.has_movie("uuid-1") and merged.has_movie("uuid-2")
+
+
+def test_a_mirror_without_changes_is_not_saved(tmp_path):
+    path = tmp_path / "alice.json"
+    WatchedSet(str(path)).save()
+
+    assert not path.exists()